@@ -0,0 +1,121 @@
+"""Benchmark parsers of 1lou.me pages over saved html fixtures
+
+Save fixtures, a list page and score pages of its medias:
+
+    python scripts/bench_oneloume_parser.py save fixtures/ --url forum-1.htm --limit 20
+
+Run benchmark:
+
+    python scripts/bench_oneloume_parser.py run fixtures/ --repeat 20
+
+Small fixtures are saved in tests/fixtures/oneloume, which can be run without saving:
+
+    python scripts/bench_oneloume_parser.py run tests/fixtures/oneloume
+"""
+
+import argparse
+import dataclasses
+import glob
+import os
+import time
+
+from pytoys.crawler.oneloume import page, parser
+
+
+def save(args):
+    web = parser.Web1louMe()
+    os.makedirs(args.dir, exist_ok=True)
+    resp = web.client.get(args.url)
+    with open(os.path.join(args.dir, "list-0.htm"), "w", encoding="utf-8") as f:
+        f.write(resp.text)
+    media_list_page = page.MediaListPage.parse_from_html(resp.text)
+    for index, media in enumerate(media_list_page.medias[: args.limit]):
+        resp = web.client.get(media.url)
+        with open(os.path.join(args.dir, f"media-{index}.htm"), "w", encoding="utf-8") as f:
+            f.write(resp.text)
+    print(f"saved to {args.dir}")
+
+
+def _load(directory, prefix):
+    htmls = []
+    for path in sorted(glob.glob(os.path.join(directory, f"{prefix}-*.htm"))):
+        with open(path, "r", encoding="utf-8") as f:
+            htmls.append(f.read())
+    return htmls
+
+
+def _bench(name, func, htmls, repeat, expected=None):
+    results = [func(html) for html in htmls]
+    if expected is not None and results != expected:
+        print(f"{name:<30} results differ from baseline")
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for html in htmls:
+            func(html)
+    elapsed = (time.perf_counter() - start) / repeat / max(len(htmls), 1)
+    print(f"{name:<30} {elapsed * 1000:>10.3f} ms/page")
+    return results
+
+
+def _dump_list_page(media_list_page):
+    return (
+        [dataclasses.astuple(media) for media in media_list_page.medias],
+        [dataclasses.astuple(pagination) for pagination in media_list_page.paginations],
+    )
+
+
+def run(args):
+    parsers = ["html.parser"] + (["lxml"] if page.DEFAULT_PARSER == "lxml" else [])
+    list_pages = _load(args.dir, "list")
+    print(f"list pages: {len(list_pages)}")
+    expected = _bench(
+        "html.parser (full tree)",
+        lambda html: _dump_list_page(
+            page.MediaListPage.parse_from_html(html, parser="html.parser", strain=False)
+        ),
+        list_pages,
+        args.repeat,
+    )
+    for name in parsers:
+        _bench(
+            f"{name} (strained)",
+            lambda html, name=name: _dump_list_page(
+                page.MediaListPage.parse_from_html(html, parser=name)
+            ),
+            list_pages,
+            args.repeat,
+            expected=expected,
+        )
+
+    media_pages = _load(args.dir, "media")
+    print(f"media pages: {len(media_pages)}")
+    expected = None
+    for name in parsers + [page.REGEX_PARSER]:
+        results = _bench(
+            name,
+            lambda html, name=name: vars(page.MediaPage.parse_from_html(html, parser=name)),
+            media_pages,
+            args.repeat,
+            expected=expected,
+        )
+        expected = expected or results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = arg_parser.add_subparsers(required=True)
+    save_parser = subparsers.add_parser("save", help="save fixtures from 1lou.me")
+    save_parser.add_argument("dir")
+    save_parser.add_argument("--url", default="/")
+    save_parser.add_argument("--limit", type=int, default=20, help="max score pages to save")
+    save_parser.set_defaults(func=save)
+    run_parser = subparsers.add_parser("run", help="run benchmark over fixtures")
+    run_parser.add_argument("dir")
+    run_parser.add_argument("--repeat", type=int, default=10)
+    run_parser.set_defaults(func=run)
+    args = arg_parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
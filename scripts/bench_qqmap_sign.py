@@ -0,0 +1,59 @@
+"""Benchmark signing of 腾讯位置服务 requests, the legacy signing, RequestSigner without and
+with cache
+
+Run benchmark:
+
+    python scripts/bench_qqmap_sign.py --number 100000 --distinct 200
+"""
+
+import argparse
+import hashlib
+import time
+from urllib import parse
+
+from pytoys.openapi import qqmap
+
+PATH = "/ws/weather/v1"
+
+
+def legacy_sign(key, secret, path, params):
+    """Signing before RequestSigner, params are copied, sorted and encoded for every call"""
+    params = {k: v if isinstance(v, list) else [v] for k, v in params.items()}
+    params["key"] = [key]
+    sorted_params = {k: params[k] for k in sorted(params)}
+    query = parse.urlencode(sorted_params, doseq=True)
+    sig = hashlib.md5(f"{path}?{query}{secret}".encode("utf-8")).hexdigest()
+    sorted_params["sig"] = [sig]
+    return sorted_params
+
+
+def _bench(name, func, params_list, number):
+    start = time.perf_counter()
+    for i in range(number):
+        func(params_list[i % len(params_list)])
+    elapsed = time.perf_counter() - start
+    print(f"{name:<20} {elapsed / number * 1e6:>8.2f} us/call {number / elapsed:>12,.0f} calls/s")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--number", type=int, default=100000, help="calls of each case")
+    arg_parser.add_argument("--distinct", type=int, default=200, help="distinct params")
+    args = arg_parser.parse_args()
+
+    key, secret = "RKABZ-DCAEB-5VPUG-N4XPP-HGE4K-VXBL6", "gB38imb0E05bQV8f4aYA2uQVHFfYUFbR"
+    params_list = [{"adcode": 110000 + i, "type": "now"} for i in range(args.distinct)]
+    signer = qqmap.RequestSigner(key, secret)
+    uncached = qqmap.RequestSigner(key, secret, cache_size=0)
+    _bench("legacy", lambda params: legacy_sign(key, secret, PATH, params), params_list,
+           args.number)                                                                 # fmt: skip
+    _bench("uncached", lambda params: uncached.sign(PATH, params), params_list, args.number)
+    _bench("cached", lambda params: signer.sign(PATH, params), params_list, args.number)
+    start = time.perf_counter()
+    signer.sign_many(PATH, params_list * (args.number // len(params_list)))
+    elapsed = time.perf_counter() - start
+    print(f"{'sign_many':<20} {elapsed / args.number * 1e6:>8.2f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,22 @@ import functools
 
 import click
 
-from pytoys.common import logging
+from pytoys.common import blobstore, cache, httpclient, logging
 
 @click.group()
 @click.help_option("-h", "--help")
 @click.option("--logfile", help="log file")
 @click.option("--debug", "-d", is_flag=True, help="debug")
-def cli(debug=False, logfile=None):
+@click.option("--http-cache", is_flag=True, help="缓存HTTP响应到本地, 重复查询时不再访问网络")
+@click.option("--blob-store", is_flag=True,
+              help="下载的文件按内容保存一份, 已下载过的文件直接链接到输出目录")  # fmt: skip
+def cli(debug=False, logfile=None, http_cache=False, blob_store=False):
     """Pytoys tools"""
     logging.setup_logger(level="DEBUG" if debug else "INFO", file=logfile)
+    if http_cache:
+        httpclient.set_default_cache(cache.HttpCache())
+    if blob_store:
+        httpclient.set_default_store(blobstore.BlobStore())
 
 
 def click_command_with_help(func):
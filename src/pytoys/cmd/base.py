@@ -1,9 +1,13 @@
+import asyncio
+import dataclasses
 import functools
-import re
+import struct
 import subprocess
 import sys
+import time
 from concurrent import futures
-from typing import Optional
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
 from urllib import parse
 import pathlib
 from urllib import parse
@@ -14,11 +18,12 @@ import yaml
 from loguru import logger
 from termcolor import colored, cprint
 
-from pytoys.common import command, httpclient, table
+from pytoys.common import batch, benchmark, cache, command, httpclient, ratelimit, sink, table
+from pytoys.crawler.oneloume.index import MediaIndex
 from pytoys.crawler.oneloume.parser import Web1louMe
 from pytoys.github import proxy
-from pytoys.net import ipinfo, location, utils
-from pytoys.net import weather as weather_server
+from pytoys.github import stats as proxy_stats
+from pytoys.net import bulkweather, ipdb, ipinfo, location, locator, utils
 from pytoys.openapi import bingimage, qqmap
 from pytoys.pip import repos
 from pytoys.vscode import extension as vscode_extension
@@ -73,6 +78,57 @@ def download_extension(name, output=None):
         return 1
 
 
+@vscode.command("bulk-download")
+@click.argument("ids", nargs=-1)
+@click.option("-f", "--file", "manifests", multiple=True,
+              type=click.Path(exists=True, dir_okay=False),
+              help="插件列表文件, 每行一个 publisher.name[@version], 或VSCode的extensions.json")  # fmt: skip
+@click.option("-o", "--output", type=click.Path(file_okay=False), default=".", help="保存目录")
+@click.option("-c", "--concurrency", type=click.IntRange(min=1), default=4,
+              help="并发下载数, 默认: 4")                                                # fmt: skip
+@click.option("--target-platform", help="平台, 例如: linux-x64, win32-x64, darwin-arm64")
+@click.option("--pre-release", is_flag=True, help="未指定版本时允许使用预发布版本")
+@click.option("--no-deps", is_flag=True, help="不下载扩展包包含的插件和依赖的插件")
+@click.option("--no-progress", is_flag=True, help="不显示下载进度")
+def bulk_download(ids, manifests=(), output=".", concurrency=4, target_platform=None,
+                  pre_release=False, no_deps=False, no_progress=False):                 # fmt: skip
+    """批量下载插件及其依赖
+
+    IDS: 插件, 格式: publisher.name[@version]
+
+    \b
+    例如:
+        pytoys vscode bulk-download ms-python.python ms-vscode.cpptools@1.20.5 \\
+            --target-platform linux-x64 -o vsix
+    """
+    ext_ids = list(ids)
+    for manifest in manifests:
+        try:
+            ext_ids.extend(vscode_extension.read_manifest(manifest))
+        except (OSError, ValueError) as e:
+            logger.error("read manifest {} failed: {}", manifest, e)
+            return 1
+    if not ext_ids:
+        logger.error("no extension given")
+        return 1
+    api = vscode_extension.MarketplaceAPI()
+    try:
+        results = api.bulk_download(ext_ids, output, concurrency=concurrency,
+                                    target_platform=target_platform, pre_release=pre_release,
+                                    expand=not no_deps, progress=not no_progress)       # fmt: skip
+    except (httpclient.HttpError, httpclient.RequestError, ValueError) as e:
+        logger.error("resolve extensions failed: {}", e)
+        return 1
+    dt = table.DataTable(["id", "version", "required_by", "status", "file", "error"])
+    dt.set_style(table.TableStyle.SINGLE_BORDER)
+    dt.align = "l"
+    dt.add_items([dataclasses.asdict(result) for result in results])
+    click.echo(dt)
+    failures = [result for result in results if not result.ok]
+    logger.info("{} extension(s) ready, {} failed", len(results) - len(failures), len(failures))
+    return 1 if failures else 0
+
+
 @cli.group()
 def github():
     """Github tools"""
@@ -80,10 +136,16 @@ def github():
 
 @github.command()
 @click.argument("url")
-def proxy_download(url):
+@click.option("-n", "--segments", type=click.IntRange(min=1), default=4,
+              help="服务器支持分段下载时的并发连接数, 默认: 4")                            # fmt: skip
+@click.option("--race", is_flag=True, help="同时探测所有代理, 使用最快的代理下载")
+@click.option("--min-speed", type=click.FloatRange(min=0, min_open=True),
+              help="与--race一起使用, 下载速度低于该值(KB/s)时切换到下一个代理")             # fmt: skip
+def proxy_download(url, segments=4, race=False, min_speed: Optional[float] = None):
     """下载github资源"""
     try:
-        proxy.download(url)
+        proxy.download(url, segments=segments, race_mode=race,
+                       min_speed=min_speed * 1024 if min_speed else None)          # fmt: skip
         logger.success("download {} success", url)
         return 0
     except proxy.AllProxyDownloadFailed as e:
@@ -91,6 +153,35 @@ def proxy_download(url):
         return 1
 
 
+@github.command("proxy-stats")
+@click.option("--reset", is_flag=True, help="清空统计数据")
+def proxy_stats_cmd(reset=False):
+    """查看代理的延迟、速度和失败统计"""
+    stats = proxy_stats.ProxyStats()
+    if reset:
+        stats.reset()
+        logger.success("proxy stats reset")
+        return 0
+    dt = table.DataTable(
+        ["mirror", "latency", "throughput", "successes", "failures", "failure_rate", "score",
+         "updated"],
+        title={"latency": "latency(ms)", "throughput": "throughput(KB/s)",
+               "score": "score(s/MB)"},
+    )                                                                              # fmt: skip
+    dt.set_style(table.TableStyle.SINGLE_BORDER)
+    dt.set_align({"mirror": "l"})
+    prior = stats.get_prior()
+    dt.add_items([
+        {**dataclasses.asdict(stat),
+         "latency": f"{stat.latency * 1000:.0f}", "throughput": f"{stat.throughput / 1024:.0f}",
+         "failure_rate": f"{stat.failure_rate:.2f}", "score": f"{stat.get_score(prior):.2f}",
+         "updated": datetime.fromtimestamp(stat.updated).strftime("%Y-%m-%d %H:%M:%S")}
+        for stat in stats.list()
+    ])                                                                             # fmt: skip
+    print(dt)
+    return 0
+
+
 @cli.group()
 def local():
     """Local tools"""
@@ -99,7 +190,10 @@ def local():
 @local.command()
 @click.option("--detail", is_flag=True, help="显示详情")
 @click.option("--ip", type=custome_types.TYPE_IPV4, help="指定IP地址")
-def info(detail=False, ip=None):
+@click.option("--quorum", type=click.IntRange(min=1), default=1,
+              help="公网IP需要相同结果的服务数, 不超过服务总数")                         # fmt: skip
+@click.option("--no-cache", is_flag=True, help="不使用缓存的公网IP")
+def info(detail=False, ip=None, quorum: int = 1, no_cache=False):
     """Get Local info"""
     local_info = {}
     if ip:
@@ -109,10 +203,21 @@ def info(detail=False, ip=None):
             return 1
         local_info["ip"] = ip
     else:
-        local_info["ip"] = ipinfo.get_public_api()
+        try:
+            local_info["ip"] = ipinfo.get_public_api(
+                quorum=quorum, public_ip_cache=None if no_cache else ipinfo.PublicIPCache()
+            )
+        except IOError as e:
+            logger.error("get public ip failed: {}", e)
+            return 1
     try:
-        ip_location = location.Location()
-        for api in [location.IP77Api(), location.UUToolApi()]:
+        ip_database = ipdb.open_default()
+        ip_location = ip_database.lookup(local_info["ip"]) if ip_database else None
+    except (ValueError, struct.error) as e:
+        logger.error("{}, 请运行 import-ipdb 重新导入IP库", e)
+        return 1
+    try:
+        for api in [] if ip_location else [location.IP77Api(), location.UUToolApi()]:
             ip_location = api.get_location(local_info.get("ip"))
             break
         if not detail:
@@ -130,11 +235,89 @@ def info(detail=False, ip=None):
 
 
 @local.command()
-@click.option("--city", help="指定城市(省,市,县|区),例如:北京市,东城区")
-def weather(city: Optional[str] = None):
-    """Get weather"""
-    api = weather_server.HefengWeatherApi()
-    if not city:
+@click.option("-f", "--file", "ip_file", type=click.File("r", encoding="utf-8"), default="-",
+              help="IP列表或访问日志文件(取每行第一个IPv4地址), 默认读取标准输入")        # fmt: skip
+@click.option("-c", "--concurrency", type=click.IntRange(min=1), default=8, help="并发数")
+@click.option("--collapse", is_flag=True, help="同一 /24 网段只查询一次")
+@click.option("--no-cache", is_flag=True, help="不使用缓存")
+@click.option("-o", "--output", help="导出到文件, 格式按后缀: .jsonl, .csv, .db(SQLite)")
+@click.option("--ipdb", "ipdb_file", type=click.Path(exists=True, dir_okay=False),
+              help="离线IP库, 默认使用 import-ipdb 导入的IP库")                           # fmt: skip
+@click.option("--offline", is_flag=True, help="只查询离线IP库和缓存")
+def locate(ip_file, concurrency: int = 8, collapse=False, no_cache=False,
+           output: Optional[str] = None, ipdb_file: Optional[str] = None,
+           offline=False):                                                              # fmt: skip
+    """Locate IPs in bulk
+
+    \b
+    Example:
+        awk '{print $1}' access.log | pytoys local locate --collapse
+        pytoys local locate -f access.log -o locations.csv
+    """
+    try:
+        ip_database = ipdb.IPDatabase(ipdb_file) if ipdb_file else ipdb.open_default()
+    except ValueError as e:
+        logger.error("{}, 请运行 import-ipdb 重新导入IP库", e)
+        return 1
+    bulk_locator = locator.BulkLocator(location_cache=None if no_cache else locator.LocationCache(),
+                                       concurrency=concurrency, collapse=collapse,
+                                       ip_database=ip_database,
+                                       apis=[] if offline else None)                    # fmt: skip
+    locations = bulk_locator.locate(locator.read_ips(ip_file))
+    fields = ["ip", "country", "province", "city", "isp", "location"]
+    if output:
+        with sink.open_sink(output, fields, table="locations") as out:
+            for ip_location in locations:
+                out.write(ip_location)
+        logger.info("saved {} location(s) to {}", out.count, output)
+        return
+    dt = table.StreamTable(fields, index=True)
+    dt.set_style(table.TableStyle.SINGLE_BORDER)
+    dt.print(locations)
+
+
+@local.command("import-ipdb")
+@click.option("-o", "--output", help="IP库文件, 默认保存到缓存目录, locate 命令会自动使用")
+@click.argument("csv_file", type=click.Path(exists=True, dir_okay=False))
+def import_ipdb(csv_file: str, output: Optional[str] = None):
+    """Import offline IP database from CSV
+
+    \b
+    CSV 需要包含表头, IP段由 network(CIDR) 列或 start,end 列(IP或整数)指定,
+    其他列按 Location 字段名导入, 例如: country,province,city,isp
+    """
+    start = time.monotonic()
+    try:
+        header = ipdb.build(csv_file, output=output)
+    except ValueError as e:
+        logger.error("import failed: {}", e)
+        return 1
+    logger.info("imported {} range(s), {} location(s), {} string(s) in {:.1f}s",
+                header["count"], header["records"], len(header["strings"]),
+                time.monotonic() - start)                                               # fmt: skip
+
+
+@local.command()
+@click.option("--city", multiple=True,
+              help="指定城市(省,市,县|区),例如:北京市,东城区, 可以指定多个")                # fmt: skip
+@click.option("-f", "--file", "city_file", type=click.File("r", encoding="utf-8"),
+              help="城市列表文件, 每行一个城市")                                         # fmt: skip
+@click.option("-c", "--concurrency", type=click.IntRange(min=1), default=8, help="并发数")
+@click.option("--ttl", type=int, default=bulkweather.DEFAULT_WEATHER_TTL,
+              help="天气缓存时间(秒), 0表示不缓存")                                       # fmt: skip
+@click.option("-o", "--output", help="导出到文件, 格式按后缀: .jsonl, .csv, .db(SQLite)")
+def weather(city: Tuple[str, ...] = (), city_file=None, concurrency: int = 8,
+            ttl: int = bulkweather.DEFAULT_WEATHER_TTL, output: Optional[str] = None):  # fmt: skip
+    """Get weather
+
+    \b
+    Example:
+        pytoys local weather --city 北京市,东城区
+        pytoys local weather --city 杭州 --city 上海 -o weathers.csv
+        pytoys local weather -f cities.txt
+    """
+    cities = list(city) + (city_file.read().splitlines() if city_file else [])
+    if not cities:
         qq_api = qqmap.QQMapAPIs()
         logger.debug("get my location")
         my_location = qq_api.get_location()
@@ -142,22 +325,122 @@ def weather(city: Optional[str] = None):
         print(data.format())
         return
 
-    values = re.split(r",|，", city)
-    if not values:
-        raise ValueError("invalid city")
-    if len(values) == 1:
-        adm, location_name = None, values[0]
+    bulk_weather = bulkweather.BulkWeather(
+        city_cache=locator.LocationCache(cache.get_cache_dir("cities.db"),
+                                         ttl=bulkweather.CITY_CACHE_TTL),              # fmt: skip
+        weather_cache=bulkweather.WeatherCache(ttl=ttl) if ttl > 0 else None,
+        concurrency=concurrency,
+    )
+    if len(cities) == 1 and not output:
+        result = bulk_weather.get_weather(cities[0])
+        if not result.weather:
+            return 1
+        print(result.weather.format())
+        return
+
+    start = time.monotonic()
+    results = (result.to_dict() for result in bulk_weather.query(cities))
+    if output:
+        with sink.open_sink(output, bulkweather.ROW_FIELDS, table="weathers") as out:
+            for result in results:
+                out.write(result)
+        logger.info("saved {} weather(s) to {}", out.count, output)
     else:
-        adm, location_name = values[0], values[1]
-    logger.debug("lookup city {}", city)
+        dt = table.StreamTable(bulkweather.ROW_FIELDS, index=True,
+                               title={"temperature": "temp", "winddirection": "wind",
+                                      "windpower": "power", "humidity": "hum",
+                                      "reporttime": "updated"})                        # fmt: skip
+        dt.set_style(table.TableStyle.SINGLE_BORDER)
+        dt.set_align({"city": "l", "location": "l", "error": "l"})
+        dt.print(results)
+    logger.info("queried {} city(s) in {:.1f}s", len(cities), time.monotonic() - start)
+
+
+def _print_response(resp: requests.Response):
+    print(colored(f"{resp.status_code} {resp.reason}",
+                  "red" if 400 <= resp.status_code < 600 else "green"))           # fmt: skip
+    print()
+
+    for k, v in resp.headers.items():
+        print(colored(k, "blue"), ":", v)
+    print()
+
+    cprint("Body:", "blue")
+    print(resp.content.decode() if resp.content else "")
+    # print()
+    print(colored(f"Elapsed: {resp.elapsed.total_seconds()}s)", "grey"))
+
+
+def _print_result(result: batch.Result):
+    req = result.request
+    cprint(f"========== {req.method} {req.url} ==========", "cyan")
+    if isinstance(result.error, requests.exceptions.InvalidSchema):
+        cprint("ERROR: invalid url", "red")
+    elif result.error:
+        cprint(f"ERROR: request faield: {result.error}", "red")
+    else:
+        _print_response(result.response)
+
+
+def _print_summary(summary: batch.Summary):
+    cprint("========== Summary ==========", "cyan")
+    print(f"Total: {summary.total}, Success: {colored(summary.success, 'green')}, "
+          f"Failed: {colored(summary.failed, 'red' if summary.failed else 'green')}, "
+          f"Elapsed: {summary.elapsed:.3f}s")                                       # fmt: skip
+    for result in summary.failures:
+        reason = result.error or f"{result.response.status_code} {result.response.reason}"
+        print(colored(f"  #{result.index + 1} {result.request.method} {result.request.url}",
+                      "red"), f": {reason}")                                        # fmt: skip
+
+
+def _load_requests(url: str, params: Optional[str] = None, method: str = "GET",
+                   header: Optional[dict] = None,
+                   timeout: Optional[int] = None) -> List[httpclient.Request]:      # fmt: skip
+    if url.startswith('@'):
+        file = url.lstrip('@')
+        if not pathlib.Path(file).is_file():
+            raise click.UsageError(f'file "{file}" not exists')
+        with open(file, "r", encoding="utf-8") as f:
+            data = yaml.safe_load(f)
+        return [httpclient.Request.load_from_dict(req) for req in data or []]
+
+    if not url.startswith('http://') and not url.startswith('https://'):
+        raise click.UsageError(
+            f'url "{url}" invalid (use http(s)://{url}), or do you want a file? (use @{url}))')
+
+    return [
+        httpclient.Request(
+            url=url, method=method, params=parse.parse_qs(params or ""),
+            headers=functools.reduce(lambda x, y: x | y, header or [], {}),
+            timeout=timeout)                                             # fmt: skip
+    ]
+
+
+def _run_batch(reqs: List[httpclient.Request], concurrency: int = 1,
+               host_limit: Optional[int] = None, ordered=True):                     # fmt: skip
+    runner = batch.BatchRunner(concurrency=concurrency, host_limit=host_limit)
+    summary = batch.Summary()
+    start = time.monotonic()
     try:
-        locations = api.lookup_city(location_name, adm=adm)
-    except (httpclient.HttpError, httpclient.RequestError) as e:
-        logger.error("lookup city failed: {}", e)
-        return 1
-    my_location = locations[0]
-    data = api.get_weather(my_location)
-    print(data.format())
+        for result in runner.run(reqs, ordered=ordered):
+            _print_result(result)
+            summary.add(result)
+    finally:
+        runner.close()
+    summary.elapsed = time.monotonic() - start
+    if len(reqs) > 1:
+        _print_summary(summary)
+
+
+def _bench(reqs: List[httpclient.Request], concurrency: Optional[int] = None,
+           rate: Optional[float] = None, duration: Optional[float] = None,
+           count: Optional[int] = None, warmup: float = 0):                             # fmt: skip
+    if not duration and not count:
+        raise click.UsageError("--duration or --count is required with --bench")
+    load_runner = benchmark.LoadRunner(reqs, concurrency=concurrency, rate=rate,
+                                       duration=duration, count=count, warmup=warmup)  # fmt: skip
+    logger.info("benchmark started")
+    print(load_runner.run().format())
 
 
 @click_command_with_help
@@ -166,9 +449,24 @@ def weather(city: Optional[str] = None):
 @click.option("-P", "--params", help="HTTP params, e.g. 'key1=value1&key2=value2'")
 @click.option("-H", '--header', multiple=True, type=custome_types.TYPE_HEADER,
               help="HTTP headers e.g. 'content-type=application/json")              # fmt: skip
+@click.option("-c", "--concurrency", type=click.IntRange(min=1),
+              help="并发请求数, 默认: 1, 指定 --rate 时按速率估算")                      # fmt: skip
+@click.option("--host-limit", type=click.IntRange(min=1), help="单个主机的最大并发请求数")
+@click.option("--unordered", is_flag=True, help="按完成顺序输出结果")
+@click.option("--bench", is_flag=True, help="压测模式, 循环发送请求并输出统计报告")
+@click.option("--rate", type=click.FloatRange(min=0, min_open=True),
+              help="压测模式: 每秒请求数, 不指定时按并发数发送")                        # fmt: skip
+@click.option("--duration", type=click.FloatRange(min=0, min_open=True),
+              help="压测模式: 持续时间(秒)")                                          # fmt: skip
+@click.option("-n", "--count", type=click.IntRange(min=1), help="压测模式: 请求总数")
+@click.option("--warmup", type=click.FloatRange(min=0), default=0,
+              help="压测模式: 预热时间(秒), 预热期间的请求不计入报告")                   # fmt: skip
 @click.argument("url", default=None)
 def curl(url: str, params: Optional[str] = None, method: str = "GET",
-         header: Optional[dict] = None, timeout: Optional[int] = None):                 # fmt: skip
+         header: Optional[dict] = None, timeout: Optional[int] = None,
+         concurrency: Optional[int] = None, host_limit: Optional[int] = None, unordered=False,
+         bench=False, rate: Optional[float] = None, duration: Optional[float] = None,
+         count: Optional[int] = None, warmup: float = 0):                               # fmt: skip
     """curl command
 
     \b
@@ -177,48 +475,18 @@ def curl(url: str, params: Optional[str] = None, method: str = "GET",
     Example:
         curl http://www.example.com
         curl @requets.yaml
+        curl -c 10 --host-limit 2 @requets.yaml
+        curl --bench -c 10 --duration 30 --warmup 5 http://127.0.0.1:8080
+        curl --bench --rate 100 -n 1000 @requets.yaml
     """
-    if url.startswith('@'):
-        file = url.lstrip('@')
-        if not pathlib.Path(file).is_file():
-            raise click.UsageError(f'file "{file}" not exists')
-        with open(file, "r", encoding="utf-8") as f:
-            data = yaml.safe_load(f)
-        reqs = [httpclient.Request.load_from_dict(req) for req in data or []]
-    else:
-        if not url.startswith('http://') or not url.startswith('https://'):
-            raise click.UsageError(
-                f'url "{url}" invalid (use http(s)://{url}), or do you want a file? (use @{url}))')
-
-        reqs = [
-            httpclient.Request(
-                url=url, method=method, params=parse.parse_qs(params or ""),
-                headers=functools.reduce(lambda x, y: x | y, header or [], {}),
-                timeout=timeout)                                         # fmt: skip
-        ]
-    for req in reqs:
-        cprint(f"========== {req.method} {req.url} ==========", "cyan")
-        try:
-            resp = httpclient.request(req)
-        except requests.exceptions.InvalidSchema:
-            cprint("ERROR: invalid url", "red")
-            continue
-        except (requests.exceptions.SSLError, requests.Timeout, requests.ConnectionError) as e:
-            cprint(f"ERROR: request faield: {e}", "red")
-            continue
-
-        print(colored(f"{resp.status_code} {resp.reason}",
-                      "red" if 400 <= resp.status_code < 600 else "green"))       # fmt: skip
-        print()
-
-        for k, v in resp.headers.items():
-            print(colored(k, "blue"), ":", v)
-        print()
-
-        cprint("Body:", "blue")
-        print(resp.content.decode() if resp.content else "")
-        # print()
-        print(colored(f"Elapsed: {resp.elapsed.total_seconds()}s)", "grey"))
+    reqs = _load_requests(url, params=params, method=method, header=header, timeout=timeout)
+
+    if bench:
+        _bench(reqs, concurrency=concurrency, rate=rate, duration=duration, count=count,
+               warmup=warmup)                                                       # fmt: skip
+        return
+    _run_batch(reqs, concurrency=concurrency or 1, host_limit=host_limit, ordered=not unordered)
+
 
 @cli.group()
 def crawler():
@@ -229,34 +497,113 @@ def crawler():
 @click.option("--no-progress", is_flag=True, help="No progress")
 @click.option("--date", help="指定年份,格式: YYYY 或 YYYY-MM-DD")
 @click.option("--timeout", type=int, default=60 * 5, help="指定timeout")
+@click.option("--async-io", is_flag=True, help="使用asyncio并发下载(需要安装aiohttp)")
+@click.option("-o", "--output",
+              help="导出下载成功的壁纸信息, 格式按后缀: .jsonl, .csv, .db(SQLite), '-' 为标准输出")  # fmt: skip
 def bing_image(date: Optional[str] = None, timeout: Optional[int] = None,
-                   no_progress: bool=False):                                    # fmt: skip
+                   no_progress: bool=False, async_io: bool=False,
+                   output: Optional[str] = None):                               # fmt: skip
     """爬取 https://bing.npanuhin.me/ 壁纸"""
 
     api = bingimage.BingNpanuhinAPI(timeout=timeout)
     logger.info("get images")
     try:
         images = api.get_bing_images(date=date)
-    except (httpclient.HttpError, httpclient.RequestError) as e:
+    except (httpclient.HttpError, httpclient.RequestError, ValueError) as e:
         logger.error("get images failed: {}", e)
         return 1
     if not images:
         logger.warning("no images found")
         return 1
 
+    out = sink.open_sink(output, sink.get_fields(images[0]), table="images") if output else None
+
     def _download(image: bingimage.BingImage):
         logger.debug("download image: {}", image.filename())
         try:
             api.download_image(image, progress=not no_progress)
         except (httpclient.HttpError, httpclient.RequestError) as e:
             logger.error("download image {} failed: {}", image.filename(), e)
+            return
+        if out:
+            out.write(image)
 
     logger.info("download {} image(s)", len(images))
-    with futures.ThreadPoolExecutor() as executor:
-        executor.map(_download, images)
+    try:
+        if async_io:
+            errors = asyncio.run(api.download_images_async(images, progress=not no_progress))
+            for image, error in zip(images, errors):
+                if error:
+                    logger.error("download image {} failed: {}", image.filename(), error)
+                elif out:
+                    out.write(image)
+        else:
+            with futures.ThreadPoolExecutor() as executor:
+                executor.map(_download, images)
+    finally:
+        if out:
+            out.close()
     logger.info("download completed")
 
 
+@crawler.command()
+@click.option("--start", required=True, help="开始日期, 格式: YYYY-MM-DD")
+@click.option("--end", help="结束日期, 格式: YYYY-MM-DD, 默认今天")
+@click.option("-m", "--market", multiple=True, default=["CN/zh"], show_default=True,
+              help="地区/语言, 可以指定多个, 例如: US/en")                               # fmt: skip
+@click.option("-d", "--dir", "output_dir", default=".", help="保存目录")
+@click.option("-c", "--concurrency", type=click.IntRange(min=1), default=4, help="并发下载数")
+@click.option("--verify", is_flag=True, help="校验已下载文件的sha256")
+@click.option("--timeout", type=int, default=60 * 5, help="指定timeout")
+@click.option("--no-progress", is_flag=True, help="No progress")
+def bing_sync(start: str, end: Optional[str] = None, market: Tuple[str, ...] = ("CN/zh",),
+              output_dir: str = ".", concurrency: int = 4, verify=False,
+              timeout: Optional[int] = None, no_progress=False):                        # fmt: skip
+    """同步 https://bing.npanuhin.me/ 壁纸, 只下载目录中没有的壁纸
+
+    \b
+    Example:
+        pytoys crawler bing-sync --start 2020-01-01 -m CN/zh -m US/en -d wallpapers
+    """
+    end = end or datetime.now().strftime("%Y-%m-%d")
+    api = bingimage.BingNpanuhinAPI(timeout=timeout)
+    try:
+        index = api.get_index(list(market), start, end)
+        # end may be a month, e.g. 2024-01
+        images = [image for _, image in index.between(start, f"{end}\uffff")]
+    except (httpclient.RequestError, ValueError) as e:
+        logger.error("get images failed: {}", e)
+        return 1
+    logger.info("found {} image(s) from {} to {}", len(images), start, end)
+    syncer = bingimage.BingSync(api, output_dir, concurrency=concurrency, verify=verify)
+    downloaded, failures = syncer.sync(images, progress=not no_progress)
+    logger.info("downloaded {} image(s), {} failed", len(downloaded), len(failures))
+    return 1 if failures else 0
+
+
+ONELOUME_MODELS = {
+    '首页': '/',
+    '电影': 'forum-1.htm',
+    '剧集': 'forum-2.htm',
+}
+
+
+def _export_medias(videos: Iterable, out: sink.Sink, output: str):
+    for video in videos:
+        out.write(video)
+    out.flush()
+    logger.info("导出 {} 条到 {}", out.count, output)
+
+
+def _print_medias(videos: Iterable, fields: List[str]):
+    dt = table.StreamTable(fields, title={"score_imdb": "IMDB", "score_douban": "豆瓣"},
+                           index=True)                                              # fmt: skip
+    dt.set_style(table.TableStyle.SINGLE_BORDER)
+    dt.set_align({"source": "l", "name": "l", "size": "r", "url": "l", "location": "l"})
+    # 分页打印
+    dt.print(videos)
+
+
 @crawler.command()
 # @click.option("-e", "--exclude", multiple=True, help="按关键字排除")
 @click.option("--max-page", type=int, default=1, help="指定最多查询页数")
@@ -265,40 +612,56 @@ def bing_image(date: Optional[str] = None, timeout: Optional[int] = None,
 @click.option("-y", "--year", help="指定年份,格式: 'YYYY' 或 '更早'")
 @click.option("-s", "--score", is_flag=True, help="查询评分")
 @click.option("--model", default='首页', help="抓取模块")
+@click.option("--async-io", is_flag=True, help="使用asyncio查询评分(需要安装aiohttp)")
+@click.option("--parser", type=click.Choice(["lxml", "html.parser"]),
+              help="HTML解析器, 默认安装了lxml时使用lxml")                           # fmt: skip
+@click.option("-i", "--incremental", is_flag=True,
+              help="增量查询: 记录查询过的视频, 没有新视频时停止翻页, 评分未过期时不再查询")  # fmt: skip
+@click.option("--rate", type=click.FloatRange(min=0), help="每秒最多请求数, 0 表示不限速, 默认 5")
+@click.option("-o", "--output",
+              help="边查询边导出到文件, 格式按后缀: .jsonl, .csv, .db(SQLite), '-' 输出JSONL到标准输出")  # fmt: skip
 @click.argument("name", required=False)
+# pylint: disable-next=too-many-locals
 def oneloume(year: Optional[str] = None, max_page: Optional[int] = None, name: Optional[str] = None,
              min_items: Optional[int] = None, type: Optional[str]=None,
-             score=False, model = None):   # fmt: skip
+             score=False, model = None, async_io=False, parser=None,
+             incremental=False, rate: Optional[float] = None,
+             output: Optional[str] = None):   # fmt: skip
     """爬取 https://www.1lou.me 视频信息
 
     NAME: 指定名称
     """
 
-    web = Web1louMe()
-    # url = '/'
-    models = {
-        '首页': '/',
-        '电影': 'forum-1.htm',
-        '剧集': 'forum-2.htm',
-    }
+    web = Web1louMe(parser=parser, index=MediaIndex() if incremental else None, rate_limit=rate)
+    fields = ["year", "location", "type", "size", "name", "url"]
+    fields.extend(["score_imdb", "score_douban"] if score else [])
+    out = sink.open_sink(output, ["source"] + fields, table="medias") if output else None
     try:
-        videos = web.walk(max_page=max_page, year=year, name=name, min_items=min_items, score=score,
-                         media_type=type, progress=True, url=models.get(model))    # fmt: skip
-    except httpclient.RequestError as e:
+        if async_io:
+            videos = web.walk(max_page=max_page, year=year, name=name, min_items=min_items,
+                              score=score, media_type=type, progress=True,
+                              url=ONELOUME_MODELS.get(model), use_async=async_io,
+                              incremental=incremental)                              # fmt: skip
+        else:
+            # rows are printed as they arrive, the progress bar is shown until the first one
+            videos = web.iter_walk(max_page=max_page, year=year, name=name, min_items=min_items,
+                                   score=score, media_type=type, progress=True,
+                                   url=ONELOUME_MODELS.get(model), incremental=incremental,
+                                   close_progress=not out)                          # fmt: skip
+        if out:
+            _export_medias(videos, out, output)
+        else:
+            _print_medias(videos, fields)
+    except (httpclient.HttpError, httpclient.RequestError) as e:
         logger.error("查询失败： {}", e)
         return 1
-    fields = ["year", "location", "type", "size", "name", "url"]
-    fields.extend(["score_imdb", "score_douban"] if score else [])
-    dt = table.DataTable(fields, title={"score_imdb": "IMDB", "score_douban": "豆瓣"}, index=True)
-    dt.set_style(table.TableStyle.SINGLE_BORDER)
-    dt.set_align({"source": "l", "name": "l", "size": "r", "url": "l", "location": "l"})
-
-    dt.add_object_items(videos)
+    finally:
+        if out:
+            out.close()
 
-    # 分页打印
-    for page in dt.pages():
-        print(page)
-    dt.reset_page()
+    for host, bucket in ratelimit.get_buckets().items():
+        logger.info("{} 请求 {} 次, 限速等待 {:.1f}s, 被限流 {} 次",
+                    host, bucket.requests, bucket.waited, bucket.throttled)             # fmt: skip
 
 
 if __name__ == "__main__":
@@ -0,0 +1,208 @@
+"""Asyncio http client with aiohttp
+
+aiohttp is optional, install it with: pip install pytoys[async]
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Optional, TypeVar
+from urllib import parse
+
+from loguru import logger
+
+from pytoys.common import httpclient, ratelimit
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Response:
+    """Response with body already read, compatible with requests.Response for common usage"""
+
+    def __init__(self, resp: "aiohttp.ClientResponse", content: bytes):
+        self.url = str(resp.url)
+        self.status_code = resp.status
+        self.reason = resp.reason
+        self.headers = resp.headers
+        self.content = content
+        self.encoding = resp.get_encoding()
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncHttpClient:
+    """Asyncio counterpart of HttpClient
+
+    All requests of a client run on one event loop and share one connection pool,
+    ``limit`` and ``limit_per_host`` bound the connections in flight.
+    ``rate_limit`` paces requests with the per-host buckets of HttpClient, throttled
+    responses are not retried.
+    """
+
+    def __init__(self, base_url, timeout=None, log_body_limit=128, limit=100, limit_per_host=0,
+                 rate_limit: float = 0, rate_burst: int = 1):                           # fmt: skip
+        if aiohttp is None:
+            raise ImportError("aiohttp is required, install with: pip install pytoys[async]")
+        self.base_url = base_url
+        self.timeout = timeout
+        self.log_body_limit = log_body_limit
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> "aiohttp.ClientSession":
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.limit, limit_per_host=self.limit_per_host
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def _get_url(self, url: str) -> str:
+        if url.startswith("https://") or url.startswith("http://"):
+            return url
+        return parse.urljoin(self.base_url, url.lstrip("/"))
+
+    def _log_response(self, method: str, resp: "aiohttp.ClientResponse",
+                      content: Optional[bytes] = None):                                 # fmt: skip
+        """Log response"""
+        content_type = resp.headers.get("Content-Type") or ""
+        body = f"<type: {content_type or None}>"
+        if content and any(t in content_type for t in ["json", "text/html", "text/plain"]):
+            body = content.decode(errors="replace")
+            if len(body) > self.log_body_limit:
+                body = body[0 : self.log_body_limit] + "..."
+        logger.debug(
+            httpclient.RESP_TEMPLATE,
+            request=f"curl -X{method} '{resp.url}'",
+            status_code=resp.status,
+            reason=resp.reason,
+            resp_headers="\n".join([f"{k}: {v}" for k, v in resp.headers.items()]),
+            content=body,
+            elapsed=0,
+        )
+
+    @contextlib.asynccontextmanager
+    async def _open(self, method, url, **kwargs) -> AsyncIterator["aiohttp.ClientResponse"]:
+        """Open response, map errors to HttpError and RequestError like HttpClient"""
+        req_url = self._get_url(url)
+        bucket = None
+        if self.rate_limit:
+            bucket = ratelimit.get_bucket(parse.urlparse(req_url).netloc, self.rate_limit,
+                                          self.rate_burst)                              # fmt: skip
+            await bucket.acquire_async()
+        logger.debug("Request: {} {}, params={}", method, req_url, kwargs.get("params", ""))
+        try:
+            async with self.session.request(method, req_url, **kwargs) as resp:
+                if bucket and resp.status in ratelimit.THROTTLE_STATUS_CODES:
+                    bucket.throttle(ratelimit.parse_retry_after(resp.headers.get("Retry-After")))
+                elif bucket:
+                    bucket.recover()
+                if resp.status >= 400:
+                    self._log_response(method, resp, await resp.read())
+                    raise httpclient.HttpError(
+                        f"{resp.status} Error: {resp.reason} for url: {resp.url}"
+                    )
+                yield resp
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise httpclient.RequestError(str(e) or type(e).__name__) from e
+
+    async def _request(self, method, url, **kwargs) -> Response:
+        """http request"""
+        async with self._open(method, url, **kwargs) as resp:
+            content = await resp.read()
+            self._log_response(method, resp, content)
+            return Response(resp, content)
+
+    async def get(self, url, params=None, headers=None) -> Response:
+        """http get"""
+        return await self._request("GET", url, params=params, headers=headers)
+
+    async def post(self, url, data=None, json=None, headers=None) -> Response:
+        """http post"""
+        # pylint: disable=redefined-outer-name
+        return await self._request("POST", url, data=data, json=json, headers=headers)
+
+    async def download(self, url, params=None, default_filename=None, progress=False,
+                       output: Optional[str] = None) -> str:                            # fmt: skip
+        """http download, return saved file
+
+        Files are linked from and added to the default blob store of httpclient if set.
+        """
+        # pylint: disable=too-many-locals
+        store = httpclient.get_default_store()
+        linked = not params and httpclient.link_from_store(
+            self._get_url(url), default_filename=default_filename, output=output
+        )
+        if linked:
+            return linked
+        async with self._open("GET", url, params=params) as resp:
+            self._log_response("GET", resp)
+            filename = httpclient.get_filename(resp.headers, str(resp.url), default_filename)
+            output_file = os.path.join(output, filename) if output else filename
+            if output:
+                os.makedirs(output, exist_ok=True)
+            total = resp.headers.get("content-length", "")
+            progressbar = httpclient.new_progressbar(filename, output_file,
+                                                     int(total) if total.isdigit() else None,
+                                                     progress=progress)                 # fmt: skip
+            sha256 = hashlib.sha256()
+            try:
+                with open(f"{output_file}.part", "wb") as f:
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        progressbar.update(len(chunk))
+                os.replace(f"{output_file}.part", output_file)
+                progressbar.set_description(f"✅ {filename}")
+            finally:
+                progressbar.clear()
+                progressbar.close()
+            if store:
+                store.add(output_file, url=str(resp.url), etag=resp.headers.get("ETag"),
+                          digest=sha256.hexdigest())                                    # fmt: skip
+        if not progress:
+            logger.info("saved to file: {}", output_file)
+        return output_file
+
+
+async def map_limited(func: Callable[[T], Awaitable[R]], items: Iterable[T],
+                      limit: int = 100) -> List[R]:                                     # fmt: skip
+    """Run func for all items with at most limit coroutines in flight, keep items order"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def _run(item):
+        async with semaphore:
+            return await func(item)
+
+    return await asyncio.gather(*[_run(item) for item in items])
@@ -0,0 +1,131 @@
+"""Run many http requests concurrently"""
+
+import collections
+import dataclasses
+import threading
+import time
+from concurrent import futures
+from typing import Deque, Dict, Generator, Iterable, List, Optional
+from urllib import parse
+
+import requests
+from loguru import logger
+
+from pytoys.common import httpclient
+
+
+@dataclasses.dataclass
+class Result:
+    index: int
+    request: httpclient.Request
+    response: Optional[requests.Response] = None
+    error: Optional[Exception] = None
+    elapsed: float = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.response is not None and self.response.ok
+
+
+@dataclasses.dataclass
+class Summary:
+    total: int = 0
+    success: int = 0
+    elapsed: float = 0
+    failures: List[Result] = dataclasses.field(default_factory=list)
+
+    @property
+    def failed(self) -> int:
+        return len(self.failures)
+
+    def add(self, result: Result):
+        self.total += 1
+        if result.ok:
+            self.success += 1
+        else:
+            self.failures.append(result)
+
+
+class BatchRunner:
+    """Execute requests with a thread pool
+
+    :param concurrency: max requests in flight
+    :param host_limit: max requests in flight for one host, no limit if not set
+
+    With ``host_limit``, requests of each host wait in a queue of their own and are
+    submitted once a request of the same host is done, so a worker never waits for a host.
+    """
+
+    def __init__(self, concurrency: int = 8, host_limit: Optional[int] = None):
+        self.concurrency = max(concurrency, 1)
+        self.host_limit = host_limit
+        self.session = httpclient.new_session(pool_size=self.concurrency)
+
+    def _execute(self, index: int, req: httpclient.Request) -> Result:
+        result = Result(index=index, request=req)
+        start = time.monotonic()
+        try:
+            result.response = httpclient.request(req, session=self.session)
+        except requests.RequestException as e:
+            logger.debug("request {} {} failed: {}", req.method, req.url, e)
+            result.error = e
+        finally:
+            result.elapsed = time.monotonic() - start
+        return result
+
+    def _submit_by_host(self, executor: futures.Executor, reqs: List[httpclient.Request],
+                        stop: threading.Event) -> List[futures.Future]:                 # fmt: skip
+        """Submit requests of each host in turn, no more requests are submitted once stop is set"""
+        tasks: List[futures.Future] = [futures.Future() for _ in reqs]
+        queues: Dict[str, Deque[int]] = collections.defaultdict(collections.deque)
+        for index, req in enumerate(reqs):
+            queues[parse.urlparse(req.url).netloc].append(index)
+
+        def submit_next(queue: Deque[int]):
+            if stop.is_set():
+                return
+            try:
+                index = queue.popleft()
+            except IndexError:
+                return
+            try:
+                future = executor.submit(self._execute, index, reqs[index])
+            except RuntimeError:
+                # the executor is shut down after stop is set
+                if stop.is_set():
+                    return
+                raise
+            future.add_done_callback(lambda future: on_done(future, index, queue))
+
+        def on_done(future: futures.Future, index: int, queue: Deque[int]):
+            # submit the next one before the last result can end the run
+            submit_next(queue)
+            if future.exception():
+                tasks[index].set_exception(future.exception())
+            else:
+                tasks[index].set_result(future.result())
+
+        for queue in queues.values():
+            for _ in range(self.host_limit or 1):
+                submit_next(queue)
+        return tasks
+
+    def run(
+        self, reqs: Iterable[httpclient.Request], ordered: bool = True
+    ) -> Generator[Result, None, None]:
+        """Execute requests, yield results in input order or in completion order"""
+        stop = threading.Event()
+        with futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            try:
+                if self.host_limit:
+                    tasks = self._submit_by_host(executor, list(reqs), stop)
+                else:
+                    tasks = [executor.submit(self._execute, i, req) for i, req in enumerate(reqs)]
+                for task in tasks if ordered else futures.as_completed(tasks):
+                    yield task.result()
+            finally:
+                # e.g. the generator is closed early, requests queued by host are dropped
+                stop.set()
+
+    def close(self):
+        self.session.close()
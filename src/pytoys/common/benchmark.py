@@ -0,0 +1,241 @@
+"""Replay http requests as a load generator"""
+
+import collections
+import dataclasses
+import itertools
+import math
+import threading
+import time
+from concurrent import futures
+from typing import Dict, List, Optional
+
+import requests
+from loguru import logger
+
+from pytoys.common import httpclient
+
+HISTOGRAM_WIDTH = 40
+# expected latency in seconds to size the workers of rate mode, by Little's law
+RATE_MODE_LATENCY = 1.0
+RATE_MODE_MAX_WORKERS = 256
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of sorted values
+
+    >>> percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 90)
+    9
+    >>> percentile([1, 2, 3], 100)
+    3
+    >>> percentile([], 50)
+    0
+    """
+    if not values:
+        return 0
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+@dataclasses.dataclass
+class Report:
+    latencies: List[float] = dataclasses.field(default_factory=list)
+    status_codes: collections.Counter = dataclasses.field(default_factory=collections.Counter)
+    errors: collections.Counter = dataclasses.field(default_factory=collections.Counter)
+    dropped: int = 0
+    elapsed: float = 0
+
+    @property
+    def total(self) -> int:
+        return sum(self.status_codes.values()) + sum(self.errors.values())
+
+    @property
+    def throughput(self) -> float:
+        return self.total / self.elapsed if self.elapsed else 0
+
+    def record(self, latency: float, status_code: Optional[int] = None,
+               error: Optional[Exception] = None):                                      # fmt: skip
+        if error is not None:
+            self.errors[type(error).__name__] += 1
+            return
+        self.latencies.append(latency)
+        self.status_codes[status_code] += 1
+
+    def latency_stats(self) -> Dict[str, float]:
+        values = sorted(self.latencies)
+        return {
+            "min": values[0] if values else 0,
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "max": values[-1] if values else 0,
+        }
+
+    def histogram(self, buckets: int = 10) -> List[str]:
+        """Render latency histogram lines with equal width buckets"""
+        if not self.latencies:
+            return []
+        low, high = min(self.latencies), max(self.latencies)
+        step = (high - low) / buckets or 1
+        counts = [0] * buckets
+        for latency in self.latencies:
+            counts[min(int((latency - low) / step), buckets - 1)] += 1
+        peak = max(counts)
+        return [
+            f"{(low + i * step) * 1000:10.2f}ms [{count:>8}] "
+            + "■" * math.ceil(count / peak * HISTOGRAM_WIDTH)
+            for i, count in enumerate(counts)
+        ]
+
+    def format(self) -> str:
+        stats = self.latency_stats()
+        lines = [
+            f"Requests   : {self.total}",
+            f"Elapsed    : {self.elapsed:.3f}s",
+            f"Throughput : {self.throughput:.2f} req/s",
+            *([f"Dropped    : {self.dropped}"] if self.dropped else []),
+            "Latency    : " + ", ".join(f"{k}={v * 1000:.2f}ms" for k, v in stats.items()),
+            "",
+            "Latency histogram:",
+            *self.histogram(),
+            "",
+            "Status codes:",
+            *[f"  {code}: {count}" for code, count in sorted(self.status_codes.items())],
+        ]
+        if self.errors:
+            lines.extend(["", "Errors:"])
+            lines.extend(f"  {name}: {count}" for name, count in self.errors.most_common())
+        return "\n".join(lines)
+
+
+class LoadRunner:
+    """Replay requests with a fixed concurrency or a fixed rate
+
+    Requests are replayed round robin until ``count`` requests are sent or ``duration``
+    seconds passed. Requests sent during the first ``warmup`` seconds are neither counted
+    nor reported.
+    In rate mode, latency is measured from the scheduled send time, so a saturated
+    server is not hidden by requests waiting for a free worker. ``concurrency`` limits the
+    requests in flight, by default it is sized for ``RATE_MODE_LATENCY``; a send finding
+    no free worker is dropped and reported instead of queued.
+    """
+
+    def __init__(self, reqs: List[httpclient.Request], concurrency: Optional[int] = None,
+                 rate: Optional[float] = None, duration: Optional[float] = None,
+                 count: Optional[int] = None, warmup: float = 0):               # fmt: skip
+        if not reqs:
+            raise ValueError("requests is empty")
+        if not duration and not count:
+            raise ValueError("duration or count is required")
+        if concurrency is None:
+            concurrency = (min(math.ceil(rate * RATE_MODE_LATENCY), RATE_MODE_MAX_WORKERS)
+                           if rate else 1)                                              # fmt: skip
+        self.reqs = reqs
+        self.concurrency = max(concurrency, 1)
+        self.rate = rate
+        self.duration = duration
+        self.count = count
+        self.warmup = warmup
+        self.report = Report()
+        self.session = httpclient.new_session(pool_size=self.concurrency)
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._start = 0.0
+        self._workers = threading.Semaphore(self.concurrency)
+
+    def _acquire(self, now: float) -> bool:
+        """Reserve one request slot, return False if the run is finished"""
+        with self._lock:
+            elapsed = now - self._start
+            if elapsed < self.warmup:
+                return True
+            if self.count and self._sent >= self.count:
+                return False
+            if self.duration and elapsed >= self.warmup + self.duration:
+                return False
+            self._sent += 1
+            return True
+
+    def _execute(self, req: httpclient.Request, scheduled: float):
+        status_code, error = None, None
+        try:
+            resp = httpclient.request(req, session=self.session)
+            status_code = resp.status_code
+        except requests.RequestException as e:
+            error = e
+        finished = time.monotonic()
+        if scheduled - self._start < self.warmup:
+            return
+        with self._lock:
+            self.report.record(finished - scheduled, status_code=status_code, error=error)
+
+    def _execute_on_worker(self, req: httpclient.Request, scheduled: float):
+        try:
+            self._execute(req, scheduled)
+        finally:
+            self._workers.release()
+
+    def _drop(self, scheduled: float):
+        if scheduled - self._start < self.warmup:
+            return
+        with self._lock:
+            if not self.report.dropped:
+                logger.warning("concurrency {} cannot keep up with rate {}/s, late requests "
+                               "are dropped", self.concurrency, self.rate)              # fmt: skip
+            self.report.dropped += 1
+
+    def _worker(self, reqs):
+        while True:
+            now = time.monotonic()
+            if not self._acquire(now):
+                break
+            self._execute(next(reqs), now)
+
+    def _run_concurrency(self):
+        reqs = _LockedIterator(itertools.cycle(self.reqs))
+        with futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for _ in range(self.concurrency):
+                executor.submit(self._worker, reqs)
+
+    def _run_rate(self):
+        interval = 1 / self.rate
+        with futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for index, req in enumerate(itertools.cycle(self.reqs)):
+                scheduled = self._start + index * interval
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                if not self._acquire(scheduled):
+                    break
+                # released by the worker once the request is done
+                # pylint: disable-next=consider-using-with
+                if not self._workers.acquire(blocking=False):
+                    self._drop(scheduled)
+                    continue
+                executor.submit(self._execute_on_worker, req, scheduled)
+
+    def run(self) -> Report:
+        """Run the load test and return the report"""
+        self._start = time.monotonic()
+        if self.rate:
+            self._run_rate()
+        else:
+            self._run_concurrency()
+        self.report.elapsed = time.monotonic() - self._start - self.warmup
+        if self.report.elapsed <= 0:
+            self.report.elapsed = time.monotonic() - self._start
+        self.session.close()
+        return self.report
+
+
+class _LockedIterator:
+
+    def __init__(self, iterator):
+        self.iterator = iterator
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.lock:
+            return next(self.iterator)
@@ -0,0 +1,152 @@
+"""Content addressed store of downloaded files
+
+A file is kept once as ``objects/<sha256[:2]>/<sha256>`` and linked into the outputs it is
+downloaded to, hard link first, then reflink and copy. Blobs are read only, since a hard
+linked output shares the blob. A manifest maps urls and ETags to blobs, so a known file is
+linked again without downloading it.
+"""
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import stat
+import threading
+import time
+from typing import Optional
+
+from loguru import logger
+
+from pytoys.common import cache
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+CHUNK_SIZE = 1024 * 1024
+# ioctl of linux to clone a file on copy-on-write file systems, e.g. btrfs and xfs
+FICLONE = 0x40049409
+
+SQL_CREATE = """
+CREATE TABLE IF NOT EXISTS assets (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    filename TEXT,
+    updated REAL NOT NULL
+)
+"""
+SQL_CREATE_INDEX = "CREATE INDEX IF NOT EXISTS assets_etag ON assets (etag)"
+
+
+def hash_file(path: str) -> str:
+    """sha256 of file"""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def is_strong_etag(etag: Optional[str]) -> bool:
+    """Weak ETags may be shared by different contents
+
+    >>> is_strong_etag('"abc"'), is_strong_etag('W/"abc"'), is_strong_etag(None)
+    (True, False, False)
+    """
+    return bool(etag) and not etag.startswith("W/")
+
+
+def _reflink(src: str, dst: str):
+    if fcntl is None:
+        raise OSError("reflink is not supported")
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+class BlobStore(cache.SqliteStore):
+    """Files stored by sha256 under root, with manifest of urls and ETags"""
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or cache.get_cache_dir("blobs")
+        os.makedirs(self.root, exist_ok=True)
+        super().__init__(os.path.join(self.root, "manifest.db"), [SQL_CREATE, SQL_CREATE_INDEX],
+                         row_factory=sqlite3.Row)                                       # fmt: skip
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def lookup(self, url: Optional[str] = None, etag: Optional[str] = None,
+               size: Optional[int] = None) -> Optional[sqlite3.Row]:                    # fmt: skip
+        """Asset of url, or of a strong ETag with the same size if given, None if unknown
+
+        The row has digest, size and filename. Contents of urls are supposed not changed,
+        e.g. versioned packages.
+        """
+        row = None
+        if url:
+            row = self.db.execute("SELECT * FROM assets WHERE url = ?", (url,)).fetchone()
+        if not row and is_strong_etag(etag):
+            row = self.db.execute(
+                "SELECT * FROM assets WHERE etag = ? AND (? IS NULL OR size = ?)",
+                (etag, size, size),
+            ).fetchone()
+        if row and not os.path.isfile(self.blob_path(row["digest"])):
+            logger.debug("blob {} of {} is missing", row["digest"], row["url"])
+            return None
+        return row
+
+    def materialize(self, digest: str, output_file: str) -> str:
+        """Link blob to output_file, return how it is linked: hardlink, reflink or copy"""
+        blob = self.blob_path(digest)
+        if os.path.isfile(output_file) and os.path.samefile(blob, output_file):
+            return "hardlink"
+        directory = os.path.dirname(output_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{output_file}.blob"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        method = "hardlink"
+        try:
+            os.link(blob, tmp)
+        except OSError:
+            method = "reflink"
+            try:
+                _reflink(blob, tmp)
+            except OSError:
+                method = "copy"
+                shutil.copyfile(blob, tmp)
+            os.chmod(tmp, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(tmp, output_file)
+        return method
+
+    def add(self, path: str, url: Optional[str] = None, etag: Optional[str] = None,
+            digest: Optional[str] = None) -> str:                                       # fmt: skip
+        """Store file and record its url and ETag, return the digest
+
+        The file is replaced with a link to the blob if the blob exists already.
+        """
+        digest = digest or hash_file(path)
+        blob = self.blob_path(digest)
+        if os.path.isfile(blob):
+            self.materialize(digest, path)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            tmp = f"{blob}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                os.link(path, tmp)
+            except OSError:
+                shutil.copyfile(path, tmp)
+            # hard linked outputs share the blob, protect it from being written in place
+            os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(tmp, blob)
+        if url:
+            self.db.execute(
+                "INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?, ?)",
+                (url, etag if is_strong_etag(etag) else None, digest, os.path.getsize(blob),
+                 os.path.basename(path), time.time()),                                  # fmt: skip
+            )
+        return digest
@@ -0,0 +1,174 @@
+"""Persistent http response cache"""
+
+import dataclasses
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Sequence
+
+import requests
+from loguru import logger
+from requests import structures, utils
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+SQL_CREATE = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status_code INTEGER NOT NULL,
+    reason TEXT,
+    headers TEXT NOT NULL,
+    content BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+)
+"""
+
+
+def get_cache_dir(*paths) -> str:
+    """Get pytoys cache directory, use $PYTOYS_CACHE_DIR to override"""
+    cache_dir = os.environ.get("PYTOYS_CACHE_DIR") or os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+        "pytoys",
+    )
+    path = os.path.join(cache_dir, *paths)
+    os.makedirs(os.path.dirname(path) if paths else path, exist_ok=True)
+    return path
+
+
+def make_key(req: requests.PreparedRequest) -> str:
+    """Cache key of method, url (with params) and body"""
+    body = req.body or b""
+    if isinstance(body, str):
+        body = body.encode()
+    return hashlib.sha256(b"\n".join([req.method.encode(), req.url.encode(), body])).hexdigest()
+
+
+@dataclasses.dataclass
+class CachedResponse:
+    url: str
+    status_code: int
+    reason: str
+    headers: dict
+    content: bytes
+    created: float
+
+    @property
+    def etag(self) -> Optional[str]:
+        return self.headers.get("ETag")
+
+    @property
+    def last_modified(self) -> Optional[str]:
+        return self.headers.get("Last-Modified")
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.created < ttl
+
+    def to_response(self, req: Optional[requests.PreparedRequest] = None) -> requests.Response:
+        resp = requests.Response()
+        resp.url = self.url
+        resp.status_code = self.status_code
+        resp.reason = self.reason
+        resp.headers = structures.CaseInsensitiveDict(self.headers)
+        resp.encoding = utils.get_encoding_from_headers(resp.headers)
+        resp.request = req
+        # pylint: disable=protected-access
+        resp._content = self.content
+        return resp
+
+
+class SqliteStore:
+    """Sqlite database with a connection of each thread
+
+    Sqlite with WAL journal is used, so the database can be shared by several processes.
+    Statements of ``ddl`` create the tables when a connection is opened.
+    """
+
+    def __init__(self, path: str, ddl: Sequence[str], row_factory=None):
+        self.path = path
+        self.ddl = list(ddl)
+        self.row_factory = row_factory
+        self._local = threading.local()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            if self.row_factory:
+                conn.row_factory = self.row_factory
+            conn.execute("PRAGMA journal_mode=WAL")
+            for sql in self.ddl:
+                conn.execute(sql)
+            self._local.conn = conn
+        return conn
+
+
+class HttpCache(SqliteStore):
+    """Http response cache stored in sqlite, shared by several processes
+
+    Entries are evicted by last access time once the total size exceeds ``max_size``.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_size: int = DEFAULT_MAX_SIZE):
+        super().__init__(path or get_cache_dir("http-cache.db"), [SQL_CREATE])
+        self.max_size = max_size
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        row = self.db.execute(
+            "SELECT url, status_code, reason, headers, content, created FROM responses "
+            "WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if not row:
+            return None
+        self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        url, status_code, reason, headers, content, created = row
+        return CachedResponse(url, status_code, reason, json.loads(headers), content, created)
+
+    def set(self, key: str, resp: requests.Response):
+        headers = {k: v for k, v in resp.headers.items() if k.lower() != "content-encoding"}
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, resp.url, resp.status_code, resp.reason, json.dumps(headers),
+             resp.content, len(resp.content), now, now),                                # fmt: skip
+        )
+        self.evict()
+
+    def touch(self, key: str):
+        """Mark entry as revalidated"""
+        now = time.time()
+        self.db.execute(
+            "UPDATE responses SET created = ?, accessed = ? WHERE key = ?", (now, now, key)
+        )
+
+    def evict(self):
+        """Remove least recently used entries until total size is under max_size"""
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_size:
+                removed = 0
+                for key, size in db.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed"
+                ).fetchall():
+                    if total <= self.max_size:
+                        break
+                    db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    total -= size
+                    removed += 1
+                logger.debug("evicted {} cached response(s)", removed)
+            db.execute("COMMIT")
+        except sqlite3.Error:
+            db.execute("ROLLBACK")
+            raise
+
+    def clear(self):
+        self.db.execute("DELETE FROM responses")
@@ -0,0 +1,353 @@
+"""Multi-connection ranged downloads"""
+
+import dataclasses
+import json
+import os
+import re
+import threading
+import time
+from concurrent import futures
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+from loguru import logger
+
+CHUNK_SIZE = 256 * 1024
+# do not split files into segments smaller than this
+MIN_SEGMENT_SIZE = 1024 * 1024
+# seconds between two journal saves
+JOURNAL_INTERVAL = 1
+
+
+class DownloadError(IOError):
+
+    def __init__(self, reason):
+        super().__init__(f"download error: {reason}")
+
+
+def split_ranges(total: int, segments: int,
+                 min_size: int = MIN_SEGMENT_SIZE) -> List[Tuple[int, int]]:            # fmt: skip
+    """Split [0, total) to inclusive byte ranges
+
+    >>> split_ranges(10, 3, min_size=1)
+    [(0, 3), (4, 7), (8, 9)]
+    >>> split_ranges(10, 3, min_size=5)
+    [(0, 4), (5, 9)]
+    >>> split_ranges(10, 3, min_size=20)
+    [(0, 9)]
+    """
+    segments = max(min(segments, total // min_size), 1)
+    size = max(-(-total // segments), 1)
+    return [(start, min(start + size, total) - 1) for start in range(0, total, size)]
+
+
+def parse_content_range(value: Optional[str]) -> Optional[Tuple[int, int, Optional[int]]]:
+    """Start, end and total size of Content-Range, total is None if unknown
+
+    >>> parse_content_range("bytes 100-199/1000"), parse_content_range("bytes 0-9/*")
+    ((100, 199, 1000), (0, 9, None))
+    >>> parse_content_range("bytes */1000") is None
+    True
+    """
+    match = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+|\*)", (value or "").strip())
+    if not match:
+        return None
+    total = match.group(3)
+    return int(match.group(1)), int(match.group(2)), None if total == "*" else int(total)
+
+
+def resume_headers(output_file: str) -> Dict[str, str]:
+    """Headers requesting the first pending range of a partial output_file, empty if none
+
+    With If-Range, the server sends the full file instead if it has changed.
+    """
+    journal = Journal.load(output_file)
+    if not journal or not journal.validator or not journal.pending:
+        return {}
+    segment = journal.pending[0]
+    return {
+        "Range": f"bytes={segment.start + segment.done}-{segment.end}",
+        "If-Range": journal.validator,
+        "Accept-Encoding": "identity",
+    }
+
+
+def get_total_size(resp: requests.Response) -> Optional[int]:
+    """Size of the file of resp, which may be a range of it"""
+    if resp.status_code == 206:
+        content_range = parse_content_range(resp.headers.get("Content-Range"))
+        return content_range[2] if content_range else None
+    total = resp.headers.get("Content-Length", "")
+    return int(total) if total.isdigit() else None
+
+
+def supports_ranges(resp: requests.Response) -> bool:
+    """Whether the response can be downloaded with byte ranges"""
+    return (
+        resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+        and resp.headers.get("Content-Length", "").isdigit()
+        and not resp.headers.get("Content-Encoding")
+    )
+
+
+@dataclasses.dataclass
+class Segment:
+    start: int
+    end: int
+    done: int = 0
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start + 1
+
+    @property
+    def completed(self) -> bool:
+        return self.done >= self.size
+
+
+@dataclasses.dataclass
+class Journal:
+    """Progress of a partial file, saved next to it as <file>.part.json"""
+
+    url: str
+    total: int
+    etag: str = ""
+    last_modified: str = ""
+    segments: List[Segment] = dataclasses.field(default_factory=list)
+
+    @staticmethod
+    def get_path(output_file: str) -> str:
+        return f"{output_file}.part.json"
+
+    @classmethod
+    def from_response(cls, resp: requests.Response, segments: int) -> "Journal":
+        total = int(resp.headers["Content-Length"])
+        return cls(
+            url=resp.url,
+            total=total,
+            etag=resp.headers.get("ETag", ""),
+            last_modified=resp.headers.get("Last-Modified", ""),
+            segments=[Segment(start, end) for start, end in split_ranges(total, segments)],
+        )
+
+    @classmethod
+    def load(cls, output_file: str) -> Optional["Journal"]:
+        path = cls.get_path(output_file)
+        if not os.path.isfile(path) or not os.path.isfile(f"{output_file}.part"):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            data["segments"] = [Segment(**segment) for segment in data.get("segments", [])]
+            return cls(**data)
+        except (ValueError, TypeError) as e:
+            logger.warning("ignore invalid journal {}: {}", path, e)
+            return None
+
+    def save(self, output_file: str):
+        path = self.get_path(output_file)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(dataclasses.asdict(self), f)
+        os.replace(f"{path}.tmp", path)
+
+    def remove(self, output_file: str):
+        path = self.get_path(output_file)
+        if os.path.exists(path):
+            os.remove(path)
+
+    @property
+    def validator(self) -> str:
+        """Validator for If-Range header, weak etag is not allowed"""
+        if self.etag and not self.etag.startswith("W/"):
+            return self.etag
+        return self.last_modified
+
+    @property
+    def done(self) -> int:
+        return sum(segment.done for segment in self.segments)
+
+    @property
+    def pending(self) -> List[Segment]:
+        return [segment for segment in self.segments if not segment.completed]
+
+    def check_range(self, resp: requests.Response, segment: Segment):
+        """Raise DownloadError if resp is not a range of segment from its written bytes"""
+        content_range = parse_content_range(resp.headers.get("Content-Range"))
+        start = segment.start + segment.done
+        if (
+            not content_range
+            or content_range[0] != start
+            or content_range[1] > segment.end
+            or content_range[2] not in (None, self.total)
+        ):
+            raise DownloadError(f"unexpected range {resp.headers.get('Content-Range')}, "
+                                f"expected bytes {start}-{segment.end}/{self.total}")  # fmt: skip
+
+    def matches(self, resp: requests.Response) -> bool:
+        """Whether the resource of resp is the one recorded, so the download can resume"""
+        return (
+            bool(self.validator)
+            and str(self.total) == resp.headers.get("Content-Length")
+            and self.etag == resp.headers.get("ETag", "")
+            and self.last_modified == resp.headers.get("Last-Modified", "")
+        )
+
+
+class SegmentedDownloader:
+    """Download byte ranges in parallel into one preallocated file
+
+    Data is written to <file>.part and progress is recorded in a journal, an interrupted
+    download resumes from the journal with Range and If-Range requests. The file is
+    renamed to <file> once all ranges are completed.
+
+    The first pending segment is read from the response already opened, which is either
+    the full response of a new download, or the range requested with ``resume_headers``.
+    ``on_data`` is called with the size of each chunk received.
+    """
+
+    def __init__(self, session: requests.Session, resp: requests.Response, output_file: str,
+                 segments: int = 4, retries: int = 3, timeout=None, progressbar=None,
+                 on_data: Optional[Callable[[int], None]] = None):                      # fmt: skip
+        self.session = session
+        self.resp = resp
+        self.output_file = output_file
+        self.part_file = f"{output_file}.part"
+        self.retries = retries
+        self.timeout = timeout
+        self.progressbar = progressbar
+        self.on_data = on_data
+        self.journal = Journal.load(output_file)
+        if resp.status_code == 206:
+            self._check_resumed(resp)
+            self.resumed = True
+        else:
+            self.resumed = self.journal is not None and self.journal.matches(resp)
+        # a full response of a resumed download is not used
+        self.reuse_resp = not self.resumed or resp.status_code == 206
+        if not self.resumed:
+            self.journal = Journal.from_response(resp, segments)
+        self.url = resp.url
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+        self._stopped = threading.Event()
+
+    def _check_resumed(self, resp: requests.Response):
+        try:
+            if not self.journal or not self.journal.pending:
+                raise DownloadError("partial response without journal")
+            self.journal.check_range(resp, self.journal.pending[0])
+        except DownloadError:
+            resp.close()
+            # restart the download next time
+            if self.journal:
+                self.journal.remove(self.output_file)
+            raise
+
+    def _update(self, segment: Segment, size: int):
+        with self._lock:
+            segment.done += size
+            if self.progressbar:
+                self.progressbar.update(size)
+            if self.on_data:
+                self.on_data(size)
+            if time.monotonic() - self._saved_at >= JOURNAL_INTERVAL:
+                self.journal.save(self.output_file)
+                self._saved_at = time.monotonic()
+
+    def _write(self, segment: Segment, resp: requests.Response):
+        # unbuffered, so bytes recorded in journal are never lost in a buffer
+        with resp, open(self.part_file, "r+b", buffering=0) as f:
+            f.seek(segment.start + segment.done)
+            for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                if self._stopped.is_set():
+                    return
+                chunk = chunk[: segment.size - segment.done]
+                f.write(chunk)
+                self._update(segment, len(chunk))
+                if segment.completed:
+                    break
+
+    def _open_range(self, segment: Segment) -> requests.Response:
+        headers = {
+            "Range": f"bytes={segment.start + segment.done}-{segment.end}",
+            "Accept-Encoding": "identity",
+        }
+        if self.journal.validator:
+            headers["If-Range"] = self.journal.validator
+        resp = self.session.get(self.url, headers=headers, stream=True, timeout=self.timeout)
+        try:
+            if resp.status_code != 206:
+                raise DownloadError(f"range not satisfied, status {resp.status_code}")
+            self.journal.check_range(resp, segment)
+        except DownloadError:
+            resp.close()
+            raise
+        return resp
+
+    def _fetch(self, segment: Segment, resp: Optional[requests.Response] = None):
+        for attempt in range(self.retries + 1):
+            try:
+                self._write(segment, resp or self._open_range(segment))
+                if segment.completed or self._stopped.is_set():
+                    return
+                raise DownloadError(f"segment {segment.start}-{segment.end} is incomplete")
+            except (requests.RequestException, DownloadError) as e:
+                if attempt >= self.retries:
+                    if isinstance(e, DownloadError):
+                        raise
+                    raise DownloadError(e) from e
+                logger.debug("retry segment {}-{}: {}", segment.start, segment.end, e)
+                time.sleep(min(2**attempt, 10))
+            resp = None
+
+    def run(self):
+        """Download all segments"""
+        pending = self.journal.pending
+        if self.resumed:
+            logger.info("resume {} from {} bytes", self.output_file, self.journal.done)
+            if not self.reuse_resp:
+                self.resp.close()
+            if self.progressbar:
+                self.progressbar.update(self.journal.done)
+        else:
+            with open(self.part_file, "wb") as f:
+                f.truncate(self.journal.total)
+        logger.debug("download {} with {} segment(s)", self.url, len(pending))
+        try:
+            with futures.ThreadPoolExecutor(max_workers=max(len(pending), 1)) as executor:
+                tasks = [
+                    executor.submit(self._fetch, segment,
+                                    self.resp if self.reuse_resp and not i else None)  # fmt: skip
+                    for i, segment in enumerate(pending)
+                ]
+                try:
+                    for task in futures.as_completed(tasks):
+                        task.result()
+                except BaseException:
+                    # stop other segments, progress is kept in journal
+                    self._stopped.set()
+                    raise
+        finally:
+            self.journal.save(self.output_file)
+        os.replace(self.part_file, self.output_file)
+        self.journal.remove(self.output_file)
+
+
+def save_stream(resp: requests.Response, output_file: str, progressbar=None, hasher=None,
+                on_data: Optional[Callable[[int], None]] = None):                       # fmt: skip
+    """Save response with one stream, the file is renamed from <file>.part once completed
+
+    ``hasher``, e.g. hashlib.sha256(), is updated with the content while writing, and
+    ``on_data`` is called with the size of each chunk.
+    """
+    part_file = f"{output_file}.part"
+    with resp, open(part_file, "wb") as f:
+        for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+            f.write(chunk)
+            if hasher:
+                hasher.update(chunk)
+            if progressbar:
+                progressbar.update(len(chunk))
+            if on_data:
+                on_data(len(chunk))
+    os.replace(part_file, output_file)
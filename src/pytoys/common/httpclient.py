@@ -1,13 +1,20 @@
 import dataclasses
-import io
+import hashlib
 import os
 import re
-from typing import Optional
+import threading
+from typing import Callable, Dict, Optional, Tuple
 from urllib import parse
 
 import requests
 from loguru import logger
+from requests import adapters
 from tqdm.auto import tqdm
+from urllib3.util import retry
+
+from pytoys.common import blobstore
+from pytoys.common import cache as http_cache
+from pytoys.common import downloader, ratelimit
 
 TYPE_WWW_FORM = "application/x-www-form-urlencoded"
 TYPE_JSON = "application/json"
@@ -25,6 +32,82 @@ Body: {content}
 
 HttpError = requests.HTTPError
 
+# enough for the default workers of ThreadPoolExecutor
+DEFAULT_POOL_SIZE = 32
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_DEFAULT_CACHE: Optional[http_cache.HttpCache] = None
+_DEFAULT_STORE: Optional[blobstore.BlobStore] = None
+
+
+def set_default_cache(cache: Optional[http_cache.HttpCache]):
+    """Set response cache for all HttpClient, clients cache responses only if cache_ttl > 0"""
+    global _DEFAULT_CACHE  # pylint: disable=global-statement
+    _DEFAULT_CACHE = cache
+
+
+def set_default_store(store: Optional[blobstore.BlobStore]):
+    """Set blob store for all downloads, known files are linked from the store"""
+    global _DEFAULT_STORE  # pylint: disable=global-statement
+    _DEFAULT_STORE = store
+
+
+def get_default_store() -> Optional[blobstore.BlobStore]:
+    return _DEFAULT_STORE
+
+
+_SESSIONS: Dict[Tuple, requests.Session] = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def new_session(pool_size: int = DEFAULT_POOL_SIZE, retries: int = 0,
+                backoff_factor: float = 0.5, rate_limit: float = 0,
+                rate_burst: int = 1) -> requests.Session:                               # fmt: skip
+    """New session with tuned connection pool and retry policy
+
+    :param pool_size: max connections kept alive for one host
+    :param retries: retry times for connection errors and 429/5xx of idempotent requests
+    :param rate_limit: max requests per second for each host, 0 means no limit. Hosts are
+        throttled for all threads on 429/503, which are retried after Retry-After
+    """
+    session = requests.Session()
+    status_forcelist = RETRY_STATUS_CODES if retries else None
+    kwargs = {}
+    if rate_limit:
+        status_forcelist = [code for code in status_forcelist or []
+                            if code not in ratelimit.THROTTLE_STATUS_CODES]             # fmt: skip
+        kwargs = {"rate": rate_limit, "burst": rate_burst, "throttle_retries": retries}
+    if retries:
+        kwargs["max_retries"] = retry.Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=status_forcelist,
+            # throttled responses are retried by RateLimitedAdapter
+            respect_retry_after_header=not rate_limit,
+            raise_on_status=False,
+        )
+    # without retries the default of the adapter raises ReadTimeout rather than ConnectionError
+    adapter = (ratelimit.RateLimitedAdapter if rate_limit else adapters.HTTPAdapter)(
+        pool_connections=pool_size, pool_maxsize=pool_size, **kwargs
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(url: str, pool_size: int = DEFAULT_POOL_SIZE, retries: int = 0,
+                backoff_factor: float = 0.5, rate_limit: float = 0,
+                rate_burst: int = 1) -> requests.Session:                               # fmt: skip
+    """Get session shared by the process for the host of url"""
+    result = parse.urlparse(url)
+    key = (result.scheme, result.netloc, pool_size, retries, backoff_factor, rate_limit,
+           rate_burst)                                                                  # fmt: skip
+    with _SESSIONS_LOCK:
+        if key not in _SESSIONS:
+            _SESSIONS[key] = new_session(pool_size, retries, backoff_factor,
+                                         rate_limit=rate_limit, rate_burst=rate_burst)  # fmt: skip
+        return _SESSIONS[key]
+
 
 class RequestError(Exception):
 
@@ -68,12 +151,40 @@ def _parse_request_to_curl(req: requests.PreparedRequest) -> str:
 class HttpClient:
     """HttpClient with requests"""
 
-    def __init__(self, base_url, timeout=None, log_body_limit=128):
+    # seconds to keep responses in cache, 0 means no cache
+    cache_ttl: float = 0
+    pool_size: int = DEFAULT_POOL_SIZE
+    retries: int = 0
+    # parallel connections for downloads if server supports ranges
+    download_segments: int = 1
+    # max requests per second for each host, 0 means no limit
+    rate_limit: float = 0
+    rate_burst: int = 1
+
+    def __init__(self, base_url, timeout=None, log_body_limit=128,
+                 cache: Optional[http_cache.HttpCache] = None,
+                 cache_ttl: Optional[float] = None, pool_size: Optional[int] = None,
+                 retries: Optional[int] = None, rate_limit: Optional[float] = None,
+                 rate_burst: Optional[int] = None):                                     # fmt: skip
         self.base_url = base_url
         self.timeout = timeout
         self.log_body_limit = log_body_limit
-        self.session = requests.Session()
-        self.session.hooks["response"].append(self._hook_log_response)
+        self.cache = cache
+        if cache_ttl is not None:
+            self.cache_ttl = cache_ttl
+        if pool_size is not None:
+            self.pool_size = pool_size
+        if retries is not None:
+            self.retries = retries
+        if rate_limit is not None:
+            self.rate_limit = rate_limit
+        if rate_burst is not None:
+            self.rate_burst = rate_burst
+        # clients of the same host share keep-alive connections
+        self.session = get_session(base_url, pool_size=self.pool_size, retries=self.retries,
+                                   rate_limit=self.rate_limit,
+                                   rate_burst=self.rate_burst)                          # fmt: skip
+        self.hooks = {"response": [self._hook_log_response]}
 
     def _get_log_body(self, resp: requests.Response):
         resp_content_type = resp.headers.get("Content-Type")
@@ -111,79 +222,222 @@ class HttpClient:
         )
         return resp
 
-    def _request(self, method, url, **kwargs) -> requests.Response:
+    def _request(self, method, url, cache_ttl: Optional[float] = None,
+                 **kwargs) -> requests.Response:                                       # fmt: skip
         """http request"""
         if url.startswith("https://") or url.startswith("http://"):
             req_url = url
         else:
             req_url = parse.urljoin(self.base_url, url.lstrip("/"))
+        cache = self.cache or _DEFAULT_CACHE
+        cache_ttl = self.cache_ttl if cache_ttl is None else cache_ttl
+        if cache and cache_ttl > 0 and not kwargs.get("stream"):
+            return self._cached_request(cache, cache_ttl, method, req_url, **kwargs)
+
         logger.debug("Request: {} {}, params={}", method, req_url, kwargs.get("params", ""))
         try:
-            resp = self.session.request(method, req_url, timeout=self.timeout, **kwargs)
+            resp = self.session.request(method, req_url, timeout=self.timeout,
+                                        hooks=self.hooks, **kwargs)                     # fmt: skip
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise RequestError(str(e)) from e
+        resp.raise_for_status()
+        return resp
+
+    def _cached_request(self, cache: http_cache.HttpCache, cache_ttl: float, method, url,
+                        headers=None, **kwargs) -> requests.Response:                   # fmt: skip
+        """http request with response cache, stale responses are revalidated if possible"""
+        req = self.session.prepare_request(
+            requests.Request(method, url, headers=headers, params=kwargs.pop("params", None),
+                             data=kwargs.pop("data", None), json=kwargs.pop("json", None),
+                             hooks=self.hooks)
+        )                                                                               # fmt: skip
+        key = http_cache.make_key(req)
+        cached = cache.get(key)
+        if cached and cached.is_fresh(cache_ttl):
+            logger.debug("Cached: {} {}", method, req.url)
+            return cached.to_response(req)
+        if cached and cached.etag:
+            req.headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified:
+            req.headers["If-Modified-Since"] = cached.last_modified
+
+        logger.debug("Request: {} {}", method, req.url)
+        settings = self.session.merge_environment_settings(
+            req.url, {}, kwargs.pop("stream", None), None, None
+        )
+        try:
+            resp = self.session.send(req, timeout=self.timeout, **kwargs, **settings)
         except (requests.ConnectionError, requests.Timeout) as e:
             raise RequestError(str(e)) from e
+        if cached and resp.status_code == 304:
+            logger.debug("Not modified: {} {}", method, req.url)
+            cache.touch(key)
+            return cached.to_response(req)
         resp.raise_for_status()
+        cache.set(key, resp)
         return resp
 
-    def get(self, url, params=None, stream=False, headers=None) -> requests.Response:
+    def get(self, url, params=None, stream=False, headers=None,
+            cache_ttl: Optional[float] = None) -> requests.Response:                    # fmt: skip
         """http get"""
-        return self._request("GET", url, params=params, stream=stream, headers=headers)
+        return self._request("GET", url, params=params, stream=stream, headers=headers,
+                             cache_ttl=cache_ttl)                                       # fmt: skip
 
-    def post(self, url, data=None, json=None, headers=None) -> requests.Response:
+    def post(self, url, data=None, json=None, headers=None,
+             cache_ttl: Optional[float] = None) -> requests.Response:                   # fmt: skip
         """http post"""
-        return self._request("POST", url, data=data, json=json, headers=headers)
+        return self._request("POST", url, data=data, json=json, headers=headers,
+                             cache_ttl=cache_ttl)                                       # fmt: skip
 
     def download(self, url, params=None, default_filename=None, progress=False,
-                 output: Optional[str] = None) -> None:                                # fmt: skip
-        """http download"""
-        resp = self.get(url, params=params, stream=True)
-        save_response(resp, default_filename=default_filename, progress=progress, output=output)
+                 output: Optional[str] = None, segments: Optional[int] = None) -> str:  # fmt: skip
+        """http download, return the saved file"""
+        if url.startswith("https://") or url.startswith("http://"):
+            req_url = url
+        else:
+            req_url = parse.urljoin(self.base_url, url.lstrip("/"))
+        prepared_url = requests.Request("GET", req_url, params=params).prepare().url
+        output_file = link_from_store(prepared_url, default_filename=default_filename,
+                                      output=output)                                    # fmt: skip
+        if output_file:
+            return output_file
+        headers = _resume_headers(prepared_url, default_filename, output)
+        resp = self.get(url, params=params, stream=True, headers=headers)
+        return save_response(resp, default_filename=default_filename, progress=progress,
+                             output=output, segments=segments or self.download_segments,
+                             session=self.session, timeout=self.timeout)                # fmt: skip
+
+
+def get_filename(headers, url: Optional[str] = None, default_filename=None) -> str:
+    """Get filename from content-disposition header, default filename or url"""
+    matched = re.match(r".*filename=(.+);", headers.get("content-disposition") or "")
+    if matched:
+        filename = matched.group(1)
+        return filename.replace("'", "").replace('"', "")
+    if default_filename:
+        return default_filename
+    if url:
+        return url.split("/")[-1]
+    raise ValueError("no filename found")
+
+
+def link_from_store(url: str, default_filename=None, output: Optional[str] = None,
+                    store: Optional[blobstore.BlobStore] = None) -> Optional[str]:      # fmt: skip
+    """Link file of url from blob store without request, return the linked file if known"""
+    store = store or _DEFAULT_STORE
+    asset = store.lookup(url=url) if store else None
+    if not asset:
+        return None
+    filename = default_filename or asset["filename"]
+    output_file = os.path.join(output, filename) if output else filename
+    method = store.materialize(asset["digest"], output_file)
+    logger.info("linked {} from blob store ({})", output_file, method)
+    return output_file
+
+
+def _resume_headers(url: str, default_filename=None, output: Optional[str] = None) -> dict:
+    """Headers resuming a partial download of url, the file name may change with the response"""
+    filename = get_filename({}, url, default_filename=default_filename)
+    return downloader.resume_headers(os.path.join(output, filename) if output else filename)
+
+
+def _link_response_from_store(store: blobstore.BlobStore, resp: requests.Response,
+                              output_file: str) -> bool:                                # fmt: skip
+    asset = store.lookup(url=resp.url, etag=resp.headers.get("ETag"),
+                         size=downloader.get_total_size(resp))                          # fmt: skip
+    if not asset:
+        return False
+    resp.close()
+    method = store.materialize(asset["digest"], output_file)
+    logger.info("linked {} from blob store ({})", output_file, method)
+    return True
+
+
+def new_progressbar(filename: str, output_file: str, total: Optional[int],
+                    progress=False) -> tqdm:                                            # fmt: skip
+    """Progress bar of saving to output_file, which is logged instead if not progress"""
+    if not progress:
+        logger.info("saving to file: {}", output_file)
+    return tqdm(desc=f"📥 {filename}", total=total or 0, unit_scale=True, leave=False,
+                disable=not total or not progress)                                      # fmt: skip
+
+
+def _add_to_store(store: blobstore.BlobStore, resp: requests.Response, output_file: str,
+                  digest: Optional[str] = None):                                        # fmt: skip
+    digest = store.add(output_file, url=resp.url, etag=resp.headers.get("ETag"), digest=digest)
+    # also known by the url before redirects
+    if resp.history:
+        store.add(output_file, url=resp.history[0].url, digest=digest)
 
 
 def save_response(resp: requests.Response, default_filename=None, progress=False,
-                  output: Optional[str]=None) -> None:                                  # fmt: skip
-    """Save response to file"""
-    matched = re.match(r".*filename=(.+);", resp.headers.get("content-disposition") or "")
-    if matched:
-        filename = matched.group(1)
-        filename = filename.replace("'", "").replace('"', "")
-    elif default_filename:
-        filename = default_filename
-    elif resp.request.url:
-        filename = resp.request.url.split("/")[-1]
-    else:
-        raise ValueError("no filename found")
+                  output: Optional[str]=None, segments: int = 1,
+                  session: Optional[requests.Session] = None, timeout=None,
+                  store: Optional[blobstore.BlobStore] = None,
+                  on_data: Optional[Callable[[int], None]] = None) -> str:              # fmt: skip
+    """Save response to file, return the saved file
+
+    If the server accepts ranges, the download is resumable and split into at most
+    ``segments`` parallel range requests, a partial response resumes the download. With a
+    blob store, a file known by url or ETag is linked from the store without reading the
+    body, and new files are added to it.
+    ``on_data`` is called with the size of each chunk received, not of resumed bytes.
+    """
+    filename = get_filename(resp.headers, resp.request.url, default_filename=default_filename)
 
     output_file = os.path.join(output, filename) if output else filename
     if output:
         os.makedirs(output, exist_ok=True)
-    if not progress:
-        logger.info("saving to file: {}", output_file)
-
-    total = resp.headers.get("content-length")
-    progressbar = tqdm(desc=f"📥 {filename}", total=int(total or 0), unit_scale=True,
-                       leave=False, disable=not total or not progress)                  # fmt: skip
+    store = store or _DEFAULT_STORE
+    if store and _link_response_from_store(store, resp, output_file):
+        return output_file
+    progressbar = new_progressbar(filename, output_file, downloader.get_total_size(resp),
+                                  progress=progress)                                    # fmt: skip
 
     try:
-        with open(output_file, "wb") as f:
-            for chunk in resp.iter_content(chunk_size=io.DEFAULT_BUFFER_SIZE):
-                f.write(chunk)
-                progressbar.update(len(chunk))
-            progressbar.set_description(f"✅ {filename}")
-            progressbar.clear()
-            progressbar.close()
+        # segments are written out of order and hashed once completed
+        hasher = None
+        if resp.status_code == 206 or downloader.supports_ranges(resp):
+            downloader.SegmentedDownloader(session or get_session(resp.url), resp, output_file,
+                                           segments=segments, timeout=timeout,
+                                           progressbar=progressbar,
+                                           on_data=on_data).run()                       # fmt: skip
+        else:
+            hasher = hashlib.sha256() if store else None
+            downloader.save_stream(resp, output_file, progressbar=progressbar, hasher=hasher,
+                                   on_data=on_data)                                     # fmt: skip
+        if store:
+            _add_to_store(store, resp, output_file, digest=hasher.hexdigest() if hasher else None)
+        progressbar.set_description(f"✅ {filename}")
+        progressbar.clear()
+        progressbar.close()
         if not progress:
             logger.info("saved to file: {}", output_file)
+        return output_file
 
-    except (TimeoutError, requests.ConnectionError, requests.ConnectTimeout) as e:
+    except (TimeoutError, requests.ConnectionError, requests.ConnectTimeout,
+            downloader.DownloadError) as e:                                             # fmt: skip
         raise RequestError(str(e)) from e
 
 
 def get_and_save(url, params=None, timeout=None, default_filename=None, output=None,
-                 progress=False):                                                       # fmt: skip
-    """Download file from url"""
-    resp = requests.get(url, params=params, timeout=timeout, stream=True)
-    save_response(resp, default_filename=default_filename, progress=progress, output=output)
+                 progress=False, segments: int = 1,
+                 on_data: Optional[Callable[[int], None]] = None) -> str:               # fmt: skip
+    """Download file from url, return the saved file"""
+    prepared_url = requests.Request("GET", url, params=params).prepare().url
+    output_file = link_from_store(prepared_url, default_filename=default_filename, output=output)
+    if output_file:
+        return output_file
+    session = get_session(url)
+    headers = _resume_headers(prepared_url, default_filename, output)
+    try:
+        resp = session.get(url, params=params, headers=headers, timeout=timeout, stream=True)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise RequestError(str(e)) from e
+    resp.raise_for_status()
+    return save_response(resp, default_filename=default_filename, progress=progress,
+                         output=output, segments=segments, session=session, timeout=timeout,
+                         on_data=on_data)                                               # fmt: skip
 
 
 @dataclasses.dataclass
@@ -208,13 +462,13 @@ class Request:
                    timeout=req.get("timeout"))                  # fmt: skip
 
 
-def request(req: Request) -> requests.Response:
-    return requests.request(
+def request(req: Request, session: Optional[requests.Session] = None) -> requests.Response:
+    return (session or requests).request(
         req.method.upper(),
         req.url,
         params=req.params or {},
         headers=req.headers or {},
         json=req.json or {},
         data=req.data or None,
-        timeout=60 * 5,
+        timeout=req.timeout or 60 * 5,
     )
@@ -0,0 +1,184 @@
+"""Per-host rate limit shared by all threads of the process"""
+
+import asyncio
+import email.utils
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib import parse
+
+import requests
+from loguru import logger
+from requests import adapters
+from urllib3.util import retry
+
+THROTTLE_STATUS_CODES = (429, 503)
+# seconds to pause a host throttled without Retry-After, doubled for each throttle in a row
+BACKOFF_BASE = 1
+MAX_BACKOFF = 60
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from Retry-After header, in seconds or a http date
+
+    >>> parse_retry_after("3")
+    3.0
+    >>> parse_retry_after("Thu, 01 Jan 1970 00:00:00 GMT")
+    0.0
+    >>> parse_retry_after("soon") is None
+    True
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - time.time(), 0.0)
+
+
+class TokenBucket:
+    """Token bucket of one host, refilled with ``rate`` tokens per second up to ``burst``
+
+    The bucket is kept as the time the next token is available, so a caller takes a token
+    by reserving it and then waits outside of the lock. A throttled response pauses the
+    bucket and halves the rate, the rate recovers gradually with successful responses.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError(f"rate must be positive: {rate}")
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = rate / 16
+        self.burst = max(burst, 1)
+        self.requests = 0
+        self.throttled = 0
+        # seconds waited for tokens
+        self.waited = 0.0
+        self._next = 0.0
+        self._paused_until = 0.0
+        self._backoffs = 0
+        # increased by throttles, which drop tokens reserved before
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> Tuple[float, int]:
+        """Take a token, return seconds to wait before sending the request and the
+        generation of the token"""
+        with self._lock:
+            now = time.monotonic()
+            interval = 1 / self.rate
+            next_at = max(self._next, now)
+            delay = max(next_at - (self.burst - 1) * interval - now, self._paused_until - now, 0)
+            self._next = max(next_at, now + delay) + interval
+            return delay, self._generation
+
+    def _record(self, waited: float):
+        with self._lock:
+            self.requests += 1
+            self.waited += waited
+
+    def acquire(self) -> float:
+        """Wait for a token, return seconds waited
+
+        The token is taken again if the bucket is throttled while waiting.
+        """
+        start = time.monotonic()
+        while True:
+            delay, generation = self.reserve()
+            if delay:
+                time.sleep(delay)
+            if generation == self._generation:
+                break
+        waited = time.monotonic() - start
+        self._record(waited)
+        return waited
+
+    async def acquire_async(self) -> float:
+        start = time.monotonic()
+        while True:
+            delay, generation = self.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            if generation == self._generation:
+                break
+        waited = time.monotonic() - start
+        self._record(waited)
+        return waited
+
+    def throttle(self, retry_after: Optional[float] = None) -> float:
+        """Pause the bucket and slow down, return seconds paused"""
+        with self._lock:
+            if retry_after is None:
+                retry_after = min(BACKOFF_BASE * 2**self._backoffs, MAX_BACKOFF)
+            self._backoffs += 1
+            self.throttled += 1
+            self.rate = max(self.rate / 2, self.min_rate)
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + retry_after)
+            # no burst right after the pause
+            self._next = self._paused_until + (self.burst - 1) / self.rate
+            self._generation += 1
+            return retry_after
+
+    def recover(self):
+        """Speed up after a successful response"""
+        with self._lock:
+            self._backoffs = 0
+            self.rate = min(self.rate + self.max_rate / 32, self.max_rate)
+
+
+_BUCKETS: Dict[str, TokenBucket] = {}
+_BUCKETS_LOCK = threading.Lock()
+
+
+def get_bucket(host: str, rate: float, burst: int = 1) -> TokenBucket:
+    """Get bucket shared by the process for host, rate and burst of the first caller win"""
+    with _BUCKETS_LOCK:
+        if host not in _BUCKETS:
+            _BUCKETS[host] = TokenBucket(rate, burst=burst)
+        return _BUCKETS[host]
+
+
+def get_buckets() -> Dict[str, TokenBucket]:
+    with _BUCKETS_LOCK:
+        return dict(_BUCKETS)
+
+
+class RateLimitedAdapter(adapters.HTTPAdapter):
+    """HTTPAdapter sending requests at most ``rate`` per second for each host
+
+    Responses with 429 or 503 throttle the host for all threads, honouring Retry-After,
+    and idempotent requests are retried at most ``throttle_retries`` times.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, throttle_retries: int = 0, **kwargs):
+        self.rate = rate
+        self.burst = burst
+        self.throttle_retries = throttle_retries
+        super().__init__(**kwargs)
+
+    def send(self, request: requests.PreparedRequest, *args, **kwargs) -> requests.Response:
+        # pylint: disable=arguments-differ
+        bucket = get_bucket(parse.urlparse(request.url).netloc, self.rate, self.burst)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            resp = super().send(request, *args, **kwargs)
+            if resp.status_code not in THROTTLE_STATUS_CODES:
+                bucket.recover()
+                return resp
+            paused = bucket.throttle(parse_retry_after(resp.headers.get("Retry-After")))
+            if (
+                attempt >= self.throttle_retries
+                or request.method not in retry.Retry.DEFAULT_ALLOWED_METHODS
+            ):
+                return resp
+            attempt += 1
+            logger.debug("throttled by {} ({}), retry after {:.1f}s",
+                         request.url, resp.status_code, paused)                         # fmt: skip
+            resp.close()
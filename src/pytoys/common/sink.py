@@ -0,0 +1,148 @@
+"""Streaming export of records to JSON Lines, CSV or SQLite
+
+Records are written as they are produced and flushed in batches, so large crawls never
+hold all rows in memory.
+"""
+
+import abc
+import csv
+import dataclasses
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+DEFAULT_BATCH_SIZE = 100
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+
+def get_fields(item: Any) -> List[str]:
+    """Fields of dataclass item"""
+    return [field.name for field in dataclasses.fields(item)]
+
+
+class Sink(abc.ABC):
+    """Write records with ``fields`` taken from objects or dicts, thread safe"""
+
+    def __init__(self, fields: Sequence[str], batch_size: int = DEFAULT_BATCH_SIZE):
+        self.fields = list(fields)
+        self.batch_size = batch_size
+        self.count = 0
+        self._rows: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def _to_row(self, item: Any) -> tuple:
+        if isinstance(item, dict):
+            return tuple(item.get(field) for field in self.fields)
+        return tuple(getattr(item, field, None) for field in self.fields)
+
+    def write(self, item: Any):
+        with self._lock:
+            self._rows.append(self._to_row(item))
+            self.count += 1
+            if len(self._rows) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            self._write_rows(self._rows)
+            self._rows = []
+
+    @abc.abstractmethod
+    def _write_rows(self, rows: List[tuple]):
+        """Write a batch of rows"""
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class JsonLinesSink(Sink):
+    """One json object per line, ``-`` writes to stdout"""
+
+    def __init__(self, path: str, fields: Sequence[str], batch_size: int = DEFAULT_BATCH_SIZE):
+        super().__init__(fields, batch_size=batch_size)
+        # pylint: disable-next=consider-using-with
+        self._file = sys.stdout if path == "-" else open(path, "a", encoding="utf-8")
+
+    def _write_rows(self, rows: List[tuple]):
+        self._file.writelines(
+            json.dumps(dict(zip(self.fields, row)), ensure_ascii=False) + "\n" for row in rows
+        )
+        self._file.flush()
+
+    def close(self):
+        super().close()
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
+class CsvSink(Sink):
+    """CSV with a header line, the header is not repeated when appending to a file"""
+
+    def __init__(self, path: str, fields: Sequence[str], batch_size: int = DEFAULT_BATCH_SIZE):
+        super().__init__(fields, batch_size=batch_size)
+        exists = os.path.isfile(path) and os.path.getsize(path) > 0
+        # pylint: disable-next=consider-using-with
+        self._file = open(path, "a", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file)
+        if not exists:
+            self._writer.writerow(self.fields)
+
+    def _write_rows(self, rows: List[tuple]):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+
+class SqliteSink(Sink):
+    """Rows inserted into ``table`` with one executemany and commit for each batch"""
+
+    def __init__(self, path: str, fields: Sequence[str], table: str = "items",
+                 batch_size: int = DEFAULT_BATCH_SIZE):                                 # fmt: skip
+        super().__init__(fields, batch_size=batch_size)
+        for name in [table] + self.fields:
+            if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", name):
+                raise ValueError(f"invalid sqlite identifier: {name}")
+        # rows are written by the thread flushing the batch
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(self.fields)})")
+        self._sql = (
+            f"INSERT INTO {table} ({', '.join(self.fields)}) "
+            f"VALUES ({', '.join('?' * len(self.fields))})"
+        )
+
+    def _write_rows(self, rows: List[tuple]):
+        with self._conn:
+            self._conn.executemany(self._sql, rows)
+
+    def close(self):
+        super().close()
+        self._conn.close()
+
+
+def open_sink(path: str, fields: Sequence[str], table: str = "items",
+              batch_size: Optional[int] = None) -> Sink:                                # fmt: skip
+    """Open sink by suffix of path: .csv, .db/.sqlite/.sqlite3, others are JSON Lines"""
+    kwargs: Dict[str, Any] = {"batch_size": batch_size or DEFAULT_BATCH_SIZE}
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == ".csv":
+        return CsvSink(path, fields, **kwargs)
+    if suffix in SQLITE_SUFFIXES:
+        return SqliteSink(path, fields, table=table, **kwargs)
+    return JsonLinesSink(path, fields, **kwargs)
@@ -1,9 +1,64 @@
-from typing import Generator, List, Optional
+import itertools
+import sys
+import unicodedata
+from typing import Any, Dict, Generator, Iterable, List, Optional
 
 import prettytable
 
 TableStyle = prettytable.TableStyle
 
+# rows to compute column widths of StreamTable before printing
+DEFAULT_SAMPLE_SIZE = 5
+
+# horizontal, vertical, then left, middle and right junctions of top, middle and bottom lines
+_BORDERS = {
+    TableStyle.DEFAULT: ("-", "|", "+++", "+++", "+++"),
+    TableStyle.SINGLE_BORDER: ("─", "│", "┌┬┐", "├┼┤", "└┴┘"),
+}
+
+
+def text_width(text: str) -> int:
+    """Display width of text in terminal
+
+    >>> text_width("IMDB")
+    4
+    >>> text_width("豆瓣")
+    4
+    """
+    if text.isascii():
+        return len(text)
+    return sum(
+        0 if unicodedata.combining(char) else 2 if unicodedata.east_asian_width(char) in "WF" else 1
+        for char in text
+    )
+
+
+def fit_text(text: str, width: int, align: str = "c") -> str:
+    """Pad text to display width, text too wide is truncated with an ellipsis
+
+    >>> fit_text("ab", 4, align="r")
+    '  ab'
+    >>> fit_text("豆瓣评分", 5, align="l")
+    '豆瓣…'
+    """
+    used = text_width(text)
+    if used > width:
+        chars, used = [], 0
+        for char in text:
+            char_width = text_width(char)
+            if used + char_width > width - 1:
+                break
+            chars.append(char)
+            used += char_width
+        text = "".join(chars) + "…"
+        used += 1
+    padding = width - used
+    if align == "l":
+        return text + " " * padding
+    if align == "r":
+        return " " * padding + text
+    return " " * (padding // 2) + text + " " * (padding - padding // 2)
+
 
 class DataTable(prettytable.PrettyTable):
     """DataTable class for displaying data in a table format"""
@@ -51,3 +106,105 @@ class DataTable(prettytable.PrettyTable):
 
     def reset_page(self):
         self.start, self.end = 0, len(self.rows)
+
+
+class StreamTable:
+    """Table rendering rows as they arrive from an iterable, in constant memory
+
+    Column widths are fixed by ``widths`` or computed from the titles and the first
+    ``sample_size`` rows, wider values are truncated. The sample is kept small so the first
+    rows are printed soon. The header is repeated every ``page_size`` rows.
+    """
+
+    def __init__(
+        self,
+        fields: List[str],
+        title: Optional[dict] = None,
+        index: bool = False,
+        widths: Optional[Dict[str, int]] = None,
+        sample_size: int = DEFAULT_SAMPLE_SIZE,
+        max_width: int = 80,
+        page_size: int = 50,
+    ):
+        title = title or {}
+        self.data_fields = fields
+        self.titles = [title.get(field, field) for field in fields]
+        self.index = index
+        self.widths = widths or {}
+        self.sample_size = sample_size
+        self.max_width = max_width
+        self.page_size = page_size
+        self.align: Dict[str, str] = {}
+        self.style = TableStyle.DEFAULT
+
+    def set_style(self, style: TableStyle):
+        self.style = style
+
+    def set_align(self, kwargs):
+        self.align.update(kwargs)
+
+    def _get_values(self, item: Any) -> List[str]:
+        if isinstance(item, dict):
+            values = [item.get(field) for field in self.data_fields]
+        else:
+            values = [getattr(item, field) for field in self.data_fields]
+        return ["" if value is None else str(value) for value in values]
+
+    def _get_widths(self, sample: List[List[str]]) -> List[int]:
+        widths = []
+        for i, field in enumerate(self.data_fields):
+            if field in self.widths:
+                widths.append(self.widths[field])
+                continue
+            width = max([text_width(self.titles[i])] + [text_width(row[i]) for row in sample])
+            widths.append(min(width, self.max_width))
+        return widths
+
+    def lines(  # pylint: disable=too-many-locals
+        self, items: Iterable[Any]
+    ) -> Generator[str, None, None]:
+        """Render lines of items, a row is yielded as soon as its item arrives"""
+        horizontal, vertical, top, middle, bottom = _BORDERS.get(
+            self.style, _BORDERS[TableStyle.DEFAULT]
+        )
+        rows = (self._get_values(item) for item in items)
+        # no sample is needed if widths of all columns are fixed
+        sample_size = (
+            0 if all(field in self.widths for field in self.data_fields) else self.sample_size
+        )
+        sample = list(itertools.islice(rows, sample_size))
+        widths = self._get_widths(sample)
+        aligns = [self.align.get(field, "c") for field in self.data_fields]
+        titles = self.titles
+        if self.index:
+            # enough for a million rows
+            widths = [max(len(str(len(sample))), 6)] + widths
+            aligns = ["c"] + aligns
+            titles = ["#"] + titles
+
+        def _border(junctions: str) -> str:
+            left, mid, right = junctions
+            return left + mid.join(horizontal * (width + 2) for width in widths) + right
+
+        def _row(values: List[str], row_aligns: List[str]) -> str:
+            cells = [fit_text(value, width, align)
+                     for value, width, align in zip(values, widths, row_aligns)]       # fmt: skip
+            return f"{vertical} " + f" {vertical} ".join(cells) + f" {vertical}"
+
+        count = 0
+        for count, values in enumerate(itertools.chain(sample, rows), start=1):
+            if count % self.page_size == 1 or self.page_size == 1:
+                if count > 1:
+                    yield _border(bottom)
+                yield _border(top)
+                yield _row(titles, ["c"] * len(titles))
+                yield _border(middle)
+            yield _row(([str(count)] if self.index else []) + values, aligns)
+        if count:
+            yield _border(bottom)
+
+    def print(self, items: Iterable[Any], file=None):
+        """Print items, flushing each line"""
+        file = file or sys.stdout
+        for line in self.lines(items):
+            print(line, file=file, flush=True)
@@ -0,0 +1,148 @@
+"""Cache of short-lived tokens, e.g. signed JWT
+
+Tokens are kept in memory and in a store shared by processes, and refreshed in background
+before expiring, so callers only sign a token when there is no valid one.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from loguru import logger
+
+from pytoys.common import cache
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# seconds before expiring to refresh a token in background
+DEFAULT_REFRESH_BEFORE = 120
+# tokens expiring within the seconds are not used
+MIN_VALIDITY = 10
+
+
+class TokenStore:
+    """Tokens with expiring time stored in a json file readable by the owner only
+
+    Updates hold a lock file, so processes updating tokens at once don't drop each other's.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or cache.get_cache_dir("tokens.json")
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        item = self._load().get(key)
+        return (item["token"], item["exp"]) if item else None
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(f"{self.path}.lock", os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def set(self, key: str, token: Optional[str], exp: float = 0):
+        """Save token, remove it if token is None"""
+        with self._lock, self._file_lock():
+            now = time.time()
+            data = {k: v for k, v in self._load().items() if v.get("exp", 0) > now}
+            if token:
+                data[key] = {"token": token, "exp": exp}
+            else:
+                data.pop(key, None)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+
+
+class TokenManager:
+    """Token of ``key`` signed by ``sign``, which returns the token and its expiring time
+
+    A token expiring within ``refresh_before`` seconds is still returned while a new one is
+    signed in background.
+    """
+
+    def __init__(self, key: str, sign: Callable[[], Tuple[str, float]],
+                 refresh_before: float = DEFAULT_REFRESH_BEFORE,
+                 store: Optional[TokenStore] = None):                                   # fmt: skip
+        self.key = key
+        self.sign = sign
+        self.refresh_before = refresh_before
+        self.store = store
+        self._token: Optional[str] = None
+        self._exp = 0.0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _get_cached(self) -> Tuple[Optional[str], float]:
+        with self._lock:
+            if not self._loaded and self.store:
+                stored = self.store.get(self.key)
+                if stored:
+                    self._token, self._exp = stored
+                self._loaded = True
+            return self._token, self._exp
+
+    def get(self) -> str:
+        token, exp = self._get_cached()
+        remaining = exp - time.time()
+        if not token or remaining <= MIN_VALIDITY:
+            return self.refresh()
+        if remaining <= self.refresh_before:
+            self._refresh_in_background()
+        return token
+
+    def refresh(self) -> str:
+        """Sign a new token"""
+        token, exp = self.sign()
+        logger.debug("token {} refreshed, expires in {:.0f}s", self.key, exp - time.time())
+        with self._lock:
+            self._token, self._exp = token, exp
+        if self.store:
+            self.store.set(self.key, token, exp)
+        return token
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def _refresh():
+            try:
+                self.refresh()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("refresh token {} failed: {}", self.key, e)
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=_refresh, daemon=True).start()
+
+    def invalidate(self):
+        """Drop the token, e.g. when it is rejected"""
+        with self._lock:
+            self._token, self._exp = None, 0.0
+        if self.store:
+            self.store.set(self.key, None)
@@ -0,0 +1,126 @@
+"""Persistent index of crawled medias"""
+
+import dataclasses
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional
+
+from pytoys.common import cache
+
+from . import page
+
+SQL_CREATE = """
+CREATE TABLE IF NOT EXISTS medias (
+    url TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    year TEXT NOT NULL,
+    location TEXT NOT NULL,
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    score_imdb TEXT NOT NULL DEFAULT '',
+    score_douban TEXT NOT NULL DEFAULT '',
+    last_modified TEXT NOT NULL DEFAULT '',
+    fetched REAL NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+)
+"""
+SQL_UPSERT = """
+INSERT INTO medias (url, source, year, location, type, name, created)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(url) DO UPDATE SET
+    source = excluded.source, year = excluded.year, location = excluded.location,
+    type = excluded.type, name = excluded.name
+"""
+# sqlite limits the number of host parameters of one statement
+MAX_PARAMS = 500
+
+
+@dataclasses.dataclass
+class IndexedMedia:
+    media: page.Media
+    # when the score page was fetched, 0 means never
+    fetched: float = 0
+    # Last-Modified of the score page
+    last_modified: str = ""
+    created: float = 0
+
+    def is_fresh(self, ttl: float) -> bool:
+        return bool(self.fetched) and time.time() - self.fetched < ttl
+
+    def apply_scores(self, media: page.Media):
+        media.score_imdb = self.media.score_imdb
+        media.score_douban = self.media.score_douban
+
+
+class MediaIndex(cache.SqliteStore):
+    """Medias keyed by url, with scores and when they were fetched, stored in sqlite"""
+
+    def __init__(self, path: Optional[str] = None):
+        super().__init__(path or cache.get_cache_dir("oneloume-index.db"), [SQL_CREATE])
+
+    @staticmethod
+    def _to_indexed(row) -> IndexedMedia:
+        url, source, year, location, type_, name, imdb, douban = row[:8]
+        last_modified, fetched, created = row[8:]
+        media = page.Media(
+            source=source,
+            year=year,
+            location=location,
+            type=type_,
+            name=name,
+            url=url,
+            score_imdb=imdb,
+            score_douban=douban,
+        )
+        return IndexedMedia(
+            media=media, fetched=fetched, last_modified=last_modified, created=created
+        )
+
+    def get(self, url: str) -> Optional[IndexedMedia]:
+        row = self.db.execute("SELECT * FROM medias WHERE url = ?", (url,)).fetchone()
+        return self._to_indexed(row) if row else None
+
+    def get_many(self, urls: Iterable[str]) -> Dict[str, IndexedMedia]:
+        urls = list(urls)
+        result = {}
+        for start in range(0, len(urls), MAX_PARAMS):
+            chunk = urls[start : start + MAX_PARAMS]
+            rows = self.db.execute(
+                f"SELECT * FROM medias WHERE url IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            result.update({row[0]: self._to_indexed(row) for row in rows})
+        return result
+
+    def add(self, medias: List[page.Media]) -> List[page.Media]:
+        """Add or update medias, scores are kept, return medias not indexed before"""
+        indexed = self.get_many(media.url for media in medias)
+        now = time.time()
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                SQL_UPSERT,
+                [(media.url, media.source, media.year, media.location, media.type, media.name,
+                  now) for media in medias],                                            # fmt: skip
+            )
+            db.execute("COMMIT")
+        except sqlite3.Error:
+            db.execute("ROLLBACK")
+            raise
+        return [media for media in medias if media.url not in indexed]
+
+    def set_scores(self, media: page.Media, last_modified: str = ""):
+        """Save scores of media fetched just now"""
+        self.add([media])
+        self.db.execute(
+            "UPDATE medias SET score_imdb = ?, score_douban = ?, last_modified = ?, fetched = ? "
+            "WHERE url = ?",
+            (media.score_imdb, media.score_douban, last_modified, time.time(), media.url),
+        )
+
+    def touch(self, url: str):
+        """Mark scores as revalidated"""
+        self.db.execute("UPDATE medias SET fetched = ? WHERE url = ?", (time.time(), url))
+
+    def clear(self):
+        self.db.execute("DELETE FROM medias")
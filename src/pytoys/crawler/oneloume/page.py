@@ -1,9 +1,37 @@
 import dataclasses
+import html as htmllib
 import re
-from typing import List
+from typing import List, Optional
 
 import bs4
 
+try:
+    import lxml  # pylint: disable=unused-import
+
+    DEFAULT_PARSER = "lxml"
+except ImportError:  # pragma: no cover
+    DEFAULT_PARSER = "html.parser"
+
+# parser of MediaPage which extracts scores with regex, without building a tree
+REGEX_PARSER = "regex"
+# only parse li.media and a.page-link of list pages
+LIST_PAGE_STRAINER = bs4.SoupStrainer(
+    ["li", "a"], class_=re.compile(r"(^|\s)(media|page-link)(\s|$)")
+)
+RE_COMMENT = re.compile(r"<!--.*?-->", re.S)
+RE_TAG = re.compile(r"<[^>]*>")
+RE_SCORE_IMDB = re.compile(r"IMDb评分.{0,1}([0-9./]+)")
+RE_SCORE_DOUBAN = re.compile(r"豆瓣评分.{0,1}([0-9./]+)")
+
+
+def html_to_text(html: str) -> str:
+    r"""Text of html without building a tree
+
+    >>> html_to_text("<p>IMDb评分&nbsp;<b>7.5</b>/10<!-- x --></p>")
+    'IMDb评分\xa07.5/10'
+    """
+    return htmllib.unescape(RE_TAG.sub("", RE_COMMENT.sub("", html)))
+
 
 @dataclasses.dataclass
 class Media:
@@ -44,13 +72,19 @@ class MediaListPage:
             if page.active:
                 active_index = index
                 break
+        if active_index + 1 >= len(self.paginations):
+            return ""
         return self.paginations[active_index + 1].href
 
     @classmethod
-    def parse_from_html(cls, html: str) -> "MediaListPage":
+    def parse_from_html(cls, html: str, parser: Optional[str] = None,
+                        strain=True) -> "MediaListPage":                                # fmt: skip
+        """Parse list page with bs4 parser (lxml if installed), only medias and paginations
+        are parsed if strain"""
         page = MediaListPage()
-        dom = bs4.BeautifulSoup(html, "html.parser")
-        
+        dom = bs4.BeautifulSoup(html, parser or DEFAULT_PARSER,
+                                parse_only=LIST_PAGE_STRAINER if strain else None)      # fmt: skip
+
         # find all paginations
         for a_page in dom.find_all("a", attrs={"class": "page-link"}) or []:
             page.paginations.append(
@@ -94,13 +128,18 @@ class MediaPage:
         self.score_douban: str = ''
 
     @classmethod
-    def parse_from_html(cls, html: str) -> "MediaPage":
+    def parse_from_html(cls, html: str, parser: Optional[str] = None) -> "MediaPage":
+        """Parse scores, with regex over the text by default or with a bs4 parser"""
         page = MediaPage()
-        dom = bs4.BeautifulSoup(html, "html.parser")
-        matched_imdb = re.findall(r"IMDb评分.{0,1}([0-9./]+)", dom.text)
+        parser = parser or REGEX_PARSER
+        if parser == REGEX_PARSER:
+            text = html_to_text(html)
+        else:
+            text = bs4.BeautifulSoup(html, parser).text
+        matched_imdb = RE_SCORE_IMDB.findall(text)
         if matched_imdb:
             page.score_imdb = matched_imdb[0]
-        matched_douban = re.findall(r"豆瓣评分.{0,1}([0-9./]+)", dom.text)
+        matched_douban = RE_SCORE_DOUBAN.findall(text)
         if matched_douban:
             page.score_douban = matched_douban[0] if matched_douban else ""
 
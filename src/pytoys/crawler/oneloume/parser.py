@@ -1,14 +1,17 @@
+import asyncio
+import collections
 import dataclasses
 import re
 from concurrent import futures
-from typing import List
+from typing import Generator, List, Optional
 
 from loguru import logger
 from tqdm.auto import tqdm
 import requests
 
 
-from pytoys.common import httpclient
+from pytoys.common import aiohttpclient, httpclient
+from . import index as media_index
 from . import page
 
 @dataclasses.dataclass
@@ -32,63 +35,228 @@ class Media:
 
 
 class Web1louMe:
+    # seconds to reuse scores in index without fetching score pages
+    score_ttl: float = 60 * 60 * 24 * 3
+    # requests per second to the site, shared by all threads
+    rate_limit: float = 5
+    rate_burst: int = 10
+    # threads fetching score pages, paced by rate_limit
+    workers: int = httpclient.DEFAULT_POOL_SIZE
 
-    def __init__(self, base_url=None):
-        self.client = httpclient.HttpClient(base_url or "https://www.1lou.me")
+    def __init__(self, base_url=None, parser=None,
+                 index: Optional[media_index.MediaIndex] = None,
+                 rate_limit: Optional[float] = None):                                   # fmt: skip
+        """parser: bs4 parser of pages, by default lxml if installed, scores are extracted
+        with regex
+        index: index of crawled medias, scores still fresh in it are not fetched again
+        rate_limit: requests per second, 0 means no limit
+        """
+        if rate_limit is not None:
+            self.rate_limit = rate_limit
+        self.client = httpclient.HttpClient(base_url or "https://www.1lou.me", retries=3,
+                                            rate_limit=self.rate_limit,
+                                            rate_burst=self.rate_burst)                 # fmt: skip
+        self.parser = parser
+        self.index = index
 
     def _get_dom(self, url: str) -> str:
         resp = self.client.get(url)
         return resp.text
 
+    def _get_score_headers(self, media: Media) -> Optional[dict]:
+        """Headers to fetch score page, None if scores in index are still fresh"""
+        indexed = self.index.get(media.url) if self.index else None
+        if not indexed or not indexed.fetched:
+            return {}
+        if indexed.is_fresh(self.score_ttl):
+            indexed.apply_scores(media)
+            return None
+        return {"If-Modified-Since": indexed.last_modified} if indexed.last_modified else {}
+
+    def _set_scores(self, media: Media, status_code: int, headers, html: str):
+        if status_code == 304:
+            self.index.get(media.url).apply_scores(media)
+            self.index.touch(media.url)
+            return
+        media_page = page.MediaPage.parse_from_html(html, parser=self.parser)
+        media.score_imdb = media_page.score_imdb
+        media.score_douban = media_page.score_douban
+        if self.index:
+            self.index.set_scores(media, last_modified=headers.get("Last-Modified", ""))
+
     def _update_score(self, media: Media):
+        headers = self._get_score_headers(media)
+        if headers is None:
+            return
         try:
-            resp = self.client.get(media.url)
+            resp = self.client.get(media.url, headers=headers)
         except (requests.Timeout, requests.HTTPError):
             logger.exception("获取评分失败(url={})", media.url)
             return
-        media_page = page.MediaPage.parse_from_html(resp.text)
-        media.score_imdb = media_page.score_imdb
-        media.score_douban = media_page.score_douban
+        self._set_scores(media, resp.status_code, resp.headers, resp.text)
 
-    def walk(self, url='/', max_page: int = 1, year: str = "", media_type: str="", name: str="",
-             min_items: int=0, score=False, progress=False) -> List[page.Media]: # fmt: skip
-        total_videos = []
-        for _ in range(max_page):
-            logger.info("查询页面: {}", url)
-            resp = self.client.get(url)
-            media_list_page = page.MediaListPage.parse_from_html(resp.text)
-            filter_medias = []
-            # TODO
-            exclude_keywords=["夸克", "图书", "学习", '无字片源', "音乐"]
-            for media in media_list_page.medias:
-                if '音乐' in media.source:
-                    continue
-                if media.source in exclude_keywords or media.type in exclude_keywords:
-                    continue
-                if year and media.year != year:
-                    continue
-                # 匹配名称，忽略重复
-                if (name and name not in media.name) or (media_type and media.type != media_type):
-                    continue
-                filter_medias.append(media)
-
-            logger.info("找到 {} 个视频", len(filter_medias))
-            total_videos.extend(filter_medias)
-
-            if min_items and len(total_videos) >= min_items:
-                break
-            url = media_list_page.next_page()
-            if not url:
-                break
-
-        logger.info("共找到 {} 个 视频 ...", len(total_videos))
-        if score:
-            logger.info("查询评分 ({}) ...", len(total_videos))
-            with futures.ThreadPoolExecutor() as execotor:
-                results = execotor.map(self._update_score, total_videos)
-                with tqdm(total=len(total_videos), desc="查询进度", disable=not progress) as pbr:
-                    for _ in results:
+    async def _update_scores_async(self, medias: List[Media], progress=False, concurrency=100):
+        async with aiohttpclient.AsyncHttpClient(self.client.base_url, limit=concurrency,
+                                                 rate_limit=self.rate_limit,
+                                                 rate_burst=self.rate_burst) as client:  # fmt: skip
+            with tqdm(total=len(medias), desc="查询进度", disable=not progress) as pbr:
+
+                async def _update_score(media: Media):
+                    headers = self._get_score_headers(media)
+                    if headers is None:
+                        pbr.update(1)
+                        return
+                    try:
+                        resp = await client.get(media.url, headers=headers)
+                    except (httpclient.HttpError, httpclient.RequestError):
+                        logger.exception("获取评分失败(url={})", media.url)
+                        return
+                    finally:
                         pbr.update(1)
+                    self._set_scores(media, resp.status_code, resp.headers, resp.text)
 
-        return total_videos
+                await aiohttpclient.map_limited(_update_score, medias, limit=concurrency)
+
+    def update_scores(self, medias: List[Media], progress=False, use_async=False):
+        """Update scores of medias, with asyncio if use_async else with threads"""
+        logger.info("查询评分 ({}) ...", len(medias))
+        if use_async:
+            asyncio.run(self._update_scores_async(medias, progress=progress))
+            return
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as execotor:
+            results = execotor.map(self._update_score, medias)
+            with tqdm(total=len(medias), desc="查询进度", disable=not progress) as pbr:
+                for _ in results:
+                    pbr.update(1)
+
+    @staticmethod
+    def _match(media: Media, year: str = "", media_type: str = "", name: str = "") -> bool:
+        # TODO
+        exclude_keywords=["夸克", "图书", "学习", '无字片源', "音乐"]
+        if '音乐' in media.source:
+            return False
+        if media.source in exclude_keywords or media.type in exclude_keywords:
+            return False
+        if year and media.year != year:
+            return False
+        # 匹配名称，忽略重复
+        if (name and name not in media.name) or (media_type and media.type != media_type):
+            return False
+        return True
 
+    def _get_list_page(self, url: str) -> page.MediaListPage:
+        logger.info("查询页面: {}", url)
+        resp = self.client.get(url)
+        return page.MediaListPage.parse_from_html(resp.text, parser=self.parser)
+
+    def _iter_pages(self, url: str, max_page: int) -> Generator[page.MediaListPage, None, None]:
+        """Yield list pages, the next page is fetched while the current one is consumed"""
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            task = executor.submit(self._get_list_page, url)
+            try:
+                for index in range(max_page):
+                    media_list_page = task.result()
+                    next_url = media_list_page.next_page()
+                    task = None
+                    if next_url and index + 1 < max_page:
+                        task = executor.submit(self._get_list_page, next_url)
+                    yield media_list_page
+                    if not task:
+                        break
+            finally:
+                if task:
+                    task.cancel()
+
+    def _iter_matched(self, url: str, max_page: int, year: str = "", media_type: str = "",
+                      name: str = "", min_items: int = 0,
+                      incremental=False) -> Generator[Media, None, None]:        # fmt: skip
+        """Yield medias of list pages that match, stop after min_items medias
+
+        If incremental, stop walking after a page without medias new to the index.
+        """
+        total = 0
+        pages = self._iter_pages(url, max_page)
+        try:
+            for media_list_page in pages:
+                new_medias = self.index.add(media_list_page.medias) if self.index else None
+                filter_medias = [media for media in media_list_page.medias
+                                 if self._match(media, year, media_type, name)]  # fmt: skip
+                logger.info("找到 {} 个视频", len(filter_medias))
+                total += len(filter_medias)
+                yield from filter_medias
+                if min_items and total >= min_items:
+                    break
+                if incremental and self.index and not new_medias:
+                    logger.info("没有新的视频, 停止查询")
+                    break
+        finally:
+            pages.close()
+        logger.info("共找到 {} 个 视频 ...", total)
+
+    def _iter_scored(self, medias: Generator[Media, None, None], score=False, progress=False,
+                     window: int = 32,
+                     close_progress=False) -> Generator[Media, None, None]:     # fmt: skip
+        """Yield medias in order, with scores fetched by threads if score
+
+        At most ``window`` medias are waiting for scores. If close_progress, the progress
+        bar is closed before the first media is yielded.
+        """
+        pending: collections.deque = collections.deque()
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as executor, \
+                tqdm(desc="查询进度", disable=not progress or not score) as pbr:  # fmt: skip
+
+            def _pop() -> Media:
+                media, task = pending.popleft()
+                if task:
+                    task.result()
+                    pbr.update(1)
+                if close_progress:
+                    pbr.close()
+                return media
+
+            try:
+                for media in medias:
+                    task = executor.submit(self._update_score, media) if score else None
+                    pending.append((media, task))
+                    while pending and (len(pending) > window or not pending[0][1]
+                                       or pending[0][1].done()):                # fmt: skip
+                        yield _pop()
+                while pending:
+                    yield _pop()
+            finally:
+                medias.close()
+                for _, task in pending:
+                    if task:
+                        task.cancel()
+
+    def iter_walk(self, url='/', max_page: int = 1, year: str = "", media_type: str="",
+                  name: str="", min_items: int=0, score=False, progress=False,
+                  window: int = 32, incremental=False,
+                  close_progress=False) -> Generator[page.Media, None, None]:      # fmt: skip
+        """Walk list pages and yield medias in page order as soon as they are ready
+
+        Score pages are fetched as soon as medias are found, at most ``window`` medias are
+        waiting for scores. If close_progress, the progress bar is closed before the first media
+        is yielded, so it does not mix with printed rows.
+        If incremental, stop walking after a page without medias new to the index.
+        """
+        medias = self._iter_matched(url, max_page, year=year, media_type=media_type, name=name,
+                                    min_items=min_items, incremental=incremental)  # fmt: skip
+        yield from self._iter_scored(medias, score=score, progress=progress, window=window,
+                                     close_progress=close_progress)             # fmt: skip
+
+    def walk(self, url='/', max_page: int = 1, year: str = "", media_type: str="", name: str="",
+             min_items: int=0, score=False, progress=False,
+             use_async=False, incremental=False) -> List[page.Media]:           # fmt: skip
+        if not use_async:
+            return list(self.iter_walk(url=url, max_page=max_page, year=year, media_type=media_type,
+                                       name=name, min_items=min_items, score=score,
+                                       progress=progress, incremental=incremental))  # fmt: skip
+
+        total_videos = list(self.iter_walk(url=url, max_page=max_page, year=year,
+                                           media_type=media_type, name=name,
+                                           min_items=min_items,
+                                           incremental=incremental))            # fmt: skip
+        if score:
+            self.update_scores(total_videos, progress=progress, use_async=use_async)
+        return total_videos
@@ -1,10 +1,26 @@
 import abc
-from typing import List
+import collections
+import dataclasses
+import os
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
 from urllib import parse
 
+import requests
 from loguru import logger
+from tqdm.auto import tqdm
 
-from pytoys.common import httpclient
+from pytoys.common import downloader, httpclient
+from pytoys.github import stats as proxy_stats
+
+PROBE_SIZE = 64 * 1024
+PROBE_TIMEOUT = 10
+# seconds to wait for other mirrors after the first probe succeeded
+PROBE_GRACE = 0.5
+# seconds of throughput window to decide a mirror is too slow
+HEDGE_WINDOW = 5
 
 
 class AllProxyDownloadFailed(Exception):
@@ -45,18 +61,295 @@ class AkamsProxy(GitProxyServer):
         return [f"{p}/{github_url}" for p in subproxy_list]
 
 
-def download(github_url, timeout=60 * 10):
-    proxy_list = [GhProxy, AkamsProxy]
-    for proxy_cls in proxy_list:
-        proxy_driver: GhProxy | AkamsProxy = proxy_cls()
-        logger.info("downlowd with proxy {}", proxy_cls.__name__)
-        for proxy_url in proxy_driver.get_proxy_urls(github_url):
+PROXY_LIST = [GhProxy, AkamsProxy]
+
+
+@dataclasses.dataclass
+class ProbeResult:
+    url: str
+    # seconds to first byte
+    ttfb: float = 0
+    # bytes per second
+    throughput: float = 0
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.throughput > 0
+
+    @property
+    def score(self) -> float:
+        """Estimated seconds to fetch the probe, lower is better"""
+        return self.ttfb + PROBE_SIZE / self.throughput if self.ok else float("inf")
+
+
+def get_proxy_urls(github_url) -> List[str]:
+    return [url for proxy_cls in PROXY_LIST for url in proxy_cls().get_proxy_urls(github_url)]
+
+
+def probe(url, stop: Optional[threading.Event] = None, timeout=PROBE_TIMEOUT) -> ProbeResult:
+    """Fetch the first PROBE_SIZE bytes of url, measure ttfb and throughput"""
+    result = ProbeResult(url)
+    start = time.monotonic()
+    try:
+        resp = httpclient.get_session(url).get(
+            url, headers={"Range": f"bytes=0-{PROBE_SIZE - 1}"}, stream=True, timeout=timeout
+        )
+        with resp:
+            resp.raise_for_status()
+            result.ttfb = time.monotonic() - start
+            size = 0
+            for chunk in resp.iter_content(chunk_size=8192):
+                size += len(chunk)
+                if size >= PROBE_SIZE or (stop and stop.is_set()):
+                    break
+            elapsed = time.monotonic() - start - result.ttfb
+            result.throughput = size / max(elapsed, 1e-6)
+    except (requests.RequestException, IOError) as e:
+        result.error = e
+    logger.debug("probe {}: ttfb={:.3f}s, throughput={:.0f}B/s, error={}",
+                 url, result.ttfb, result.throughput, result.error)             # fmt: skip
+    return result
+
+
+def race(urls: List[str], timeout=PROBE_TIMEOUT, grace=PROBE_GRACE,
+         stats: Optional[proxy_stats.ProxyStats] = None) -> List[ProbeResult]:  # fmt: skip
+    """Probe all urls at once, return succeeded results ordered by score
+
+    Once a probe succeeded, other probes have ``grace`` seconds to finish, the losers are
+    stopped then. Probes run in daemon threads, the ones still connecting do not block
+    exiting.
+    """
+    stop = threading.Event()
+    answers: queue.Queue = queue.Queue()
+    for url in urls:
+        threading.Thread(target=lambda url: answers.put(probe(url, stop, timeout)), args=(url,),
+                         daemon=True).start()                                   # fmt: skip
+    results: List[ProbeResult] = []
+    deadline = time.monotonic() + timeout
+    try:
+        for _ in urls:
+            try:
+                result = answers.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            results.append(result)
+            if stats:
+                stats.record(result.url, result.ok, latency=result.ttfb,
+                             throughput=result.throughput)                      # fmt: skip
+            if result.ok:
+                deadline = min(deadline, time.monotonic() + grace)
+    finally:
+        stop.set()
+    return sorted((r for r in results if r.ok), key=lambda r: r.score)
+
+
+class _PartFile:
+    """File appended by urls in turn
+
+    ``total`` is the file size and ``filename`` the file name told by the first response.
+    """
+
+    def __init__(self, path: str, progressbar):
+        self.path = path
+        self.progressbar = progressbar
+        self.total = 0
+        self.filename: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def check_range(self, url, resp: requests.Response):
+        """Raise RequestError if resp does not continue the file of the previous responses"""
+        offset = self.size
+        if offset and resp.status_code != 206:
+            raise httpclient.RequestError(f"{url} does not support range")
+        content_range = downloader.parse_content_range(resp.headers.get("Content-Range"))
+        if content_range:
+            start, total = content_range[0], content_range[2] or 0
+        else:
+            start, total = 0, int(resp.headers.get("Content-Length") or 0)
+        if start != offset:
+            raise httpclient.RequestError(f"{url} returns range from {start}, expected {offset}")
+        if self.total and total and total != self.total:
+            raise httpclient.RequestError(f"{url} returns size {total}, expected {self.total}")
+        self.total = self.total or total
+        self.filename = self.filename or httpclient.get_filename(resp.headers, resp.request.url)
+        if self.progressbar.total != self.total:
+            self.progressbar.reset(total=self.total)
+            self.progressbar.update(offset)
+
+
+def _stream(url, part: _PartFile, timeout=None, min_speed: Optional[float] = None,
+            on_response: Optional[Callable[[], None]] = None) -> bool:                  # fmt: skip
+    """Append the rest of url to part from its current size
+
+    ``on_response`` is called once the response headers are received.
+    Return False if throughput is lower than min_speed, True if completed
+    """
+    offset = part.size
+    headers = {"Range": f"bytes={offset}-", "Accept-Encoding": "identity"} if offset else {}
+    resp = httpclient.get_session(url).get(url, headers=headers, stream=True, timeout=timeout)
+    if on_response:
+        on_response()
+    with resp:
+        resp.raise_for_status()
+        part.check_range(url, resp)
+        with open(part.path, "ab") as f:
+            window_start, window_size = time.monotonic(), 0
+            for chunk in resp.iter_content(chunk_size=256 * 1024):
+                f.write(chunk)
+                part.progressbar.update(len(chunk))
+                window_size += len(chunk)
+                elapsed = time.monotonic() - window_start
+                if elapsed >= HEDGE_WINDOW:
+                    if min_speed and window_size / elapsed < min_speed:
+                        logger.warning("{} is too slow ({:.0f}B/s)", url, window_size / elapsed)
+                        return False
+                    window_start, window_size = time.monotonic(), 0
+    return True
+
+
+def _stream_with_stats(url, part: _PartFile, timeout=None, min_speed: Optional[float] = None,
+                       stats: Optional[proxy_stats.ProxyStats] = None) -> bool:  # fmt: skip
+    """_stream recording the result, time to first byte and throughput of url in stats"""
+    offset, start = part.size, time.monotonic()
+    ttfb: List[float] = []
+    try:
+        completed = _stream(url, part, timeout=timeout, min_speed=min_speed,
+                            on_response=lambda: ttfb.append(time.monotonic() - start))  # fmt: skip
+    except (requests.RequestException, httpclient.RequestError):
+        if stats:
+            stats.record(url, False)
+        raise
+    if stats:
+        elapsed = max(time.monotonic() - start, 1e-6)
+        stats.record(url, True, latency=ttfb[0] if ttfb else None,
+                     throughput=(part.size - offset) / elapsed)                         # fmt: skip
+    return completed
+
+
+def download_hedged(urls: List[str], output_file: Optional[str] = None, timeout=None,
+                    min_speed: Optional[float] = None,
+                    stats: Optional[proxy_stats.ProxyStats] = None) -> str:     # fmt: skip
+    """Download from urls in order, switch to next url if the current one is too slow
+
+    All urls must serve the same file, the download continues from the written bytes if
+    the range and file size returned match. Urls dropped for being too slow are tried
+    again without min_speed after the others.
+    The written bytes are kept in ``<file>.part``, a later download of the same file
+    resumes from it. Return the saved file, named by the first response as get_and_save
+    does unless output_file is given.
+    """
+    if not urls:
+        raise AllProxyDownloadFailed(output_file)
+    # the response is not known yet, so the partial file is named by the url
+    name = output_file or httpclient.get_filename({}, urls[0])
+    pending, slow = collections.deque(urls), collections.deque()
+    with tqdm(desc=f"📥 {os.path.basename(name)}", unit_scale=True,
+              leave=False) as progressbar:                                      # fmt: skip
+        part = _PartFile(f"{name}.part", progressbar)
+        if part.size:
+            logger.info("resume {} from {} bytes", part.path, part.size)
+        while pending or slow:
+            # the last url and the slow ones have to complete the download
+            limit = min_speed if pending and (len(pending) > 1 or slow) else None
+            url = (pending or slow).popleft()
+            logger.debug("download with proxy url: {}", url)
             try:
-                logger.debug("download with proxy url: {}", proxy_url)
-                httpclient.get_and_save(proxy_url, timeout=timeout, progress=True)
-                return
-            except (httpclient.HttpError, httpclient.RequestError) as e:
-                logger.warning("get with proxy {} failed, {}", proxy_url, e)
+                completed = _stream_with_stats(url, part, timeout=timeout, min_speed=limit,
+                                               stats=stats)                     # fmt: skip
+            except (requests.RequestException, httpclient.RequestError) as e:
+                logger.warning("get with proxy {} failed, {}", url, e)
+                continue
+            if not completed:
+                slow.append(url)
+                continue
+            if part.total and part.size != part.total:
+                logger.warning("get with proxy {} incomplete", url)
                 continue
+            output_file = output_file or part.filename
+            os.replace(part.path, output_file)
+            return output_file
+    raise AllProxyDownloadFailed(name)
+
+
+def download(github_url, timeout=60 * 10, segments=4, race_mode=False,
+             min_speed: Optional[float] = None):                                # fmt: skip
+    """Download github url with proxies
+
+    Proxy urls are tried in the order of mirror scores recorded by previous downloads.
+
+    :param race_mode: probe all proxy urls at once and download from the fastest
+    :param min_speed: bytes per second, in race mode switch to the next fastest proxy if
+        the current one is slower
+    """
+    # proxy urls of the same file differ, so the file is also recorded by the github url
+    store = httpclient.get_default_store()
+    if httpclient.link_from_store(github_url, default_filename=github_url.split("/")[-1]):
+        return
+    stats = proxy_stats.ProxyStats()
+    try:
+        output_file = None
+        if not race_mode:
+            urls = stats.sort(get_proxy_urls(github_url))
+            output_file = _download_any(urls, timeout=timeout, segments=segments, stats=stats)
+        else:
+            results = race(get_proxy_urls(github_url), stats=stats)
+            if not results:
+                raise AllProxyDownloadFailed(github_url)
+            logger.info("fastest proxy: {}", results[0].url)
+            urls = [result.url for result in results]
+            if min_speed:
+                output_file = download_hedged(urls, timeout=timeout, min_speed=min_speed,
+                                              stats=stats)                      # fmt: skip
+            else:
+                output_file = _download_any(urls, timeout=timeout, segments=segments,
+                                            stats=stats)                        # fmt: skip
+        if not output_file:
+            raise AllProxyDownloadFailed(github_url)
+        if store:
+            store.add(output_file, url=github_url)
+    finally:
+        stats.save()
+
+
+def _download_with_stats(url, timeout=None, segments=4,
+                         stats: Optional[proxy_stats.ProxyStats] = None) -> str:        # fmt: skip
+    """get_and_save recording the result, time to first byte and throughput of url in stats"""
+    start = time.monotonic()
+    # bytes received in this run, resumed bytes are not counted in throughput
+    received: List[int] = []
+    ttfb: List[float] = []
+
+    def _on_data(size: int):
+        if not ttfb:
+            ttfb.append(time.monotonic() - start)
+        received.append(size)
+
+    try:
+        output_file = httpclient.get_and_save(url, timeout=timeout, progress=True,
+                                              segments=segments, on_data=_on_data)      # fmt: skip
+    except (httpclient.HttpError, httpclient.RequestError):
+        if stats:
+            stats.record(url, False)
+        raise
+    if stats:
+        elapsed = max(time.monotonic() - start, 1e-6)
+        stats.record(url, True, latency=ttfb[0] if ttfb else None,
+                     throughput=sum(received) / elapsed)                                # fmt: skip
+    return output_file
+
 
-    raise AllProxyDownloadFailed(github_url)
+def _download_any(urls: List[str], timeout=None, segments=4,
+                  stats: Optional[proxy_stats.ProxyStats] = None) -> Optional[str]:  # fmt: skip
+    """Download with the first url succeeded, return the saved file"""
+    for proxy_url in urls:
+        logger.info("download with proxy url: {}", proxy_url)
+        try:
+            return _download_with_stats(proxy_url, timeout=timeout, segments=segments,
+                                        stats=stats)                                    # fmt: skip
+        except (httpclient.HttpError, httpclient.RequestError) as e:
+            logger.warning("get with proxy {} failed, {}", proxy_url, e)
+    return None
@@ -0,0 +1,143 @@
+"""Health stats of github proxy mirrors"""
+
+import dataclasses
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib import parse
+
+from loguru import logger
+
+from pytoys.common import cache
+
+# weight of the newest sample
+EWMA_ALPHA = 0.3
+# score of mirrors never used if no mirror succeeded, in seconds
+DEFAULT_SCORE = 5.0
+SCORE_SIZE = 1024 * 1024
+
+
+def get_mirror(url: str) -> str:
+    """Mirror of a proxy url
+
+    >>> get_mirror("https://gh.llkk.cc/https://github.com/a/b/releases/download/v1/c.zip")
+    'https://gh.llkk.cc'
+    """
+    result = parse.urlparse(url)
+    return f"{result.scheme}://{result.netloc}"
+
+
+def ewma(old: float, new: float, count: int) -> float:
+    return new if count <= 1 else EWMA_ALPHA * new + (1 - EWMA_ALPHA) * old
+
+
+@dataclasses.dataclass
+class MirrorStat:
+    mirror: str
+    # seconds to first byte
+    latency: float = 0
+    # bytes per second
+    throughput: float = 0
+    successes: int = 0
+    failures: int = 0
+    failure_rate: float = 0
+    updated: float = 0
+
+    @property
+    def total(self) -> int:
+        return self.successes + self.failures
+
+    @property
+    def score(self) -> float:
+        return self.get_score()
+
+    def get_score(self, prior: float = DEFAULT_SCORE) -> float:
+        """Estimated seconds to fetch 1MiB, penalized by failure rate, lower is better
+
+        ``prior`` is the estimated seconds of a mirror never succeeded.
+        """
+        if not self.successes:
+            return prior * (1 + 10 * self.failure_rate)
+        seconds = self.latency + (SCORE_SIZE / self.throughput if self.throughput else 0)
+        return seconds * (1 + 10 * self.failure_rate)
+
+    def record(self, ok: bool, latency: Optional[float] = None,
+               throughput: Optional[float] = None):                                     # fmt: skip
+        if ok:
+            self.successes += 1
+            if latency is not None:
+                self.latency = ewma(self.latency, latency, self.successes)
+            if throughput:
+                self.throughput = ewma(self.throughput or throughput, throughput,
+                                       self.successes)                                  # fmt: skip
+        else:
+            self.failures += 1
+        self.failure_rate = ewma(self.failure_rate, 0 if ok else 1, self.total)
+        self.updated = time.time()
+
+
+class ProxyStats:
+    """Mirror stats persisted in the pytoys cache directory"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or cache.get_cache_dir("proxy-stats.json")
+        self.mirrors: Dict[str, MirrorStat] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.mirrors = {item["mirror"]: MirrorStat(**item) for item in data}
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning("ignore invalid proxy stats {}: {}", self.path, e)
+
+    def save(self):
+        with self._lock:
+            data = [dataclasses.asdict(stat) for stat in self.mirrors.values()]
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def reset(self):
+        with self._lock:
+            self.mirrors = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def get(self, url: str) -> MirrorStat:
+        mirror = get_mirror(url)
+        return self.mirrors.get(mirror) or MirrorStat(mirror)
+
+    def record(self, url: str, ok: bool, latency: Optional[float] = None,
+               throughput: Optional[float] = None):                                     # fmt: skip
+        mirror = get_mirror(url)
+        with self._lock:
+            stat = self.mirrors.setdefault(mirror, MirrorStat(mirror))
+            stat.record(ok, latency=latency, throughput=throughput)
+
+    def get_prior(self) -> float:
+        """Score of mirrors never succeeded, the worst score of the mirrors succeeded
+
+        So mirrors not measured are tried after the known good ones.
+        """
+        with self._lock:
+            scores = [stat.get_score() for stat in self.mirrors.values() if stat.successes]
+        return max(scores) if scores else DEFAULT_SCORE
+
+    def _get_sort_key(self, stat: MirrorStat, prior: float) -> tuple:
+        return stat.get_score(prior), not stat.successes
+
+    def sort(self, urls: List[str]) -> List[str]:
+        """Order urls by score of their mirrors, the best first"""
+        prior = self.get_prior()
+        return sorted(urls, key=lambda url: self._get_sort_key(self.get(url), prior))
+
+    def list(self) -> List[MirrorStat]:
+        prior = self.get_prior()
+        return sorted(self.mirrors.values(), key=lambda stat: self._get_sort_key(stat, prior))
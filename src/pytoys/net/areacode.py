@@ -1,21 +1,183 @@
+"""Administrative area codes of China
+
+Codes are downloaded once and kept in a versioned local file, names are resolved with an
+index built from the codes, by full name, short name (without suffix like 省, 市 or 区),
+prefix, or a close match if fuzzy.
+"""
+
+import bisect
+import difflib
+import gzip
+import json
+import os
+import re
+import time
 from functools import lru_cache
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from pytoys.common import cache, httpclient
+
+# increase when the format of stored file changes, files of other versions are refetched
+STORE_VERSION = 1
+# longer suffixes first
+NAME_SUFFIXES = (
+    "特别行政区", "维吾尔自治区", "壮族自治区", "回族自治区", "自治区", "自治州", "自治县",
+    "地区", "新区", "林区", "省", "市", "区", "县", "盟", "旗",
+)                                                                                       # fmt: skip
+RE_SEPARATORS = re.compile(r"[,，\s/]+")
+
+
+def get_short_name(name: str) -> str:
+    """Name without suffix, kept if the short name is too short
+
+    >>> get_short_name("广西壮族自治区"), get_short_name("东城区"), get_short_name("和县")
+    ('广西', '东城', '和县')
+    """
+    for suffix in NAME_SUFFIXES:
+        if name.endswith(suffix) and len(name) - len(suffix) >= 2:
+            return name[: -len(suffix)]
+    return name
+
+
+def get_parent_codes(code: str) -> List[str]:
+    """Codes of province and city of a 6-digit code, from top to bottom
+
+    >>> get_parent_codes("110101")
+    ['110000', '110100']
+    """
+    parents = [code[:2] + "0000", code[:4] + "00"]
+    return [parent for parent in parents if parent != code and not code.endswith("0000")]
+
+
+class AreaCodeIndex:
+    """Reverse index from area names to codes
+
+    >>> index = AreaCodeIndex({"110000": "北京市", "110100": "市辖区", "110101": "东城区",
+    ...                        "220000": "吉林省", "220100": "长春市", "220104": "朝阳区",
+    ...                        "110105": "朝阳区"})
+    >>> index.find("北京,朝阳区"), index.find("东城"), index.find("长春 朝阳")
+    (['110105'], ['110101'], ['220104'])
+    >>> index.find("朝阳区"), index.find("吉"), index.find("东成区")
+    (['110105', '220104'], ['220000'], [])
+    >>> index.find("东成区", fuzzy=True)
+    ['110101']
+    >>> index.get_names("110101")
+    ['北京市', '市辖区', '东城区']
+    """
 
-from pytoys.common import httpclient
+    def __init__(self, codes: Dict[str, str]):
+        self.codes = codes
+        self._names: Dict[str, List[str]] = {}
+        for code, name in sorted(codes.items(), key=lambda item: self._get_sort_key(item[0])):
+            for key in dict.fromkeys([name, get_short_name(name)]):
+                self._names.setdefault(key, []).append(code)
+        self._sorted_names = sorted(self._names)
+
+    @staticmethod
+    def _get_sort_key(code: str) -> tuple:
+        # provinces first, then cities and districts
+        return len(get_parent_codes(code)), code
+
+    def get_names(self, code: str) -> List[str]:
+        """Names from province to the area of code"""
+        return [self.codes[c] for c in get_parent_codes(code) + [code] if c in self.codes]
+
+    def search_prefix(self, prefix: str) -> List[str]:
+        """Codes of areas with name starting with prefix"""
+        codes: Dict[str, None] = {}
+        start = bisect.bisect_left(self._sorted_names, prefix)
+        for name in self._sorted_names[start:]:
+            if not name.startswith(prefix):
+                break
+            codes.update(dict.fromkeys(self._names[name]))
+        return sorted(codes, key=self._get_sort_key)
+
+    def _match(self, name: str, fuzzy: bool) -> List[str]:
+        codes = self._names.get(name) or self._names.get(get_short_name(name))
+        if codes:
+            return codes
+        codes = self.search_prefix(name)
+        if codes or not fuzzy:
+            return codes
+        matched = difflib.get_close_matches(name, self._sorted_names, n=3, cutoff=0.6)
+        return list(dict.fromkeys(code for key in matched for code in self._names[key]))
+
+    def _is_parent(self, code: str, name: str) -> bool:
+        for parent in get_parent_codes(code):
+            parent_name = self.codes.get(parent, "")
+            if parent_name.startswith(name) or get_short_name(parent_name) == name:
+                return True
+        return False
+
+    def find(self, area: str, fuzzy=False) -> List[str]:
+        """Codes of area, best matched first
+
+        Area is a name or names from province to district, separated by comma or space.
+        Names are matched exactly or by prefix, and also by close names if fuzzy.
+        """
+        names = [name for name in RE_SEPARATORS.split(area.strip()) if name]
+        if not names:
+            return []
+        codes = self._match(names[-1], fuzzy=fuzzy)
+        for name in names[:-1]:
+            codes = [code for code in codes if self._is_parent(code, name)]
+        return codes
 
 
 class WenyisoApi(httpclient.HttpClient):
 
-    def __init__(self):
-        super().__init__("https://www.wenyiso.com")
+    # seconds to use the stored codes before refreshing
+    store_ttl = 60 * 60 * 24 * 7
+
+    def __init__(self, path: Optional[str] = None, base_url: Optional[str] = None):
+        super().__init__(base_url or "https://www.wenyiso.com")
+        self.path = path or cache.get_cache_dir("areacodes.json.gz")
+
+    def _load(self) -> Optional[dict]:
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.debug("load area codes from {} failed: {}", self.path, e)
+            return None
+        return data if data.get("version") == STORE_VERSION else None
+
+    def _save(self, codes: Dict[str, str]):
+        data = {"version": STORE_VERSION, "fetched": time.time(), "codes": codes}
+        with gzip.open(f"{self.path}.tmp", "wt", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def refresh(self) -> Dict[str, str]:
+        """Download area codes and store them"""
+        resp = self.get("/jres/json/quhuadaima/list.json", cache_ttl=0)
+        codes = resp.json()
+        self._save(codes)
+        self.get_index.cache_clear()
+        return codes
 
-    @lru_cache()
     def get_areacode_list(self) -> dict:
-        resp = self.get("/jres/json/quhuadaima/list.json")
-        return resp.json()
+        """Stored area codes, refreshed if older than store_ttl"""
+        data = self._load()
+        if data and time.time() - data["fetched"] < self.store_ttl:
+            return data["codes"]
+        try:
+            return self.refresh()
+        except (httpclient.HttpError, httpclient.RequestError, ValueError) as e:
+            if not data:
+                raise
+            logger.warning("refresh area codes failed, use the stored: {}", e)
+            return data["codes"]
+
+    @lru_cache()
+    def get_index(self) -> AreaCodeIndex:
+        return AreaCodeIndex(self.get_areacode_list())
 
-    def get_areacode(self, area) -> str:
-        arearcodes = self.get_areacode_list()
-        code = [k for k, v in arearcodes.items() if v == area]
-        if not code:
+    def get_areacode(self, area, fuzzy=False) -> str:
+        """Code of area best matched, a close name is matched only if fuzzy"""
+        codes = self.get_index().find(area, fuzzy=fuzzy)
+        if not codes:
             raise ValueError(f"area code is not found for {area}")
-        return code[0]
+        return codes[0]
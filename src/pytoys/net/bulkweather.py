@@ -0,0 +1,131 @@
+"""Weather of many cities"""
+
+import dataclasses
+import json
+import re
+import time
+from concurrent import futures
+from typing import Generator, Iterable, Optional, Tuple
+
+from loguru import logger
+
+from pytoys.common import cache, httpclient
+from pytoys.net import location, locator
+from pytoys.net import weather as net_weather
+
+# cities are not moved, keep resolved cities for a long time
+CITY_CACHE_TTL = 60 * 60 * 24 * 365
+DEFAULT_WEATHER_TTL = 60 * 10
+ERRORS = (httpclient.HttpError, httpclient.RequestError, IOError, ValueError, TypeError)
+ROW_FIELDS = [
+    "city", "location", "weather", "temperature", "winddirection", "windpower", "humidity",
+    "reporttime", "error",
+]                                                                                       # fmt: skip
+
+SQL_CREATE = """
+CREATE TABLE IF NOT EXISTS weathers (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    created REAL NOT NULL
+)
+"""
+
+
+def parse_city(city: str) -> Tuple[Optional[str], str]:
+    """Administrative area and name of city given as "省,市" or "市"
+
+    >>> parse_city("北京市，东城区"), parse_city(" 杭州 ")
+    (('北京市', '东城区'), (None, '杭州'))
+    """
+    values = [value.strip() for value in re.split(r",|，", city.strip())]
+    if not values[-1]:
+        raise ValueError(f"invalid city: {city}")
+    if len(values) == 1:
+        return None, values[0]
+    return values[0] or None, values[1]
+
+
+class WeatherCache(cache.SqliteStore):
+    """Weathers stored in sqlite, keyed by area code"""
+
+    def __init__(self, path: Optional[str] = None, ttl: float = DEFAULT_WEATHER_TTL):
+        super().__init__(path or cache.get_cache_dir("weathers.db"), [SQL_CREATE])
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[net_weather.Weather]:
+        row = self.db.execute(
+            "SELECT data FROM weathers WHERE key = ? AND created > ?",
+            (key, time.time() - self.ttl),
+        ).fetchone()
+        if not row:
+            return None
+        data = json.loads(row[0])
+        return net_weather.Weather(**{**data, "location": location.Location(**data["location"])})
+
+    def set(self, key: str, city_weather: net_weather.Weather):
+        self.db.execute(
+            "INSERT OR REPLACE INTO weathers VALUES (?, ?, ?)",
+            (key, json.dumps(dataclasses.asdict(city_weather), ensure_ascii=False), time.time()),
+        )
+
+
+@dataclasses.dataclass
+class CityWeather:
+    city: str
+    weather: Optional[net_weather.Weather] = None
+    error: str = ""
+
+    def to_dict(self) -> dict:
+        """Flat row of ROW_FIELDS"""
+        row = {"city": self.city, "error": self.error}
+        if self.weather:
+            row.update({field: getattr(self.weather, field) for field in ROW_FIELDS[2:-1]})
+            row["location"] = self.weather.location.info()
+        return row
+
+
+class BulkWeather:
+    """Query weather of cities concurrently, resolved cities and weathers are cached"""
+
+    def __init__(self, api: Optional[net_weather.HefengWeatherApi] = None,
+                 city_cache: Optional[locator.LocationCache] = None,
+                 weather_cache: Optional[WeatherCache] = None, concurrency: int = 8):   # fmt: skip
+        self.api = api or net_weather.HefengWeatherApi()
+        self.city_cache = city_cache
+        self.weather_cache = weather_cache
+        self.concurrency = concurrency
+
+    def resolve(self, city: str) -> location.Location:
+        """Location of city, the first one if more than one matched"""
+        adm, name = parse_city(city)
+        key = f"{adm or ''},{name}"
+        city_location = self.city_cache.get(key) if self.city_cache else None
+        if city_location:
+            return city_location
+        locations = self.api.lookup_city(name, adm=adm)
+        if not locations:
+            raise ValueError(f"city not found: {city}")
+        if self.city_cache:
+            self.city_cache.set(key, locations[0])
+        return locations[0]
+
+    def get_weather(self, city: str) -> CityWeather:
+        try:
+            city_location = self.resolve(city)
+            city_weather = None
+            if self.weather_cache:
+                city_weather = self.weather_cache.get(city_location.area_code)
+            if not city_weather:
+                city_weather = self.api.get_weather(city_location)
+                if self.weather_cache:
+                    self.weather_cache.set(city_location.area_code, city_weather)
+        except ERRORS as e:
+            logger.warning("get weather of {} failed: {}", city, e)
+            return CityWeather(city=city, error=str(e))
+        return CityWeather(city=city, weather=city_weather)
+
+    def query(self, cities: Iterable[str]) -> Generator[CityWeather, None, None]:
+        """Yield weather of each distinct city in input order"""
+        cities = list(dict.fromkeys(city.strip() for city in cities if city.strip()))
+        with futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            yield from executor.map(self.get_weather, cities)
@@ -0,0 +1,206 @@
+"""Offline IP location database
+
+The database is built from a CSV of IP ranges and saved as one binary file:
+
+    MAGIC | header length | json header | starts | ends | record ids | records
+
+``starts`` and ``ends`` are sorted uint32 arrays of inclusive ranges, each range points to
+a record of string ids and strings are interned in the header. The file is memory mapped
+and looked up by bisect, without loading the arrays.
+"""
+
+import array
+import bisect
+import csv
+import ipaddress
+import json
+import mmap
+import os
+import socket
+import struct
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pytoys.common import cache
+from pytoys.net import location
+
+MAGIC = b"PYTIPDB1"
+VERSION = 1
+# Location fields which can be imported
+FIELDS = (
+    "continent", "country", "country_code", "province", "city", "district", "isp",
+    "area_code", "zip_code", "time_zone", "longitude", "latitude", "location",
+)                                                                                       # fmt: skip
+ITEM_SIZE = 4
+_ITEM_TYPE = "I" if array.array("I").itemsize == ITEM_SIZE else "L"
+
+
+def get_default_path() -> str:
+    return cache.get_cache_dir("ipdb.bin")
+
+
+def parse_range(row: Dict[str, str]) -> Tuple[int, int]:
+    """Inclusive integer range of a row with network or start and end
+
+    >>> parse_range({"network": "1.2.3.0/24"})
+    (16909056, 16909311)
+    >>> parse_range({"start": "1.2.3.4", "end": "16909060"})
+    (16909060, 16909060)
+    """
+    if row.get("network"):
+        network = ipaddress.IPv4Network(row["network"].strip(), strict=False)
+        return int(network.network_address), int(network.broadcast_address)
+
+    def _to_int(value: str) -> int:
+        value = value.strip()
+        return int(value) if value.isdigit() else int(ipaddress.IPv4Address(value))
+
+    return _to_int(row["start"]), _to_int(row["end"])
+
+
+def _read_csv(csv_file: str, strings: Dict[str, int], records: Dict[Tuple[int, ...], int]):
+    """Fields and sorted ranges of CSV, strings and records are interned to the dicts"""
+    ranges: List[Tuple[int, int, int]] = []
+    with open(csv_file, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        columns = set(reader.fieldnames or [])
+        if "network" not in columns and not {"start", "end"} <= columns:
+            raise ValueError("network or start and end columns are required")
+        fields = [field for field in FIELDS if field in columns]
+        for line, row in enumerate(reader, start=2):
+            try:
+                start, end = parse_range(row)
+            except (KeyError, ValueError) as e:
+                raise ValueError(f"invalid range at line {line}: {e}") from e
+            record = tuple(
+                strings.setdefault(row.get(field) or "", len(strings)) for field in fields
+            )
+            ranges.append((start, end, records.setdefault(record, len(records))))
+    ranges.sort()
+    return fields, ranges
+
+
+def _write(output: str, header: dict, arrays: List[array.array]):
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    # arrays are aligned to item size
+    header_bytes += b" " * (-(len(MAGIC) + 4 + len(header_bytes)) % ITEM_SIZE)
+    with open(f"{output}.tmp", "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        for items in arrays:
+            if sys.byteorder != "little":
+                items.byteswap()
+            f.write(items.tobytes())
+    os.replace(f"{output}.tmp", output)
+
+
+def build(csv_file: str, output: Optional[str] = None) -> dict:
+    """Build database from CSV with a header line, return header of the database
+
+    Ranges are given by a ``network`` column (CIDR) or ``start`` and ``end`` columns (IP or
+    integer), other columns named as Location fields are imported. Ranges must not overlap.
+    """
+    strings: Dict[str, int] = {"": 0}
+    records: Dict[Tuple[int, ...], int] = {}
+    fields, ranges = _read_csv(csv_file, strings, records)
+    for previous, current in zip(ranges, ranges[1:]):
+        if current[0] <= previous[1]:
+            raise ValueError(
+                f"overlapped ranges: {ipaddress.IPv4Address(previous[0])}-"
+                f"{ipaddress.IPv4Address(previous[1])} and {ipaddress.IPv4Address(current[0])}"
+            )
+    header = {
+        "version": VERSION,
+        "fields": fields,
+        "strings": list(strings),
+        "count": len(ranges),
+        "records": len(records),
+        "source": os.path.basename(csv_file),
+        "built": time.time(),
+    }
+    arrays = [
+        array.array(_ITEM_TYPE, [item[0] for item in ranges]),
+        array.array(_ITEM_TYPE, [item[1] for item in ranges]),
+        array.array(_ITEM_TYPE, [item[2] for item in ranges]),
+        array.array(_ITEM_TYPE, [string_id for record in records for string_id in record]),
+    ]
+    _write(output or get_default_path(), header, arrays)
+    return header
+
+
+class IPDatabase:
+    """IP location database loaded from file built by build()
+
+    A truncated or corrupted file raises ValueError.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or get_default_path()
+        with open(self.path, "rb") as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:
+                raise ValueError(f"invalid ip database {self.path}: {e}") from e
+        try:
+            self._load()
+        except (ValueError, KeyError, TypeError, struct.error) as e:
+            self._mmap.close()
+            raise ValueError(f"invalid ip database {self.path}: {e}") from e
+
+    def _load(self):
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            raise ValueError("bad magic")
+        offset = len(MAGIC) + 4
+        (header_size,) = struct.unpack("<I", self._mmap[len(MAGIC) : offset])
+        self.header = json.loads(self._mmap[offset : offset + header_size])
+        offset += header_size
+        self.fields: List[str] = self.header["fields"]
+        self.strings: List[str] = [sys.intern(string) for string in self.header["strings"]]
+        count, records = self.header["count"], self.header["records"]
+        if offset + (count * 3 + records * len(self.fields)) * ITEM_SIZE > len(self._mmap):
+            raise ValueError("truncated file")
+        self.starts = self._get_array(offset, count)
+        self.ends = self._get_array(offset + count * ITEM_SIZE, count)
+        self.record_ids = self._get_array(offset + count * ITEM_SIZE * 2, count)
+        self.records = self._get_array(offset + count * ITEM_SIZE * 3, records * len(self.fields))
+
+    def _get_array(self, offset: int, length: int) -> Sequence[int]:
+        data = memoryview(self._mmap)[offset : offset + length * ITEM_SIZE]
+        if sys.byteorder == "little":
+            return data.cast(_ITEM_TYPE)
+        items = array.array(_ITEM_TYPE, data.tobytes())
+        items.byteswap()
+        return items
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def lookup(self, ip: str) -> Optional[location.Location]:
+        """Location of ip, None if not found"""
+        try:
+            # much faster than ipaddress
+            ip_int = int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+        except OSError as e:
+            raise ValueError(f"invalid ipv4 address: {ip}") from e
+        index = bisect.bisect_right(self.starts, ip_int) - 1
+        if index < 0 or ip_int > self.ends[index]:
+            return None
+        offset = self.record_ids[index] * len(self.fields)
+        values = {
+            field: self.strings[self.records[offset + i]] for i, field in enumerate(self.fields)
+        }
+        return location.Location(ip=ip, ip_int=ip_int, **values)
+
+    def close(self):
+        for items in [self.starts, self.ends, self.record_ids, self.records]:
+            if isinstance(items, memoryview):
+                items.release()
+        self._mmap.close()
+
+
+def open_default() -> Optional[IPDatabase]:
+    """Open database at the default path, None if not imported"""
+    path = get_default_path()
+    return IPDatabase(path) if os.path.isfile(path) else None
@@ -1,10 +1,28 @@
-from pytoys.common import httpclient
+"""Public IP of this host, discovered from several providers"""
+
+import collections
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from typing import List, Optional
+
+from loguru import logger
+
+from pytoys.common import cache, httpclient
+
+# seconds to reuse the public ip while network interfaces are not changed
+DEFAULT_CACHE_TTL = 60 * 5
+DEFAULT_TIMEOUT = 30
+ERRORS = (httpclient.HttpError, httpclient.RequestError, IOError, ValueError)
 
 
 class IPinfoAPI(httpclient.HttpClient):
 
-    def __init__(self):
-        super().__init__("https://ipinfo.io", timeout=30)
+    def __init__(self, base_url=None):
+        super().__init__(base_url or "https://ipinfo.io", timeout=DEFAULT_TIMEOUT)
 
     def get_public_ip(self) -> str:
         resp = self.get("/json")
@@ -13,18 +31,130 @@ class IPinfoAPI(httpclient.HttpClient):
 
 class IPApi(httpclient.HttpClient):
 
-    def __init__(self):
-        super().__init__("http://ip-api.com")
+    def __init__(self, base_url=None):
+        super().__init__(base_url or "http://ip-api.com", timeout=DEFAULT_TIMEOUT)
 
     def get_public_ip(self) -> str:
         resp = self.get("/json")
         return resp.json().get("query")
 
 
-def get_public_api() -> str:
-    for api in [IPinfoAPI(), IPApi()]:
+class IpifyAPI(httpclient.HttpClient):
+
+    def __init__(self, base_url=None):
+        super().__init__(base_url or "https://api.ipify.org", timeout=DEFAULT_TIMEOUT)
+
+    def get_public_ip(self) -> str:
+        resp = self.get("/?format=json")
+        return resp.json().get("ip")
+
+
+def get_network_key() -> str:
+    """Key of the network state: interfaces and the local address of the default route"""
+    try:
+        names = ",".join(sorted(name for _, name in socket.if_nameindex()))
+    except OSError:
+        names = ""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            # no packet is sent by connecting an udp socket
+            sock.connect(("8.8.8.8", 80))
+            address = sock.getsockname()[0]
+        except OSError:
+            address = ""
+    return f"{names}|{address}"
+
+
+class PublicIPCache:
+    """Public ip stored in a file with the network key it is discovered with"""
+
+    def __init__(self, path: Optional[str] = None, ttl: float = DEFAULT_CACHE_TTL):
+        self.path = path or cache.get_cache_dir("public-ip.json")
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[str]:
         try:
-            return api.get_public_ip()
-        except IOError:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("key") != key or time.time() - data.get("created", 0) > self.ttl:
+            return None
+        return data.get("ip")
+
+    def set(self, key: str, ip: str):
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"key": key, "ip": ip, "created": time.time()}, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+
+def discover(apis: Optional[list] = None, quorum: int = 1,
+             timeout: float = DEFAULT_TIMEOUT) -> str:                                  # fmt: skip
+    """Query all providers at once, return the first ip answered by ``quorum`` providers
+
+    If no ip reaches the quorum, the ip answered most is returned. ``quorum`` is capped at
+    the number of providers. Providers still running are abandoned, their threads are daemon
+    and do not block exiting.
+    """
+    apis = apis or [IPinfoAPI(), IPApi(), IpifyAPI()]
+    quorum = min(max(quorum, 1), len(apis))
+    results: queue.Queue = queue.Queue()
+
+    def _query(api):
+        try:
+            results.put((api, api.get_public_ip(), None))
+        except ERRORS as e:
+            results.put((api, None, e))
+
+    for api in apis:
+        threading.Thread(target=_query, args=(api,), daemon=True).start()
+    votes: collections.Counter = collections.Counter()
+    errors: List[str] = []
+    deadline = time.monotonic() + timeout
+    for _ in apis:
+        try:
+            api, ip, error = results.get(timeout=max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+            errors.append("timeout")
+            break
+        if not ip:
+            logger.debug("get public ip with {} failed: {}", type(api).__name__, error)
+            errors.append(f"{type(api).__name__}: {error or 'empty ip'}")
             continue
-    raise IOError("get public ip failed")
+        logger.debug("get public ip with {}: {}", type(api).__name__, ip)
+        votes[ip] += 1
+        if votes[ip] >= quorum:
+            return ip
+    if votes:
+        ip, count = votes.most_common(1)[0]
+        logger.warning("public ip {} answered by {} provider(s), less than quorum {}",
+                       ip, count, quorum)                                               # fmt: skip
+        return ip
+    raise IOError(f"get public ip failed: {', '.join(errors)}")
+
+
+def get_public_api(parallel=True, quorum: int = 1,
+                   public_ip_cache: Optional[PublicIPCache] = None) -> str:             # fmt: skip
+    """Public ip of this host, cached for the current network state if public_ip_cache
+
+    Providers are tried in turn if not parallel.
+    """
+    key = get_network_key() if public_ip_cache else ""
+    ip = public_ip_cache.get(key) if public_ip_cache else None
+    if ip:
+        logger.debug("use cached public ip {}", ip)
+        return ip
+    if parallel:
+        ip = discover(quorum=quorum)
+    else:
+        for api in [IPinfoAPI(), IPApi(), IpifyAPI()]:
+            try:
+                ip = api.get_public_ip()
+                break
+            except ERRORS:
+                continue
+        else:
+            raise IOError("get public ip failed")
+    if public_ip_cache:
+        public_ip_cache.set(key, ip)
+    return ip
@@ -40,8 +40,8 @@ class Location:
 
 class UUToolApi(httpclient.HttpClient):
 
-    def __init__(self):
-        super().__init__("https://api.uutool.cn")
+    def __init__(self, base_url=None):
+        super().__init__(base_url or "https://api.uutool.cn")
 
     def get_location(self, ipaddr) -> Location:
         resp = self.get(f"/ip/location/?ip={ipaddr}", headers={"accept-language": "zh-CN"})
@@ -51,8 +51,8 @@ class UUToolApi(httpclient.HttpClient):
 
 class IP77Api(httpclient.HttpClient):
 
-    def __init__(self):
-        super().__init__("https://api.ip77.net")
+    def __init__(self, base_url=None):
+        super().__init__(base_url or "https://api.ip77.net")
 
     def get_location(self, ipaddr) -> Location:
         resp = self.post(
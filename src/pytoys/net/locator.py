@@ -0,0 +1,181 @@
+"""Bulk IP geolocation"""
+
+import collections
+import dataclasses
+import ipaddress
+import json
+import re
+import threading
+import time
+from concurrent import futures
+from typing import Dict, Generator, Iterable, Optional
+
+from loguru import logger
+
+from pytoys.common import cache, httpclient
+from pytoys.net import ipdb, location
+from pytoys.openapi import qqmap
+
+RE_IPV4 = re.compile(r"(?<![\d.])(?:\d{1,3}\.){3}\d{1,3}(?![\d.])")
+# seconds to keep locations in cache
+DEFAULT_CACHE_TTL = 60 * 60 * 24 * 30
+LOOKUP_ERRORS = (httpclient.HttpError, httpclient.RequestError, IOError, ValueError, TypeError)
+
+SQL_CREATE = """
+CREATE TABLE IF NOT EXISTS locations (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    created REAL NOT NULL
+)
+"""
+
+
+class LocateError(Exception):
+
+    def __init__(self, reason):
+        super().__init__(f"locate error: {reason}")
+
+
+def read_ips(lines: Iterable[str]) -> Generator[str, None, None]:
+    """Yield the first IPv4 address of each line, e.g. client address of access logs
+
+    >>> list(read_ips(["1.2.3.4 - - [01/Jan/2025] GET /", "bad 300.1.1.1", "x 10.0.0.1"]))
+    ['1.2.3.4', '10.0.0.1']
+    """
+    for line in lines:
+        for matched in RE_IPV4.findall(line):
+            try:
+                yield str(ipaddress.IPv4Address(matched))
+                break
+            except ValueError:
+                continue
+
+
+def get_lookup_key(ip: str, collapse=False) -> str:
+    """Key to lookup, the /24 network if collapse
+
+    >>> get_lookup_key("1.2.3.4", collapse=True)
+    '1.2.3.0/24'
+    """
+    if not collapse:
+        return ip
+    return str(ipaddress.IPv4Network(f"{ip}/24", strict=False))
+
+
+class LocationCache(cache.SqliteStore):
+    """Locations stored in sqlite, keyed by IP or network"""
+
+    def __init__(self, path: Optional[str] = None, ttl: float = DEFAULT_CACHE_TTL):
+        super().__init__(path or cache.get_cache_dir("ip-locations.db"), [SQL_CREATE])
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[location.Location]:
+        row = self.db.execute(
+            "SELECT data FROM locations WHERE key = ? AND created > ?",
+            (key, time.time() - self.ttl),
+        ).fetchone()
+        return location.Location(**json.loads(row[0])) if row else None
+
+    def set(self, key: str, ip_location: location.Location):
+        self.db.execute(
+            "INSERT OR REPLACE INTO locations VALUES (?, ?, ?)",
+            (key, json.dumps(ip_location.to_dict(), ensure_ascii=False), time.time()),
+        )
+
+
+class BulkLocator:
+    """Locate IPs concurrently, failing over between backends
+
+    IPs found in the offline database are not looked up with backends. A backend failed
+    recently is tried after the others until it succeeds again.
+    """
+
+    def __init__(self, apis: Optional[list] = None, location_cache: Optional[LocationCache] = None,
+                 concurrency: int = 8, collapse=False,
+                 ip_database: Optional[ipdb.IPDatabase] = None):                        # fmt: skip
+        if apis is None:
+            apis = [location.IP77Api(), location.UUToolApi(), qqmap.QQMapAPIs()]
+        self.apis = apis
+        self.ip_database = ip_database
+        self.cache = location_cache
+        self.concurrency = concurrency
+        self.collapse = collapse
+        self._failures: Dict[int, int] = {id(api): 0 for api in self.apis}
+        self._lock = threading.Lock()
+
+    def _get_apis(self) -> list:
+        with self._lock:
+            return sorted(self.apis, key=lambda api: self._failures[id(api)])
+
+    def _record(self, api, ok: bool):
+        with self._lock:
+            self._failures[id(api)] = 0 if ok else self._failures[id(api)] + 1
+
+    def lookup(self, ip: str) -> location.Location:
+        """Locate one IP with the first backend succeeded"""
+        errors = []
+        for api in self._get_apis():
+            try:
+                ip_location = api.get_location(ip)
+                if not ip_location.info():
+                    raise ValueError("empty location")
+            except LOOKUP_ERRORS as e:
+                logger.debug("locate {} with {} failed: {}", ip, type(api).__name__, e)
+                self._record(api, False)
+                errors.append(f"{type(api).__name__}: {e}")
+                continue
+            self._record(api, True)
+            return ip_location
+        raise LocateError(", ".join(errors))
+
+    def _locate_key(self, key: str, ip: str) -> Optional[location.Location]:
+        cached = self.cache.get(key) if self.cache else None
+        if cached or not self.apis:
+            return cached
+        try:
+            ip_location = self.lookup(ip)
+        except LocateError as e:
+            logger.warning("locate {} failed: {}", ip, e)
+            return None
+        if self.cache:
+            self.cache.set(key, ip_location)
+        return ip_location
+
+    def locate(self, ips: Iterable[str]) -> Generator[location.Location, None, None]:
+        """Yield location of each distinct IP in input order
+
+        Private IPs are not looked up. With collapse, one IP of each /24 network is looked
+        up with backends for all IPs of the network.
+        """
+        seen = set()
+        pending: collections.deque = collections.deque()
+        tasks: Dict[str, futures.Future] = {}
+        with futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+
+            def _result(ip: str, key: Optional[str],
+                        ip_location: Optional[location.Location]) -> location.Location:  # fmt: skip
+                if ip_location:
+                    return ip_location
+                ip_location = tasks[key].result() if key else None
+                if ip_location is None:
+                    return location.Location(ip=ip, location="" if key else "内网IP")
+                return dataclasses.replace(ip_location, ip=ip,
+                                           ip_int=int(ipaddress.IPv4Address(ip)))      # fmt: skip
+
+            for ip in ips:
+                if ip in seen:
+                    continue
+                seen.add(ip)
+                key = None
+                ip_location = self.ip_database.lookup(ip) if self.ip_database else None
+                if not ip_location and ipaddress.IPv4Address(ip).is_global:
+                    key = get_lookup_key(ip, collapse=self.collapse)
+                    if key not in tasks:
+                        tasks[key] = executor.submit(self._locate_key, key, ip)
+                pending.append((ip, key, ip_location))
+                # yield finished results in order, keep at most concurrency * 4 in flight
+                while pending and (not pending[0][1] or tasks[pending[0][1]].done()
+                                   or len(pending) > self.concurrency * 4):            # fmt: skip
+                    yield _result(*pending.popleft())
+            for item in pending:
+                yield _result(*item)
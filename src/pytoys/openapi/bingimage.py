@@ -1,9 +1,22 @@
+import bisect
 import dataclasses
+import json
+import os
+import re
+import threading
+import time
+from concurrent import futures
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 from urllib import parse
 
-from pytoys.common import httpclient
+from loguru import logger
+from tqdm.auto import tqdm
+
+from pytoys.common import aiohttpclient, blobstore, cache, httpclient
+
+MANIFEST_FILE = ".bing-manifest.json"
+RE_DATE = re.compile(r"\d{4}(-\d{2}){0,2}")
 
 
 @dataclasses.dataclass
@@ -21,37 +34,226 @@ class BingImage:
         image_id = parse.parse_qs(parsed.query).get("id")
         return image_id[0] if image_id else ""
 
+    @classmethod
+    def from_dict(cls, data: dict) -> "BingImage":
+        return cls(**{field.name: data.get(field.name) for field in dataclasses.fields(cls)})
+
+
+def parse_market(market: str) -> Tuple[str, str]:
+    """Country and language of market given as "CN/zh" or "zh-CN"
+
+    >>> parse_market("CN/zh"), parse_market("en-US")
+    (('CN', 'zh'), ('US', 'en'))
+    """
+    if "/" in market:
+        country, language = market.split("/", 1)
+    else:
+        language, country = market.split("-", 1)
+    return country.upper(), language.lower()
+
+
+class BingImageIndex:
+    """Images of markets indexed by date
+
+    >>> index = BingImageIndex()
+    >>> index.add("CN/zh", [BingImage("", "", "", "", "", "", date) for date in
+    ...                     ["2024-01-02", "2024-01-01", "2024-01-03"]])
+    >>> [image.date for _, image in index.between("2024-01-02", "2024-01-09")]
+    ['2024-01-02', '2024-01-03']
+    """
+
+    def __init__(self):
+        self._dates: Dict[str, List[str]] = {}
+        self._images: Dict[str, Dict[str, BingImage]] = {}
+
+    def add(self, market: str, images: Iterable[BingImage]):
+        market_images = self._images.setdefault(market, {})
+        market_images.update((image.date, image) for image in images if image.date)
+        self._dates[market] = sorted(market_images)
+
+    def between(self, start: str, end: str,
+                markets: Optional[List[str]] = None) -> List[Tuple[str, BingImage]]:   # fmt: skip
+        """Images dated in [start, end] of markets, by market and date"""
+        result = []
+        for market in markets or list(self._images):
+            dates = self._dates.get(market, [])
+            # dates may be longer than start and end, e.g. with time
+            for date in dates[bisect.bisect_left(dates, start) : bisect.bisect_right(dates, end)]:
+                result.append((market, self._images[market][date]))
+        return result
+
 
 class BingNpanuhinAPI(httpclient.HttpClient):
     """
     https://bing.npanuhin.me/
     """
 
-    def __init__(self, timeout: Optional[int] = None):
-        super().__init__("https://bing.npanuhin.me", timeout=timeout)
+    cache_ttl = 60 * 60 * 6
+
+    def __init__(self, timeout: Optional[int] = None, base_url: Optional[str] = None):
+        super().__init__(base_url or "https://bing.npanuhin.me", timeout=timeout, retries=3)
 
     def get_bing_images(self, country: str='CN', language: str='zh',
                         date: Optional[str]=None) -> List[BingImage]:        # fmt: skip
-        if date:
-            year = date.split("-")[0]
-        else:
+        """Images of the date, which is YYYY, YYYY-MM or YYYY-MM-DD, today by default"""
+        if not date:
             date = datetime.now().strftime("%Y-%m-%d")
+        if not RE_DATE.fullmatch(date):
+            raise ValueError(f"invalid date '{date}', expected YYYY, YYYY-MM or YYYY-MM-DD")
 
-        year = date.split("-")[0]
-        resp = self.get(f"/{country}/{language}.{year}.json")
+        year = int(date.split("-")[0])
         return [
-            BingImage(
-                title=data.get("title"),
-                caption=data.get("caption"),
-                subtitle=data.get("subtitle"),
-                description=data.get("description"),
-                bing_url=data.get("bing_url"),
-                url=data.get("url"),
-                date=data.get("date"),
-            )
-            for data in resp.json()
-            if data.get("date", "").startswith(date)
+            image
+            for image in self.get_year_images(country, language, year)
+            if (image.date or "").startswith(date)
         ]
 
+    def _is_year_fresh(self, path: str, year: int) -> bool:
+        if not os.path.isfile(path):
+            return False
+        modified = os.path.getmtime(path)
+        # images of a year are not changed some days after the year
+        return modified > datetime(year + 1, 1, 3).timestamp() or (
+            time.time() - modified < self.cache_ttl
+        )
+
+    def get_year_images(self, country: str, language: str, year: int) -> List[BingImage]:
+        """Images of a year, the json file is kept in cache directory
+
+        The cached file is used if it exists and refreshing it failed.
+        """
+        path = cache.get_cache_dir("bing", f"{country}.{language}.{year}.json")
+        if not self._is_year_fresh(path, year):
+            try:
+                resp = self.get(f"/{country}/{language}.{year}.json", cache_ttl=0)
+            except (httpclient.HttpError, httpclient.RequestError) as e:
+                if not os.path.isfile(path):
+                    raise
+                logger.warning("refresh images of {} {} failed, use cached: {}", country, year, e)
+            else:
+                with open(f"{path}.tmp", "wb") as f:
+                    f.write(resp.content)
+                os.replace(f"{path}.tmp", path)
+        with open(path, "r", encoding="utf-8") as f:
+            return [BingImage.from_dict(data) for data in json.load(f)]
+
+    def get_index(self, markets: List[str], start: str, end: str) -> BingImageIndex:
+        """Index of images of markets in years from start to end, missing years are skipped"""
+        index = BingImageIndex()
+        for market in markets:
+            country, language = parse_market(market)
+            for year in range(int(start[:4]), int(end[:4]) + 1):
+                try:
+                    index.add(market, self.get_year_images(country, language, year))
+                except httpclient.HttpError as e:
+                    logger.warning("get images of {} {} failed: {}", market, year, e)
+        return index
+
     def download_image(self, image: BingImage, progress=False):
         self.download(image.bing_url, default_filename=image.filename(), progress=progress)
+
+    async def download_images_async(self, images: List[BingImage], progress=False,
+                                    concurrency=20) -> List[Optional[Exception]]:       # fmt: skip
+        """Download images with asyncio, return the error of each image"""
+        async with aiohttpclient.AsyncHttpClient(self.base_url, timeout=self.timeout,
+                                                 limit=concurrency) as client:          # fmt: skip
+
+            async def _download(image: BingImage) -> Optional[Exception]:
+                try:
+                    await client.download(image.bing_url, default_filename=image.filename(),
+                                          progress=progress)                            # fmt: skip
+                except (httpclient.HttpError, httpclient.RequestError) as e:
+                    return e
+                return None
+
+            return await aiohttpclient.map_limited(_download, images, limit=concurrency)
+
+
+class BingSync:
+    """Download images not in the output directory
+
+    Downloaded files are recorded with size and sha256 in a manifest in the directory,
+    a file is skipped if its size matches, or with ``verify`` its sha256 too. Files not in
+    the manifest, e.g. downloaded before, are recorded as they are.
+    """
+
+    def __init__(self, api: BingNpanuhinAPI, output: str, concurrency: int = 4, verify=False):
+        self.api = api
+        self.output = output
+        self.concurrency = concurrency
+        self.verify = verify
+        self.manifest_path = os.path.join(output, MANIFEST_FILE)
+        self.manifest: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    def save_manifest(self):
+        with self._lock:
+            with open(f"{self.manifest_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+            os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+
+    def _record(self, image: BingImage, path: str):
+        """Record the file of image, which may be saved with another name given by server"""
+        record = {"size": os.path.getsize(path), "sha256": blobstore.hash_file(path),
+                  "date": image.date, "url": image.bing_url,
+                  "file": os.path.basename(path)}                                       # fmt: skip
+        with self._lock:
+            self.manifest[image.filename()] = record
+
+    def is_synced(self, image: BingImage) -> bool:
+        record = self.manifest.get(image.filename())
+        path = os.path.join(self.output, (record or {}).get("file") or image.filename())
+        if not os.path.isfile(path):
+            return False
+        if not record:
+            self._record(image, path)
+            return True
+        if os.path.getsize(path) != record["size"]:
+            return False
+        return not self.verify or blobstore.hash_file(path) == record["sha256"]
+
+    def missing(self, images: Iterable[BingImage]) -> List[BingImage]:
+        """Images to download, images of the same file in markets are downloaded once"""
+        distinct = {image.filename(): image for image in images if image.filename()}
+        return [image for image in distinct.values() if not self.is_synced(image)]
+
+    def _download(self, image: BingImage) -> Optional[Exception]:
+        try:
+            path = self.api.download(image.bing_url, default_filename=image.filename(),
+                                     output=self.output)                               # fmt: skip
+            self._record(image, path)
+        except (httpclient.HttpError, httpclient.RequestError, IOError) as e:
+            return e
+        return None
+
+    def sync(
+        self, images: List[BingImage], progress=False
+    ) -> Tuple[List[BingImage], List[Tuple[BingImage, Exception]]]:
+        """Download missing images, return downloaded images and failures
+
+        With progress, one bar counts the finished images. Images are downloaded by several
+        threads, so a bar of each file would garble the output.
+        """
+        os.makedirs(self.output, exist_ok=True)
+        missing = self.missing(images)
+        downloaded, failures = [], []
+        synced = len({image.filename() for image in images if image.filename()}) - len(missing)
+        logger.info("{} image(s) to download, {} synced", len(missing), synced)
+        try:
+            with futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor, \
+                    tqdm(desc="📥 images", total=len(missing),
+                         disable=not progress) as pbr:                                  # fmt: skip
+                errors = executor.map(self._download, missing)
+                for image, error in zip(missing, errors):
+                    pbr.update(1)
+                    if error:
+                        logger.error("download image {} failed: {}", image.filename(), error)
+                        failures.append((image, error))
+                    else:
+                        downloaded.append(image)
+        finally:
+            self.save_manifest()
+        return downloaded, failures
@@ -1,7 +1,8 @@
 """腾讯位置服务 api"""
 
+import functools
 import hashlib
-from typing import Optional
+from typing import Iterable, List, Optional, Tuple
 from urllib import parse
 
 from loguru import logger
@@ -10,37 +11,71 @@ from pytoys.common import httpclient
 from pytoys.net import location, weather
 
 
+class RequestSigner:
+    """Sign requests with the secret key (SK) of 腾讯位置服务
+
+    sig is md5 of ``path?k1=v1&k2=v2`` followed by SK, with params sorted by name and values
+    not encoded. Signed queries are cached by path and params.
+
+    >>> signer = RequestSigner("KEY", "SK")
+    >>> signer.sign("/ws/location/v1/ip", {"ip": "1.2.3.4"})
+    'ip=1.2.3.4&key=KEY&sig=0e2e4d6ac3b21e769c91a70802eda120'
+    >>> signer.sign("/ws/weather/v1", {"type": "now", "adcode": 110101})
+    'adcode=110101&key=KEY&type=now&sig=792969d2eb7d4655b1ca4df6911fd265'
+    >>> signer.sign("/ws/geocoder/v1", {"location": "28.7,115.8"}).split("&")
+    ['key=KEY', 'location=28.7%2C115.8', 'sig=de8b9b8c1f548928e4aae1a73b7f71e3']
+    """
+
+    def __init__(self, key: str, secret: str, cache_size: int = 4096):
+        self.key = key
+        self.secret = secret
+        self._sign = self._sign_items
+        if cache_size:
+            self._sign = functools.lru_cache(maxsize=cache_size)(self._sign_items)
+
+    @staticmethod
+    def _get_items(params: dict) -> Tuple[Tuple[str, str], ...]:
+        items = []
+        for name, value in params.items():
+            if name in ("key", "sig"):
+                continue
+            for v in value if isinstance(value, (list, tuple)) else [value]:
+                items.append((name, str(v)))
+        return tuple(items)
+
+    def _sign_items(self, path: str, items: Tuple[Tuple[str, str], ...]) -> str:
+        items = sorted(items + (("key", self.key),))
+        raw_query = "&".join([f"{name}={value}" for name, value in items])
+        sig = hashlib.md5(f"{path}?{raw_query}{self.secret}".encode("utf-8")).hexdigest()
+        quote = parse.quote_plus
+        return "&".join([f"{quote(name)}={quote(value)}" for name, value in items] + [f"sig={sig}"])
+
+    def sign(self, path: str, params: Optional[dict] = None) -> str:
+        """Signed query string of the request, with key and sig"""
+        return self._sign(path, self._get_items(params or {}))
+
+    def sign_many(self, path: str, params_list: Iterable[dict]) -> List[str]:
+        """Signed query strings of requests to the same path"""
+        return [self.sign(path, params) for params in params_list]
+
+
 class QQMapAPIs(httpclient.HttpClient):
     """腾讯位置服务 api"""
 
-    def __init__(self, key: Optional[str] = None, signature: Optional[str] = None):
-        super().__init__("https://apis.map.qq.com")
+    def __init__(self, key: Optional[str] = None, signature: Optional[str] = None,
+                 base_url: Optional[str] = None):                                       # fmt: skip
+        super().__init__(base_url or "https://apis.map.qq.com")
         self.key = key or "RKABZ-DCAEB-5VPUG-N4XPP-HGE4K-VXBL6"
         self.signature = signature or "gB38imb0E05bQV8f4aYA2uQVHFfYUFbR"
+        self.signer = RequestSigner(self.key, self.signature)
 
-    def _get_req_params(self, url, params=None) -> dict:
-        params = params or {}
-        for k, v in params.items() or {}:
-            params[k] = v if isinstance(v, list) else [v]
-        params["key"] = [self.key]
-        # 必须对请求参数进行排序
-        sorted_params = {}
-        for k in sorted(params.keys()):
-            sorted_params[k] = params[k]
-
-        query = parse.urlencode(sorted_params, doseq=True)
-        sig = hashlib.md5(f"{url}?{query}{self.signature}".encode("utf-8")).hexdigest()
-        sorted_params["sig"] = [sig]
-        return sorted_params
+    def _get_signed(self, path: str, params: Optional[dict] = None):
+        query = self.signer.sign(path, params)
+        logger.debug("req query : {}", query)
+        return self.get(f"{path}?{query}")
 
     def get_location(self, ip: Optional[str] = None):
-        req_url = "/ws/location/v1/ip"
-        if ip:
-            req_url += f"?ip={ip}"
-        params = {"ip": ip} if ip else {}
-        params = self._get_req_params(req_url, params)
-        logger.debug("req params : {}", params)
-        resp = self.get(req_url, params=params)
+        resp = self._get_signed("/ws/location/v1/ip", {"ip": ip} if ip else {})
         result = resp.json().get("result", {})
         return location.Location(
             ip=result.get("ip", ""),
@@ -54,12 +89,7 @@ class QQMapAPIs(httpclient.HttpClient):
         )
 
     def get_weather(self, city: location.Location, query_type: str = "now") -> weather.Weather:
-        req_url = "/ws/weather/v1"
-        adcode = city.area_code
-        params = {"adcode": adcode, "type": query_type}
-        params = self._get_req_params(req_url, params)
-        logger.debug("req params : {}", params)
-        resp = self.get(req_url, params=params)
+        resp = self._get_signed("/ws/weather/v1", {"adcode": city.area_code, "type": query_type})
         result = resp.json().get("result", {})
         realtime = result.get("realtime", [])
         if not realtime:
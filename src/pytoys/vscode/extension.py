@@ -2,13 +2,35 @@
 
 import dataclasses
 import json
-from typing import Optional
+import os
+import re
+from concurrent import futures
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import prettytable
 from loguru import logger
+from tqdm.auto import tqdm
 
 from pytoys.common import httpclient, user_input
 
+TARGET = "Microsoft.VisualStudio.Code"
+# filter types and flags of extensionquery
+FILTER_EXTENSION_NAME = 7
+FILTER_TARGET = 8
+FILTER_SEARCH_TEXT = 10
+FILTER_EXCLUDE_WITH_FLAGS = 12
+FLAG_INCLUDE_VERSIONS = 0x1
+FLAG_INCLUDE_VERSION_PROPERTIES = 0x10
+FLAG_UNPUBLISHED = 0x1000
+# extensions in a filter of extensionquery
+MAX_QUERY_SIZE = 100
+
+PROPERTY_EXTENSION_PACK = "Microsoft.VisualStudio.Code.ExtensionPack"
+PROPERTY_DEPENDENCIES = "Microsoft.VisualStudio.Code.ExtensionDependencies"
+PROPERTY_PRE_RELEASE = "Microsoft.VisualStudio.Code.PreRelease"
+# file names given by server of downloaded extensions, saved in the output directory
+MANIFEST_FILE = ".vsix-manifest.json"
+
 
 @dataclasses.dataclass
 class Extension:
@@ -22,10 +44,123 @@ class Extension:
     publisher_name: str
     publisher_display_name: str
     flags: Optional[str] = None
+    target_platform: Optional[str] = None
+    dependencies: List[str] = dataclasses.field(default_factory=list)
+    pack: List[str] = dataclasses.field(default_factory=list)
+
+    @property
+    def full_id(self) -> str:
+        return f"{self.publisher_name}.{self.name}"
 
     def filename(self):
         """Get file name"""
-        return f"{self.publisher_name}.{self.name}-{self.version}.vsix"
+        if self.target_platform:
+            return f"{self.full_id}-{self.version}@{self.target_platform}.vsix"
+        return f"{self.full_id}-{self.version}.vsix"
+
+
+def _read_manifest(output: str) -> Dict[str, str]:
+    """Saved file names of output, keyed by Extension.filename()"""
+    path = os.path.join(output, MANIFEST_FILE)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_manifest(output: str, manifest: Dict[str, str]):
+    path = os.path.join(output, MANIFEST_FILE)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(f"{path}.tmp", path)
+
+
+@dataclasses.dataclass
+class BulkResult:
+    """Result of an extension of bulk download"""
+
+    id: str
+    version: str = ""
+    required_by: str = ""
+    status: str = ""
+    file: str = ""
+    error: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.status in ("downloaded", "exists")
+
+
+def parse_extension_id(value: str) -> Tuple[str, Optional[str]]:
+    """Extension id and version of "publisher.name[@version]"
+
+    >>> parse_extension_id("ms-python.python@2024.2.1"), parse_extension_id(" ms-python.python ")
+    (('ms-python.python', '2024.2.1'), ('ms-python.python', None))
+    """
+    ext_id, _, version = value.strip().partition("@")
+    if ext_id.count(".") != 1 or not all(ext_id.split(".")):
+        raise ValueError(f'invalid extension id "{value}", expected publisher.name[@version]')
+    return ext_id, version or None
+
+
+def strip_jsonc(text: str) -> str:
+    """Remove comments and trailing commas of JSON with comments, e.g. extensions.json
+
+    >>> strip_jsonc('{"a": "//b", // c\\n /* d */ "e": [1, 2,],}')
+    '{"a": "//b", \\n  "e": [1, 2]}'
+    """
+    string = r'"(?:\\.|[^"\\])*"'
+    text = re.sub(rf"({string})|//[^\n]*|/\*.*?\*/", lambda m: m.group(1) or "", text,
+                  flags=re.DOTALL)                                                      # fmt: skip
+    return re.sub(rf"({string})|,(\s*[}}\]])", lambda m: m.group(1) or m.group(2), text)
+
+
+def read_manifest(path: str) -> List[str]:
+    """Extension ids in a manifest, one id a line with # comments, or the recommendations of
+    extensions.json of VSCode, which may have comments
+
+    Raise ValueError if the json is invalid.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            data = json.loads(strip_jsonc(f.read()))
+            recommendations = data.get("recommendations", []) if isinstance(data, dict) else None
+            if not isinstance(recommendations, list):
+                raise ValueError(f"recommendations of {path} is not a list")
+            return [str(item) for item in recommendations]
+        lines = (line.split("#", 1)[0].strip() for line in f)
+        return [line for line in lines if line]
+
+
+def _split_ids(value: Optional[str]) -> List[str]:
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+def _select_version(versions: List[dict], version: Optional[str] = None,
+                    target_platform: Optional[str] = None,
+                    pre_release=False) -> Optional[dict]:                               # fmt: skip
+    """The version given or the latest one, versions are ordered from the latest
+
+    >>> versions = [{"version": "2.0.0", "properties": [{"key": PROPERTY_PRE_RELEASE,
+    ...                                                   "value": "true"}]},
+    ...             {"version": "1.1.0", "targetPlatform": "win32-x64"}, {"version": "1.0.0"}]
+    >>> [_select_version(versions, target_platform=platform)["version"]
+    ...  for platform in [None, "win32-x64"]]
+    ['1.0.0', '1.1.0']
+    >>> _select_version(versions, pre_release=True)["version"]
+    '2.0.0'
+    """
+    for item in versions:
+        if version and item.get("version") != version:
+            continue
+        platform = item.get("targetPlatform")
+        if platform and platform not in (target_platform, "universal"):
+            continue
+        properties = {prop["key"]: prop["value"] for prop in item.get("properties") or []}
+        if not version and not pre_release and properties.get(PROPERTY_PRE_RELEASE) == "true":
+            continue
+        return item
+    return None
 
 
 class ExtensionNotFound(Exception):
@@ -35,11 +170,32 @@ class ExtensionNotFound(Exception):
         super().__init__(f'extension "{name}" not found')
 
 
+def _to_extension(data: dict, version: dict) -> Extension:
+    properties = {prop["key"]: prop["value"] for prop in version.get("properties") or []}
+    publisher = data.get("publisher") or {}
+    return Extension(
+        id=data.get("extensionId"),
+        name=data.get("extensionName"),
+        version=version.get("version"),
+        display_name=data.get("displayName"),
+        publisher_id=publisher.get("publisherId"),
+        publisher_name=publisher.get("publisherName"),
+        publisher_display_name=publisher.get("displayName"),
+        flags=data.get("flags", None),
+        target_platform=version.get("targetPlatform"),
+        dependencies=_split_ids(properties.get(PROPERTY_DEPENDENCIES)),
+        pack=_split_ids(properties.get(PROPERTY_EXTENSION_PACK)),
+    )
+
+
 class MarketplaceAPI(httpclient.HttpClient):
     """Marketplace API"""
 
-    def __init__(self):
-        super().__init__("https://marketplace.visualstudio.com")
+    cache_ttl = 60 * 60
+    download_segments = 4
+
+    def __init__(self, base_url: Optional[str] = None):
+        super().__init__(base_url or "https://marketplace.visualstudio.com")
 
     def search(self, name):
         """Search for plugins in the marketplace"""
@@ -47,8 +203,8 @@ class MarketplaceAPI(httpclient.HttpClient):
             "filters": [
                 {
                     "criteria": [
-                        {"filterType": 8, "value": "Microsoft.VisualStudio.Code"},
-                        {"filterType": 10, "value": name},
+                        {"filterType": FILTER_TARGET, "value": TARGET},
+                        {"filterType": FILTER_SEARCH_TEXT, "value": name},
                     ],
                     "pageNumber": 1,
                     "pageSize": 50,
@@ -83,17 +239,142 @@ class MarketplaceAPI(httpclient.HttpClient):
             for ext in extensions
         ]
 
-    def download_extension(self, ext: Extension, output: Optional[str] = None):
-        """Download extension from marketplace"""
-        logger.info("download extension: {}({})", ext.display_name, ext.name)
+    def query_extensions(self, ext_ids: Iterable[str]) -> Dict[str, dict]:
+        """Extensions of ids with all versions and their properties, by lower case id
+
+        Ids are queried with a POST, a filter of at most MAX_QUERY_SIZE ids each.
+        """
+        ext_ids = sorted({ext_id.lower() for ext_id in ext_ids})
+        if not ext_ids:
+            return {}
+        filters = [
+            {
+                "criteria": [
+                    {"filterType": FILTER_TARGET, "value": TARGET},
+                    {"filterType": FILTER_EXCLUDE_WITH_FLAGS, "value": str(FLAG_UNPUBLISHED)},
+                    *({"filterType": FILTER_EXTENSION_NAME, "value": ext_id}
+                      for ext_id in ext_ids[i : i + MAX_QUERY_SIZE]),
+                ],
+                "pageNumber": 1,
+                "pageSize": MAX_QUERY_SIZE,
+                "sortBy": 0,
+                "sortOrder": 0,
+            }
+            for i in range(0, len(ext_ids), MAX_QUERY_SIZE)
+        ]                                                                               # fmt: skip
+        data = {
+            "filters": filters,
+            "flags": FLAG_INCLUDE_VERSIONS | FLAG_INCLUDE_VERSION_PROPERTIES,
+        }
+        resp = self.post("/_apis/public/gallery/extensionquery", json=data)
+        extensions = {}
+        for result in json.loads(resp.content).get("results") or []:
+            for ext in result.get("extensions") or []:
+                publisher = (ext.get("publisher") or {}).get("publisherName")
+                extensions[f"{publisher}.{ext.get('extensionName')}".lower()] = ext
+        return extensions
+
+    def resolve(  # pylint: disable=too-many-locals
+        self, ext_ids: List[str], target_platform: Optional[str] = None, pre_release=False,
+        expand=True,
+    ) -> Tuple[List[Extension], List[BulkResult]]:                                      # fmt: skip
+        """Resolve "publisher.name[@version]" ids, with packed extensions and dependencies
+
+        Ids are queried in a request, then the packed and dependent extensions found of each
+        level in another one. The latest released version is used if version is not given.
+        Return the extensions found and a result of each id.
+        """
+        pending = [(*parse_extension_id(value), "") for value in ext_ids]
+        extensions, results, seen = [], [], set()
+        while pending:
+            queried = self.query_extensions(
+                ext_id for ext_id, _, _ in pending if ext_id.lower() not in seen
+            )
+            next_pending = []
+            for ext_id, version, required_by in pending:
+                if ext_id.lower() in seen:
+                    continue
+                seen.add(ext_id.lower())
+                result = BulkResult(ext_id, version or "", required_by)
+                data = queried.get(ext_id.lower())
+                item = data and _select_version(data.get("versions") or [], version,
+                                                target_platform, pre_release)           # fmt: skip
+                if not item:
+                    result.status = "not found"
+                    if data:
+                        platform = target_platform or "universal"
+                        result.error = f"no version {version or ''}".strip() + f" for {platform}"
+                    results.append(result)
+                    continue
+                ext = _to_extension(data, item)
+                result.id, result.version = ext.full_id, ext.version
+                extensions.append(ext)
+                results.append(result)
+                if expand:
+                    next_pending.extend((dep, None, ext.full_id)
+                                        for dep in ext.pack + ext.dependencies)         # fmt: skip
+            pending = next_pending
+        return extensions, results
+
+    def _download_vsix(self, ext: Extension, output: Optional[str] = None,
+                       progress=True) -> str:                                           # fmt: skip
+        """Download vsix of ext, return the saved file, which is named by server"""
         url = (
             f"/_apis/public/gallery/publishers/{ext.publisher_name}/"
             f"vsextensions/{ext.name}/{ext.version}/vspackage"
         )
+        if ext.target_platform:
+            url = f"{url}?targetPlatform={ext.target_platform}"
+        return self.download(url, default_filename=ext.filename(), progress=progress,
+                             output=output)                                             # fmt: skip
 
-        self.download(url, default_filename=ext.filename(), progress=True, output=output)
+    def download_extension(self, ext: Extension, output: Optional[str] = None):
+        """Download extension from marketplace"""
+        logger.info("download extension: {}({})", ext.display_name, ext.name)
+        self._download_vsix(ext, output=output)
         logger.success("download success")
 
+    def bulk_download(self, ext_ids: List[str], output: str, concurrency: int = 4,
+                      target_platform: Optional[str] = None, pre_release=False, expand=True,
+                      progress=True) -> List[BulkResult]:                               # fmt: skip
+        """Resolve extensions and download the ones not in output, return result of each
+
+        Progress is shown with a bar of extensions, not a bar of each file, as files are
+        downloaded at once.
+        The server names the files, so the saved names are recorded in a manifest in output
+        to know the extensions already downloaded.
+        """
+        extensions, results = self.resolve(ext_ids, target_platform=target_platform,
+                                           pre_release=pre_release, expand=expand)      # fmt: skip
+        os.makedirs(output, exist_ok=True)
+        by_id = {result.id: result for result in results}
+        manifest = _read_manifest(output)
+
+        def _download(ext: Extension):
+            result = by_id[ext.full_id]
+            result.file = os.path.join(output, manifest.get(ext.filename()) or ext.filename())
+            if os.path.isfile(result.file) and os.path.getsize(result.file) > 0:
+                result.status = "exists"
+                return
+            try:
+                result.file = self._download_vsix(ext, output=output, progress=False)
+                result.status = "downloaded"
+                manifest[ext.filename()] = os.path.basename(result.file)
+            except (httpclient.HttpError, httpclient.RequestError, IOError) as e:
+                logger.error("download extension {} failed: {}", ext.full_id, e)
+                result.status, result.file, result.error = "failed", "", str(e)
+
+        logger.info("{} extension(s) to download", len(extensions))
+        try:
+            with futures.ThreadPoolExecutor(max_workers=concurrency) as executor, \
+                    tqdm(desc="📥 extensions", total=len(extensions),
+                         disable=not progress) as pbr:                                  # fmt: skip
+                for _ in executor.map(_download, extensions):
+                    pbr.update(1)
+        finally:
+            _write_manifest(output, manifest)
+        return results
+
     def search_and_download(self, name, output: Optional[str] = None):
         """Search and download extension"""
         logger.info("search extension: {}", name)
@@ -0,0 +1,59 @@
+import http.server
+import threading
+import time
+
+import pytest
+
+from pytoys.common import benchmark
+from pytoys.common import httpclient
+
+LATENCY = 0.2
+
+
+class _SlowHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(LATENCY)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@pytest.fixture(name="url", scope="module")
+def fixture_url():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _SlowHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrency_mode(url):
+    report = benchmark.LoadRunner([httpclient.Request(url)], concurrency=2, count=4).run()
+    assert report.status_codes == {200: 4}
+    assert not report.dropped
+
+
+def test_rate_mode_sizes_workers(url):
+    runner = benchmark.LoadRunner([httpclient.Request(url)], rate=20, count=10)
+    assert runner.concurrency == 20
+    report = runner.run()
+    assert report.status_codes == {200: 10}
+    assert not report.dropped
+
+
+def test_rate_mode_drops_late_sends(url):
+    runner = benchmark.LoadRunner([httpclient.Request(url)], concurrency=1, rate=20, count=10)
+    started = time.monotonic()
+    report = runner.run()
+    # sends are not queued behind the only worker
+    assert time.monotonic() - started < 10 * LATENCY
+    assert report.dropped > 0
+    assert report.total + report.dropped == 10
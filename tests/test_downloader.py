@@ -0,0 +1,166 @@
+import http.server
+import os
+import re
+import threading
+
+import pytest
+import requests
+
+from pytoys.common import downloader
+from pytoys.common import httpclient
+
+SIZE = 4 * downloader.MIN_SEGMENT_SIZE
+
+
+class _RangeHandler(http.server.BaseHTTPRequestHandler):
+    """Serve ``content`` with Range and If-Range
+
+    A range from ``broken_at`` is cut short, ranges are sent ``shift`` bytes later than
+    requested.
+    """
+
+    protocol_version = "HTTP/1.1"
+    content = b""
+    etag = ""
+    broken_at = None
+    shift = 0
+    ranges: list = []
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        content, etag = self.content, self.etag
+        requested = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        self.ranges.append((requested, if_range))
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", requested or "")
+        if not match or (if_range and if_range != etag):
+            self._send(200, content, {})
+            return
+        start = int(match.group(1)) + self.shift
+        end = int(match.group(2) or len(content) - 1)
+        self._send(206, content[start : end + 1],
+                   {"Content-Range": f"bytes {start}-{end}/{len(content)}"})    # fmt: skip
+
+    def _send(self, status: int, body: bytes, headers: dict):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        broken = self.broken_at is not None and status == 206 \
+            and self.headers.get("Range", "").startswith(f"bytes={self.broken_at}-")  # fmt: skip
+        if broken:
+            # the connection is lost in the middle of the segment
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class _QuietServer(http.server.ThreadingHTTPServer):
+
+    def handle_error(self, request, client_address):
+        # connections closed by stopped segments
+        pass
+
+
+def _serve(content: bytes, etag: str, broken_at=None, shift=0):
+    _RangeHandler.content = content
+    _RangeHandler.etag = etag
+    _RangeHandler.broken_at = broken_at
+    _RangeHandler.shift = shift
+    _RangeHandler.ranges = []
+
+
+@pytest.fixture(name="url", scope="module")
+def fixture_url():
+    server = _QuietServer(("127.0.0.1", 0), _RangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/file.bin"
+    server.shutdown()
+    server.server_close()
+
+
+def _kill_download(url: str, output_file: str):
+    """Download with the third segment lost, as if the download was killed"""
+    session = requests.Session()
+    resp = session.get(url, stream=True)
+    with pytest.raises(downloader.DownloadError):
+        downloader.SegmentedDownloader(session, resp, output_file, segments=4, retries=0).run()
+    session.close()
+
+
+def test_split_ranges():
+    assert downloader.split_ranges(10, 3, min_size=1) == [(0, 3), (4, 7), (8, 9)]
+    assert downloader.split_ranges(10, 3, min_size=5) == [(0, 4), (5, 9)]
+    assert downloader.split_ranges(10, 3, min_size=20) == [(0, 9)]
+
+
+def test_segmented_download(url, tmp_path):
+    content = os.urandom(SIZE)
+    _serve(content, '"v1"')
+    output_file = httpclient.get_and_save(url, output=str(tmp_path), segments=4)
+    with open(output_file, "rb") as f:
+        assert f.read() == content
+    # the first segment is read from the full response
+    size = downloader.MIN_SEGMENT_SIZE
+    assert sorted(r for r, _ in _RangeHandler.ranges if r) == [
+        f"bytes={size}-{2 * size - 1}", f"bytes={2 * size}-{3 * size - 1}",
+        f"bytes={3 * size}-{4 * size - 1}",
+    ]  # fmt: skip
+    assert not os.path.exists(f"{output_file}.part")
+    assert not os.path.exists(downloader.Journal.get_path(output_file))
+
+
+def test_resume_killed_segment(url, tmp_path):
+    content = os.urandom(SIZE)
+    output_file = str(tmp_path / "file.bin")
+    _serve(content, '"v1"', broken_at=2 * downloader.MIN_SEGMENT_SIZE)
+    _kill_download(url, output_file)
+    journal = downloader.Journal.load(output_file)
+    assert journal and journal.pending and journal.done < SIZE
+
+    _serve(content, '"v1"')
+    received = []
+    assert httpclient.get_and_save(url, output=str(tmp_path), segments=4,
+                                   on_data=received.append) == output_file  # fmt: skip
+    with open(output_file, "rb") as f:
+        assert f.read() == content
+    # only the bytes not written before are requested again
+    assert sum(received) == SIZE - journal.done
+    first = journal.pending[0]
+    assert _RangeHandler.ranges[0] == (f"bytes={first.start + first.done}-{first.end}", '"v1"')
+    assert not os.path.exists(downloader.Journal.get_path(output_file))
+
+
+def test_changed_validator_restarts(url, tmp_path):
+    output_file = str(tmp_path / "file.bin")
+    _serve(os.urandom(SIZE), '"v1"', broken_at=2 * downloader.MIN_SEGMENT_SIZE)
+    _kill_download(url, output_file)
+
+    content = os.urandom(SIZE)
+    _serve(content, '"v2"')
+    received = []
+    httpclient.get_and_save(url, output=str(tmp_path), segments=4, on_data=received.append)
+    with open(output_file, "rb") as f:
+        assert f.read() == content
+    assert sum(received) == SIZE
+
+
+def test_unexpected_content_range(url, tmp_path):
+    content = os.urandom(SIZE)
+    output_file = str(tmp_path / "file.bin")
+    _serve(content, '"v1"', broken_at=2 * downloader.MIN_SEGMENT_SIZE)
+    _kill_download(url, output_file)
+
+    # the partial response does not continue the first pending segment
+    _serve(content, '"v1"', shift=1)
+    with pytest.raises(httpclient.RequestError):
+        httpclient.get_and_save(url, output=str(tmp_path), segments=4)
+    # the download restarts next time
+    assert downloader.Journal.load(output_file) is None
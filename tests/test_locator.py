@@ -0,0 +1,115 @@
+import collections
+import http.server
+import json
+import threading
+from urllib import parse
+
+import pytest
+
+from pytoys.net import location, locator
+
+
+class _LocationApiHandler(http.server.BaseHTTPRequestHandler):
+    """Fake IP77 and UUTool api, IP77 fails if ``ip77_error`` is set"""
+
+    protocol_version = "HTTP/1.1"
+    ip77_error = ""
+    lookups: collections.Counter = collections.Counter()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        ip = parse.parse_qs(parse.urlparse(self.path).query)["ip"][0]
+        self.lookups["uutool", ip] += 1
+        self._send({"data": {"ip": ip, "country": "中国", "city": f"uutool-{ip}"}})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+        ip = parse.parse_qs(body)["ip"][0]
+        self.lookups["ip77", ip] += 1
+        if self.ip77_error:
+            self._send({"error": self.ip77_error})
+            return
+        self._send({"data": {"ip": ip, "country": "中国", "city": f"ip77-{ip}", "risk": {}}})
+
+    def _send(self, data: dict):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@pytest.fixture(name="base_url", scope="module")
+def fixture_base_url():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _LocationApiHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(name="apis")
+def fixture_apis(base_url):
+    _LocationApiHandler.ip77_error = ""
+    _LocationApiHandler.lookups = collections.Counter()
+    return [location.IP77Api(base_url=base_url), location.UUToolApi(base_url=base_url)]
+
+
+def test_read_ips():
+    lines = ["1.2.3.4 - - [01/Jan/2025] GET /", "bad 300.1.1.1", "x 10.0.0.1 1.1.1.1"]
+    assert list(locator.read_ips(lines)) == ["1.2.3.4", "10.0.0.1"]
+
+
+def test_locate_dedup(apis):
+    ips = ["1.2.3.4", "8.8.8.8", "1.2.3.4", "10.0.0.1", "8.8.8.8", "9.9.9.9"]
+    results = list(locator.BulkLocator(apis, concurrency=2).locate(ips))
+    # distinct IPs in input order, private ones are not looked up
+    assert [result.ip for result in results] == ["1.2.3.4", "8.8.8.8", "10.0.0.1", "9.9.9.9"]
+    assert [result.city for result in results] == \
+        ["ip77-1.2.3.4", "ip77-8.8.8.8", "", "ip77-9.9.9.9"]  # fmt: skip
+    assert results[2].location == "内网IP"
+    assert _LocationApiHandler.lookups == {
+        ("ip77", "1.2.3.4"): 1, ("ip77", "8.8.8.8"): 1, ("ip77", "9.9.9.9"): 1,
+    }  # fmt: skip
+
+
+def test_locate_failover(apis):
+    _LocationApiHandler.ip77_error = "quota exceeded"
+    ips = ["1.2.3.4", "8.8.8.8", "9.9.9.9"]
+    results = list(locator.BulkLocator(apis, concurrency=1).locate(ips))
+    assert [result.city for result in results] == [f"uutool-{ip}" for ip in ips]
+    # the failed backend is tried after the others
+    assert _LocationApiHandler.lookups["ip77", "1.2.3.4"] == 1
+    assert _LocationApiHandler.lookups["ip77", "8.8.8.8"] == 0
+    assert _LocationApiHandler.lookups["ip77", "9.9.9.9"] == 0
+
+
+def test_locate_all_backends_failed(base_url, apis):
+    _LocationApiHandler.ip77_error = "quota exceeded"
+    results = list(locator.BulkLocator(apis[:1]).locate(["1.2.3.4"]))
+    assert results == [location.Location(ip="1.2.3.4")]
+    with pytest.raises(locator.LocateError):
+        locator.BulkLocator([location.IP77Api(base_url=base_url)]).lookup("1.2.3.4")
+
+
+def test_locate_collapse(apis):
+    ips = ["1.2.3.4", "1.2.3.5", "1.2.4.1"]
+    results = list(locator.BulkLocator(apis, collapse=True).locate(ips))
+    # one lookup of each /24 network, the IP of each result is the IP located
+    assert [result.ip for result in results] == ips
+    assert [result.city for result in results] == ["ip77-1.2.3.4", "ip77-1.2.3.4", "ip77-1.2.4.1"]
+    assert sum(_LocationApiHandler.lookups.values()) == 2
+
+
+def test_locate_cached(apis, tmp_path):
+    location_cache = locator.LocationCache(str(tmp_path / "locations.db"))
+    ips = ["1.2.3.4", "8.8.8.8"]
+    first = list(locator.BulkLocator(apis, location_cache=location_cache).locate(ips))
+    _LocationApiHandler.lookups.clear()
+    second = list(locator.BulkLocator(apis, location_cache=location_cache).locate(ips))
+    assert second == first
+    assert not _LocationApiHandler.lookups
@@ -0,0 +1,56 @@
+import dataclasses
+import glob
+import os
+
+import pytest
+
+from pytoys.crawler.oneloume import page
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "oneloume")
+# bs4 parsers installed, lxml is optional
+PARSERS = ["html.parser"] + (["lxml"] if page.DEFAULT_PARSER == "lxml" else [])
+
+
+def _read(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _dump_list_page(media_list_page: page.MediaListPage):
+    return (
+        [dataclasses.astuple(media) for media in media_list_page.medias],
+        [dataclasses.astuple(pagination) for pagination in media_list_page.paginations],
+    )
+
+
+def test_list_page():
+    html = _read("list-0.htm")
+    media_list_page = page.MediaListPage.parse_from_html(html, parser="html.parser", strain=False)
+    # pinned posts, posts without all tags and commented out posts are skipped
+    assert [media.url for media in media_list_page.medias] == \
+        ["thread-101.htm", "thread-102.htm", "thread-104.htm"]  # fmt: skip
+    assert media_list_page.medias[1] == page.Media(
+        source="BT剧集", year="2024", location="大陆", type="悬疑",
+        name="[更新至12集] 漫长的季节 & 番外 4K 国语中字 [32.5GB]", url="thread-102.htm",
+    )  # fmt: skip
+    assert media_list_page.medias[2].name == "无间道 Infernal Affairs (2002) 720p 国粤双语 [2.1G]"
+    assert media_list_page.medias[2].size == "2.1G"
+    assert media_list_page.next_page() == "forum-1-2.htm"
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+def test_strained_list_page(parser):
+    html = _read("list-0.htm")
+    expected = page.MediaListPage.parse_from_html(html, parser="html.parser", strain=False)
+    assert _dump_list_page(page.MediaListPage.parse_from_html(html, parser=parser)) == \
+        _dump_list_page(expected)  # fmt: skip
+
+
+@pytest.mark.parametrize("parser", PARSERS + [page.REGEX_PARSER])
+def test_media_page(parser):
+    scores = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES, "media-*.htm"))):
+        media_page = page.MediaPage.parse_from_html(_read(os.path.basename(path)), parser=parser)
+        scores.append((media_page.score_imdb, media_page.score_douban))
+    # scores in comments are ignored
+    assert scores == [("8.6/10", "8.3/10"), ("8.9/10", "9.4/10"), ("", "")]
@@ -0,0 +1,82 @@
+import hashlib
+import http.server
+import json
+import threading
+from urllib import parse
+
+import pytest
+
+from pytoys.openapi import qqmap
+
+KEY, SK = "KEY", "SK"
+
+
+def _md5(text: str) -> str:
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+@pytest.mark.parametrize("path,params,raw_query,query", [
+    ("/ws/location/v1/ip", {"ip": "1.2.3.4"}, "ip=1.2.3.4&key=KEY", "ip=1.2.3.4&key=KEY"),
+    ("/ws/weather/v1", {"type": "now", "adcode": 110101},
+     "adcode=110101&key=KEY&type=now", "adcode=110101&key=KEY&type=now"),
+    ("/ws/geocoder/v1", {"location": "28.7,115.8"},
+     "key=KEY&location=28.7,115.8", "key=KEY&location=28.7%2C115.8"),
+    ("/ws/location/v1/ip", {}, "key=KEY", "key=KEY"),
+])  # fmt: skip
+def test_sign(path, params, raw_query, query):
+    # sig is md5 of the path and the raw query sorted by name, followed by SK
+    expected = f"{query}&sig={_md5(f'{path}?{raw_query}{SK}')}"
+    assert qqmap.RequestSigner(KEY, SK).sign(path, params) == expected
+    assert qqmap.RequestSigner(KEY, SK, cache_size=0).sign(path, params) == expected
+
+
+def test_sign_ignores_key_and_sig():
+    signer = qqmap.RequestSigner(KEY, SK)
+    assert signer.sign("/ws/location/v1/ip", {"ip": "1.2.3.4", "key": "x", "sig": "y"}) == \
+        signer.sign("/ws/location/v1/ip", {"ip": "1.2.3.4"})  # fmt: skip
+
+
+def test_sign_many():
+    signer = qqmap.RequestSigner(KEY, SK)
+    params_list = [{"adcode": 110101, "type": "now"}, {"adcode": 110102, "type": "now"}]
+    assert signer.sign_many("/ws/weather/v1", params_list) == \
+        [signer.sign("/ws/weather/v1", params) for params in params_list]  # fmt: skip
+
+
+class _LocationHandler(http.server.BaseHTTPRequestHandler):
+    paths: list = []
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.paths.append(self.path)
+        body = json.dumps({"status": 0, "result": {"ip": "1.2.3.4", "ad_info": {}}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@pytest.fixture(name="base_url")
+def fixture_base_url():
+    _LocationHandler.paths = []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _LocationHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_location_sends_ip_once(base_url):
+    # ip was put both in the url and in the params, and the url with ip was signed
+    api = qqmap.QQMapAPIs(key=KEY, signature=SK, base_url=base_url)
+    assert api.get_location("1.2.3.4").ip == "1.2.3.4"
+    path, query = _LocationHandler.paths[0].split("?", 1)
+    assert path == "/ws/location/v1/ip"
+    assert parse.parse_qs(query) == {
+        "ip": ["1.2.3.4"], "key": [KEY],
+        "sig": [_md5("/ws/location/v1/ip?ip=1.2.3.4&key=KEYSK")],
+    }  # fmt: skip